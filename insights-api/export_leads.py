@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import sys
+import os
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.database import AsyncSessionLocal, async_engine
+from shared.export import EXPORT_FORMATS, export_batches, get_encoder
+
+
+async def export_leads(args) -> int:
+    """Пишет выгрузку в файл порциями; при сбое печатает параметры для продолжения"""
+    encoder = get_encoder(args.format)
+    after = (args.after_created_at, args.after_id) if args.after_id else None
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    exported = 0
+    last_row = None
+
+    try:
+        output.write(encoder.header())
+        async with AsyncSessionLocal() as db:
+            async for rows in export_batches(
+                db,
+                created_after=args.since,
+                created_before=args.until,
+                after=after,
+                chunk_size=args.chunk_size
+            ):
+                output.write(encoder.encode(rows))
+                output.flush()
+                exported += len(rows)
+                last_row = rows[-1]
+        output.write(encoder.finish())
+
+    except BaseException:
+        if last_row is not None:
+            print(
+                f"Export interrupted after {exported} rows, resume with: "
+                f"--after-created-at {last_row['lead_created_at'].isoformat()} --after-id {last_row['lead_id']}",
+                file=sys.stderr
+            )
+        raise
+
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+        await async_engine.dispose()
+
+    print(f"Exported {exported} leads", file=sys.stderr)
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка лидов с последними инсайтами для BI")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output", default="-", help="файл выгрузки, по умолчанию stdout")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="лиды, созданные начиная с (ISO дата)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="лиды, созданные до (ISO дата)")
+    parser.add_argument("--after-created-at", type=datetime.fromisoformat,
+                        help="продолжить после строки с этим lead_created_at")
+    parser.add_argument("--after-id", help="продолжить после строки с этим lead_id")
+    parser.add_argument("--chunk-size", type=int, help="строк на порцию (по умолчанию EXPORT_CHUNK_SIZE)")
+
+    args = parser.parse_args()
+    if (args.after_created_at is None) != (args.after_id is None):
+        parser.error("--after-created-at and --after-id must be given together")
+
+    asyncio.run(export_leads(args))
+
+
+if __name__ == "__main__":
+    main()
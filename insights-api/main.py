@@ -5,16 +5,27 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from shared.database import init_db
+from shared.insight_events import insight_notifier
+from shared.message_queue import queue
 from routes.insights import router as insights_router
+from routes.listing import router as listing_router
+from routes.export import router as export_router
 
 app = FastAPI(title="Insights API", version="1.0.0")
 
 app.include_router(insights_router)
+app.include_router(listing_router)
+app.include_router(export_router)
 
 @app.on_event("startup")
 async def startup_event():
     init_db()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await insight_notifier.aclose()
+    await queue.aclose()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
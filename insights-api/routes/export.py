@@ -0,0 +1,51 @@
+from datetime import datetime
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from shared.database import get_async_db, closing_session
+from shared.export import MEDIA_TYPES, ExportFormatUnavailable, export_stream, get_encoder
+
+router = APIRouter(prefix="/insights", tags=["export"])
+
+@router.get("/export")
+async def export_leads(
+    format: Literal["csv", "ndjson", "parquet"] = Query("csv"),
+    created_after: Optional[datetime] = Query(None, description="Лиды, созданные начиная с (включительно)"),
+    created_before: Optional[datetime] = Query(None, description="Лиды, созданные до (исключительно)"),
+    after_created_at: Optional[datetime] = Query(None, description="lead_created_at последней полученной строки"),
+    after_id: Optional[str] = Query(None, description="lead_id последней полученной строки"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Потоковая выгрузка лидов с последними инсайтами в CSV, NDJSON или Parquet в порядке создания лидов.
+    Прерванную выгрузку можно продолжить с after_created_at и after_id последней полученной строки
+    """
+    if (after_created_at is None) != (after_id is None):
+        raise HTTPException(status_code=400, detail="after_created_at and after_id must be given together")
+    
+    try:
+        encoder = get_encoder(format)
+    except ExportFormatUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    
+    async def chunks():
+        async for chunk in export_stream(
+            db, encoder,
+            created_after=created_after,
+            created_before=created_before,
+            after=(after_created_at, after_id) if after_id is not None else None
+        ):
+            if chunk:
+                yield chunk
+    
+    return StreamingResponse(
+        closing_session(db, chunks()),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="leads_insights.{format}"'}
+    )
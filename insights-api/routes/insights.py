@@ -1,40 +1,153 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import time
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
-from shared.database import get_db, InsightDB
-from shared.models import Insight
+from shared.config import config
+from shared.database import get_async_db, closing_session, LeadDB, InsightDB
+from shared.insight_events import insight_notifier
+from shared.models import Insight, InsightBatchRequest, InsightBatchResponse
 
 router = APIRouter(prefix="/leads", tags=["insights"])
 
-@router.get("/{lead_id}/insight", response_model=Insight)
-async def get_lead_insight(lead_id: str, db: Session = Depends(get_db)):
-    """Получает последний инсайт для лида"""
-    
-    insight_db = (
-        db.query(InsightDB)
-        .filter(InsightDB.lead_id == lead_id)
-        .order_by(InsightDB.created_at.desc())
-        .first()
+async def find_latest_insight(db: AsyncSession, lead_id: str) -> Optional[InsightDB]:
+    """
+    Последний инсайт лида: поиск по первичным ключам через leads.latest_insight_id.
+    Если указатель не заполнен (инсайт записан в обход воркера), идет по ix_insights_lead_created
+    """
+    insight_db = await db.scalar(
+        select(InsightDB)
+        .join(LeadDB, LeadDB.latest_insight_id == InsightDB.id)
+        .where(LeadDB.id == lead_id)
+    )
+    if insight_db:
+        return insight_db
+    
+    return await db.scalar(
+        select(InsightDB)
+        .where(InsightDB.lead_id == lead_id)
+        .order_by(InsightDB.created_at.desc(), InsightDB.id.desc())
+        .limit(1)
+    )
+
+async def find_latest_insights(db: AsyncSession, lead_ids: List[str]) -> Dict[str, InsightDB]:
+    """
+    Последние инсайты пачки лидов: сначала по указателям leads.latest_insight_id,
+    для остальных одним запросом ROW_NUMBER() по лиду вместо запроса на каждый лид
+    """
+    latest = {
+        insight_db.lead_id: insight_db
+        for insight_db in await db.scalars(
+            select(InsightDB)
+            .join(LeadDB, LeadDB.latest_insight_id == InsightDB.id)
+            .where(LeadDB.id.in_(lead_ids))
+        )
+    }
+    missing = [lead_id for lead_id in lead_ids if lead_id not in latest]
+    if not missing:
+        return latest
+    
+    ranked = (
+        select(
+            InsightDB.id,
+            func.row_number().over(
+                partition_by=InsightDB.lead_id,
+                order_by=(InsightDB.created_at.desc(), InsightDB.id.desc())
+            ).label("rank")
+        )
+        .where(InsightDB.lead_id.in_(missing))
+        .subquery()
+    )
+    rows = await db.scalars(
+        select(InsightDB).join(ranked, InsightDB.id == ranked.c.id).where(ranked.c.rank == 1)
     )
+    latest.update({insight_db.lead_id: insight_db for insight_db in rows})
+    return latest
+
+async def wait_for_insight(db: AsyncSession, lead_id: str, timeout: float) -> Optional[InsightDB]:
+    """
+    Ждет инсайт лида не дольше timeout. База перечитывается только после уведомления воркера
+    (или раз в INSIGHT_WAIT_POLL_INTERVAL, если pub/sub недоступен).
+    На время ожидания сессия закрывается и соединение возвращается в пул, иначе ожидающие запросы
+    займут весь пул и остальные запросы к API будут ждать свободного соединения
+    """
+    deadline = time.monotonic() + timeout
+    async with insight_notifier.subscribe(lead_id) as ready:
+        while True:
+            insight_db = await find_latest_insight(db, lead_id)
+            remaining = deadline - time.monotonic()
+            if insight_db or remaining <= 0:
+                return insight_db
+            await db.close()
+            await insight_notifier.wait(ready, remaining)
+
+@router.post("/insights/batch", response_model=InsightBatchResponse)
+async def get_leads_insights(batch_request: InsightBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """Получает последние инсайты для пачки лидов (до INSIGHT_BATCH_MAX_SIZE) одним запросом к базе"""
+    
+    lead_ids = list(dict.fromkeys(batch_request.lead_ids))
+    if len(lead_ids) > config.INSIGHT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch size exceeds {config.INSIGHT_BATCH_MAX_SIZE} lead ids")
+    
+    latest = await find_latest_insights(db, lead_ids)
+    
+    return InsightBatchResponse(insights={
+        lead_id: Insight.from_db(latest[lead_id]) if lead_id in latest else None
+        for lead_id in lead_ids
+    })
+
+@router.get("/{lead_id}/insight", response_model=Insight)
+async def get_lead_insight(
+    lead_id: str,
+    wait: float = Query(0, ge=0, description="Сколько секунд ждать появления инсайта (long-poll)"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Получает последний инсайт для лида; с ?wait=<секунды> ждет его появления"""
+    
+    if wait > 0:
+        insight_db = await wait_for_insight(db, lead_id, min(wait, config.INSIGHT_MAX_WAIT))
+    else:
+        insight_db = await find_latest_insight(db, lead_id)
     
     if not insight_db:
         raise HTTPException(status_code=404, detail="Insight not found")
     
-    tags = insight_db.tags.split(",") if insight_db.tags else []
-    
-    insight = Insight(
-        id=insight_db.id,
-        lead_id=insight_db.lead_id,
-        intent=insight_db.intent,
-        priority=insight_db.priority,
-        next_action=insight_db.next_action,
-        confidence=insight_db.confidence,
-        tags=tags,
-        created_at=insight_db.created_at
-    )
+    return Insight.from_db(insight_db)
+
+@router.get("/{lead_id}/insight/stream")
+async def stream_lead_insight(
+    lead_id: str,
+    timeout: Optional[float] = Query(None, gt=0, description="Сколько секунд держать поток открытым"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Server-Sent Events: отправляет событие insight, как только инсайт лида готов, и закрывает поток.
+    Если инсайт не появился за timeout, отправляется событие timeout
+    """
+    timeout = min(timeout or config.INSIGHT_STREAM_TIMEOUT, config.INSIGHT_STREAM_TIMEOUT)
     
-    return insight
\ No newline at end of file
+    async def events():
+        deadline = time.monotonic() + timeout
+        while True:
+            # Периодический комментарий не дает прокси закрыть простаивающее соединение
+            window = min(config.INSIGHT_STREAM_KEEPALIVE, deadline - time.monotonic())
+            insight_db = await wait_for_insight(db, lead_id, max(window, 0))
+            if insight_db:
+                yield f"event: insight\ndata: {Insight.from_db(insight_db).model_dump_json()}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            yield ": keepalive\n\n"
+    
+    return StreamingResponse(
+        closing_session(db, events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Annotated, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from shared.config import config
+from shared.database import get_async_db, TriageRollupDB
+from shared.insight_query import InvalidCursor, decode_cursor, encode_cursor, insight_query
+from shared.models import Insight, InsightPage, InsightPageQuery, TriageStatsBucket, TriageStatsResponse
+
+router = APIRouter(prefix="/insights", tags=["insights"])
+
+STATS_DIMENSIONS = ("intent", "priority", "next_action", "source")
+
+@router.get("", response_model=InsightPage)
+async def list_insights(
+    params: Annotated[InsightPageQuery, Query()],
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Список инсайтов по фильтрам от новых к старым с постраничным обходом по курсору.
+    Повторяющийся параметр tag отбирает инсайты со всеми перечисленными тегами
+    """
+    
+    limit = min(params.limit or config.INSIGHT_PAGE_SIZE, config.INSIGHT_PAGE_MAX_SIZE)
+    try:
+        after = decode_cursor(params.cursor) if params.cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = list(await db.scalars(insight_query(params, after).limit(limit + 1)))
+    page = rows[:limit]
+    
+    return InsightPage(
+        items=[Insight.from_db(insight_db) for insight_db in page],
+        next_cursor=encode_cursor(page[-1]) if len(rows) > limit else None
+    )
+
+@router.get("/stats", response_model=TriageStatsResponse)
+async def get_triage_stats(
+    granularity: Literal["hour", "day"] = Query("hour"),
+    since: Optional[datetime] = Query(None, description="Первый интервал (включительно)"),
+    until: Optional[datetime] = Query(None, description="Конец периода (исключительно)"),
+    group_by: List[Literal["intent", "priority", "next_action", "source"]] = Query([]),
+    intent: Optional[str] = None,
+    priority: Optional[str] = None,
+    next_action: Optional[str] = None,
+    source: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Число инсайтов по интервалам с разбивкой по group_by. Читает только роллапы triage_rollups,
+    поэтому стоимость запроса зависит от числа интервалов, а не от числа инсайтов
+    """
+    dimensions = [dimension for dimension in STATS_DIMENSIONS if dimension in group_by]
+    columns = [getattr(TriageRollupDB, dimension) for dimension in dimensions]
+    
+    query = (
+        select(TriageRollupDB.bucket_start, *columns, func.sum(TriageRollupDB.count).label("count"))
+        .where(TriageRollupDB.granularity == granularity)
+        .group_by(TriageRollupDB.bucket_start, *columns)
+        .order_by(TriageRollupDB.bucket_start, *columns)
+    )
+    if since is not None:
+        query = query.where(TriageRollupDB.bucket_start >= since)
+    if until is not None:
+        query = query.where(TriageRollupDB.bucket_start < until)
+    for dimension, value in (("intent", intent), ("priority", priority), ("next_action", next_action), ("source", source)):
+        if value is not None:
+            query = query.where(getattr(TriageRollupDB, dimension) == value)
+    
+    rows = await db.execute(query)
+    return TriageStatsResponse(
+        granularity=granularity,
+        buckets=[
+            TriageStatsBucket(
+                bucket_start=row.bucket_start,
+                count=row.count,
+                # Лиды без источника хранятся в роллапах с пустой строкой
+                **{dimension: getattr(row, dimension) or None for dimension in dimensions}
+            )
+            for row in rows
+        ]
+    )
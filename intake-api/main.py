@@ -5,7 +5,11 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from shared.database import init_db
+from shared.idempotency import idempotency_cache, idempotency_flights
+from shared.llm import adapter_stats
+from shared.message_queue import queue
 from routes.leads import router as leads_router
+from services.triage_service import get_inline_adapter
 
 app = FastAPI(title="Lead Intake API", version="1.0.0")
 
@@ -15,11 +19,24 @@ app.include_router(leads_router)
 async def startup_event():
     init_db()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await queue.aclose()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Счетчики кеша ключей идемпотентности, схлопывания одновременных запросов и кеша inline triage"""
+    return {
+        "idempotency_cache": idempotency_cache.stats(),
+        "idempotency_flights": idempotency_flights.stats(),
+        "triage_cache": adapter_stats(get_inline_adapter()).get("triage_cache"),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,45 @@
+import asyncio
+import signal
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.database import init_db
+from shared.idempotency import IdempotencyKeyExpiry
+from shared.message_queue import queue
+from shared.outbox import OutboxRelay
+
+
+async def main():
+    """
+    Фоновые задачи intake-api: публикует события из outbox в Redis Stream
+    и удаляет просроченные ключи идемпотентности
+    """
+
+    init_db()
+
+    relay = OutboxRelay()
+    expiry = IdempotencyKeyExpiry()
+
+    def stop():
+        relay.stop()
+        expiry.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except NotImplementedError:
+            pass
+
+    try:
+        await asyncio.gather(relay.run(), expiry.run())
+    finally:
+        await queue.aclose()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Outbox relay stopped")
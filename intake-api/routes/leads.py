@@ -1,33 +1,100 @@
-from fastapi import APIRouter, Depends, Header, Response
-from sqlalchemy.orm import Session
+from typing import Literal, Optional, Union
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
+import json
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
-from shared.database import get_db
-from shared.models import LeadRequest, Lead
-from services.lead_service import LeadService
+from shared.config import config
+from shared.database import get_async_db, closing_session
+from shared.models import LeadRequest, Lead, LeadWithInsight, LeadBatchRequest, LeadBatchResponse
+from services.lead_service import LeadService, NDJSONLineTooLong
+from services.triage_service import TriageService
 
 router = APIRouter(prefix="/leads", tags=["leads"])
 
-@router.post("", response_model=Lead)
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ, который отдается, пока еще читается тело запроса.
+    Стандартный StreamingResponse параллельно ждет http.disconnect и забирает у генератора
+    сообщения с телом запроса; обрыв соединения здесь обнаруживает чтение тела (ClientDisconnect)
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@router.post("", response_model=Union[LeadWithInsight, Lead])
 async def create_lead(
     lead_request: LeadRequest,
     response: Response,
     idempotency_key: str = Header(..., alias="Idempotency-Key"),
-    db: Session = Depends(get_db)
+    triage: Optional[Literal["inline"]] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Создает новый лид с идемпотентностью"""
+    """
+    Создает новый лид с идемпотентностью.
+    С ?triage=inline лид сразу анализируется в пределах INLINE_TRIAGE_BUDGET и возвращается вместе с инсайтом
+    """
     lead_service = LeadService(db)
     lead, status_code = await lead_service.create_lead(lead_request, idempotency_key)
     
     response.status_code = status_code
     
+    if triage == "inline":
+        insight = await TriageService(db).triage_inline(lead)
+        return LeadWithInsight(**lead.model_dump(), insight=insight)
+    
     return lead
 
+@router.post("/batch", response_model=LeadBatchResponse)
+async def create_leads_batch(
+    batch_request: LeadBatchRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Создает пачку лидов одной транзакцией.
+    Ключ элемента берется из его поля idempotency_key, иначе выводится из ключа пачки как "<ключ>:<индекс>"
+    """
+    if len(batch_request.items) > config.LEAD_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch size exceeds {config.LEAD_BATCH_MAX_SIZE} items")
+
+    lead_service = LeadService(db)
+    results = await lead_service.create_leads(batch_request.items, idempotency_key)
+
+    return LeadBatchResponse(results=results)
+
+@router.post("/stream")
+async def import_leads_stream(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Потоковый импорт лидов из NDJSON тела запроса произвольного размера.
+    Лиды фиксируются пачками по LEAD_STREAM_CHUNK_SIZE, результаты по строкам
+    возвращаются NDJSON потоком по мере обработки
+    """
+    lead_service = LeadService(db)
+
+    async def results():
+        try:
+            async for result in lead_service.import_ndjson(request.stream(), idempotency_key):
+                yield result.model_dump_json() + "\n"
+        except NDJSONLineTooLong as e:
+            # Статус ответа уже отправлен, поэтому ошибка сообщается последней строкой потока
+            yield json.dumps({"status_code": 413, "error": str(e)}) + "\n"
+
+    return NDJSONStreamingResponse(closing_session(db, results()))
+
 @router.get("/{lead_id}", response_model=Lead)
-async def get_lead(lead_id: str, db: Session = Depends(get_db)):
+async def get_lead(lead_id: str, db: AsyncSession = Depends(get_async_db)):
     """Получает лид по ID"""
     lead_service = LeadService(db)
     return await lead_service.get_lead(lead_id)
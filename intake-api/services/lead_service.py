@@ -1,54 +1,297 @@
 import json
 import uuid
 from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import HTTPException, Response
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
+from shared.config import config
 from shared.database import LeadDB, IdempotencyKeyDB
-from shared.models import LeadRequest, Lead, QueueEvent
-from shared.message_queue import queue
-from shared.utils import generate_content_hash
+from shared.idempotency import IdempotencyCache, SingleFlight, idempotency_cache, idempotency_flights
+from shared.models import LeadRequest, Lead, QueueEvent, LeadBatchItemResult
+from shared.outbox import add_outbox_events
+from shared.utils import generate_content_hash, generate_request_fingerprint
+
+# Ограничение на число ключей в одном IN (...), чтобы не упереться в лимит параметров SQLite
+KEY_LOOKUP_CHUNK = 500
+
+class NDJSONLineTooLong(ValueError):
+    """Строка NDJSON превышает допустимый размер"""
+
+
+async def iter_ndjson_lines(stream: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Tuple[int, bytes]]:
+    """Разбивает поток байтов на непустые строки, не накапливая больше одной строки в памяти"""
+    buffer = b""
+    index = 0
+
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            # Чанк может целиком содержать длинную строку, поэтому проверяется каждая строка, а не только хвост
+            if len(line) > max_line_bytes:
+                raise NDJSONLineTooLong(f"Line {index} exceeds {max_line_bytes} bytes")
+            if line.strip():
+                yield index, line
+            index += 1
+
+        if len(buffer) > max_line_bytes:
+            raise NDJSONLineTooLong(f"Line {index} exceeds {max_line_bytes} bytes")
+
+    if buffer.strip():
+        yield index, buffer
+
 
 class LeadService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession, cache: Optional[IdempotencyCache] = None,
+                 flights: Optional[SingleFlight] = None):
         self.db = db
+        self.cache = cache if cache is not None else idempotency_cache
+        self.flights = flights if flights is not None else idempotency_flights
 
     async def create_lead(self, lead_request: LeadRequest, idempotency_key: str) -> tuple[Lead, int]:
         """
         Создает лид с проверкой идемпотентности
         Возвращает: (Lead, status_code)
         """
-        
+
         print(f"Processing request with idempotency key: {idempotency_key}")
-        
-        existing_key = self.db.query(IdempotencyKeyDB).filter(
-            IdempotencyKeyDB.key == idempotency_key
-        ).first()
-        
-        if existing_key:
-            print(f"Found existing idempotency key: {idempotency_key}")
+
+        fingerprint = generate_request_fingerprint(lead_request.model_dump())
+
+        # Одновременные запросы с одним ключом ждут первый из них, а не вставляют лид параллельно
+        stored_record = await self.cache.get(idempotency_key)
+        if stored_record is None:
+            stored_record, created = await self.flights.run(
+                idempotency_key,
+                lambda: self._load_key(idempotency_key),
+                lambda: self._insert_lead(lead_request, idempotency_key, fingerprint)
+            )
+            if created:
+                return Lead(**stored_record["lead"]), 201
+
+        print(f"Found existing idempotency key: {idempotency_key}")
+        return self._replay(stored_record, fingerprint)
+
+    async def create_leads(
+        self,
+        items: List[Any],
+        batch_key: Optional[str] = None,
+        indices: Optional[List[int]] = None
+    ) -> List[LeadBatchItemResult]:
+        """
+        Создает пачку лидов: ключи идемпотентности проверяются одним запросом,
+        все новые лиды, ключи и события outbox фиксируются одной транзакцией.
+        indices задает номера элементов в исходном потоке (по умолчанию позиции в items).
+        Возвращает результат по каждому элементу в исходном порядке
+        """
+
+        indices = indices if indices is not None else list(range(len(items)))
+        results: List[Optional[LeadBatchItemResult]] = [None] * len(items)
+        pending: List[Tuple[int, int, LeadRequest, str, str]] = []
+
+        for position, (index, item) in enumerate(zip(indices, items)):
+            if not isinstance(item, dict):
+                results[position] = LeadBatchItemResult(index=index, status_code=422, error="Item must be a JSON object")
+                continue
+
+            idempotency_key = item.get("idempotency_key") or (f"{batch_key}:{index}" if batch_key else None)
+            if not idempotency_key:
+                results[position] = LeadBatchItemResult(index=index, status_code=400, error="Idempotency key required")
+                continue
+
             try:
-                stored_data = json.loads(existing_key.response_data)
-                stored_request = stored_data["request"]
-                current_request = lead_request.model_dump()
-                
-                if stored_request == current_request:
-                    print("Request matches - returning cached response with 200")
-                    return Lead(**stored_data["lead"]), 200  
+                lead_request = LeadRequest.model_validate({k: v for k, v in item.items() if k != "idempotency_key"})
+            except ValidationError as e:
+                results[position] = LeadBatchItemResult(
+                    index=index, status_code=422, idempotency_key=idempotency_key,
+                    error=str(e.errors(include_url=False))
+                )
+                continue
+
+            fingerprint = generate_request_fingerprint(lead_request.model_dump())
+            pending.append((position, index, lead_request, idempotency_key, fingerprint))
+
+        existing_keys = await self._load_keys([key for _, _, _, key, _ in pending])
+
+        # Повтор ключа внутри пачки обрабатывается как повторный запрос к первому вхождению
+        new_records: Dict[str, Dict[str, Any]] = {}
+        new_items = []
+
+        for position, index, lead_request, idempotency_key, fingerprint in pending:
+            try:
+                if idempotency_key in existing_keys:
+                    lead, status_code = self._replay(existing_keys[idempotency_key], fingerprint)
+                elif idempotency_key in new_records:
+                    lead, status_code = self._replay(new_records[idempotency_key], fingerprint)
                 else:
-                    print("Request differs - conflict!")
-                    raise HTTPException(status_code=409, detail="Idempotency key conflict")
-            except (json.JSONDecodeError, KeyError) as e:
-                print(f"Error parsing stored data: {e}")
-                raise HTTPException(status_code=500, detail="Invalid stored idempotency data")
-        
+                    lead, new_records[idempotency_key] = self._add_lead(lead_request, idempotency_key, fingerprint)
+                    status_code = 201
+                    new_items.append((position, index, lead_request, idempotency_key))
+            except HTTPException as e:
+                results[position] = LeadBatchItemResult(
+                    index=index, status_code=e.status_code, idempotency_key=idempotency_key, error=e.detail
+                )
+                continue
+
+            results[position] = LeadBatchItemResult(
+                index=index, status_code=status_code, idempotency_key=idempotency_key, lead=lead
+            )
+
+        if new_items:
+            try:
+                await self.db.commit()
+                await self.cache.set_many(new_records)
+                print(f"Successfully created {len(new_items)} leads in batch")
+            except IntegrityError as e:
+                # Ключ успели занять параллельным запросом: повторяем новые элементы поштучно
+                await self.db.rollback()
+                print(f"Integrity error in batch, falling back to single inserts: {e}")
+                for position, index, lead_request, idempotency_key in new_items:
+                    results[position] = await self._create_single(index, lead_request, idempotency_key)
+
+        return results
+
+    async def import_ndjson(
+        self,
+        stream: AsyncIterator[bytes],
+        batch_key: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        max_line_bytes: Optional[int] = None
+    ) -> AsyncIterator[LeadBatchItemResult]:
+        """
+        Импортирует лиды из NDJSON потока: строки разбираются по мере поступления
+        и фиксируются пачками по chunk_size, результаты отдаются сразу после каждой пачки.
+        Номер элемента в результате совпадает с номером строки (с нуля), пустые строки пропускаются
+        """
+        chunk_size = chunk_size or config.LEAD_STREAM_CHUNK_SIZE
+
+        items, indices = [], []
+        try:
+            async for index, line in iter_ndjson_lines(stream, max_line_bytes or config.LEAD_STREAM_MAX_LINE_BYTES):
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+                indices.append(index)
+
+                if len(items) >= chunk_size:
+                    for result in await self._import_chunk(items, indices, batch_key):
+                        yield result
+                    items, indices = [], []
+        except NDJSONLineTooLong:
+            # Строки до ошибки все равно сохраняем
+            if items:
+                for result in await self._import_chunk(items, indices, batch_key):
+                    yield result
+            raise
+
+        if items:
+            for result in await self._import_chunk(items, indices, batch_key):
+                yield result
+
+    async def _import_chunk(self, items: List[Any], indices: List[int], batch_key: Optional[str]) -> List[LeadBatchItemResult]:
+        results = await self.create_leads(items, batch_key, indices)
+        # Не держим в сессии объекты уже зафиксированных пачек
+        self.db.expunge_all()
+        return results
+
+    async def get_lead(self, lead_id: str) -> Lead:
+        """Получает лид по ID"""
+        lead_db = await self.db.get(LeadDB, lead_id)
+
+        if not lead_db:
+            raise HTTPException(status_code=404, detail="Lead not found")
+
+        return Lead.model_validate(lead_db)
+
+    async def _insert_lead(self, lead_request: LeadRequest, idempotency_key: str, fingerprint: str) -> Tuple[Dict[str, Any], bool]:
+        """Сохраняет новый лид; если ключ успел сохранить другой процесс, возвращает его запись"""
         print("Creating new lead...")
-        
+
+        try:
+            lead_response, stored_record = self._add_lead(lead_request, idempotency_key, fingerprint)
+            await self.db.commit()
+        except IntegrityError as e:
+            await self.db.rollback()
+            print(f"Integrity error: {e}")
+            stored_record = await self._load_key(idempotency_key)
+            if stored_record is None:
+                raise HTTPException(status_code=400, detail="Failed to create lead")
+            return stored_record, False
+        except Exception as e:
+            await self.db.rollback()
+            print(f"Unexpected error: {e}")
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+        await self.cache.set(idempotency_key, stored_record)
+        print(f"Successfully created lead {lead_response.id}")
+        return stored_record, True
+
+    async def _create_single(self, index: int, lead_request: LeadRequest, idempotency_key: str) -> LeadBatchItemResult:
+        try:
+            lead, status_code = await self.create_lead(lead_request, idempotency_key)
+        except HTTPException as e:
+            return LeadBatchItemResult(index=index, status_code=e.status_code, idempotency_key=idempotency_key, error=e.detail)
+        return LeadBatchItemResult(index=index, status_code=status_code, idempotency_key=idempotency_key, lead=lead)
+
+    async def _load_key(self, key: str) -> Optional[Dict[str, Any]]:
+        """Запись ключа из базы, минуя кеш"""
+        return (await self._fetch_keys([key])).get(key)
+
+    async def _load_keys(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Записи ключей в виде {"request_fingerprint", "lead"}: сначала из кеша, оставшиеся из базы"""
+        unique_keys = list(dict.fromkeys(keys))
+        found = await self.cache.get_many(unique_keys)
+        found.update(await self._fetch_keys([key for key in unique_keys if key not in found]))
+        return found
+
+    async def _fetch_keys(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Загружает ключи вместе с лидами одним запросом на пачку ключей и кладет их в кеш"""
+        loaded = {}
+        for i in range(0, len(keys), KEY_LOOKUP_CHUNK):
+            rows = await self.db.execute(
+                select(IdempotencyKeyDB.key, IdempotencyKeyDB.request_fingerprint, LeadDB)
+                .outerjoin(LeadDB, LeadDB.id == IdempotencyKeyDB.lead_id)
+                .where(IdempotencyKeyDB.key.in_(keys[i:i + KEY_LOOKUP_CHUNK]))
+            )
+            for key, fingerprint, lead_db in rows:
+                if lead_db is None:
+                    print(f"Lead for idempotency key {key} not found")
+                    raise HTTPException(status_code=500, detail="Invalid stored idempotency data")
+                loaded[key] = self._record(fingerprint, Lead.model_validate(lead_db))
+
+        await self.cache.set_many(loaded)
+        return loaded
+
+    def _record(self, fingerprint: str, lead: Lead) -> Dict[str, Any]:
+        return {"request_fingerprint": fingerprint, "lead": lead.model_dump()}
+
+    def _replay(self, stored_record: Dict[str, Any], fingerprint: str) -> tuple[Lead, int]:
+        """Ответ на повторный запрос: сохраненный лид при совпадении отпечатка запроса, иначе конфликт"""
+        try:
+            if stored_record["request_fingerprint"] == fingerprint:
+                print("Request matches - returning cached response with 200")
+                return Lead(**stored_record["lead"]), 200
+            else:
+                print("Request differs - conflict!")
+                raise HTTPException(status_code=409, detail="Idempotency key conflict")
+        except KeyError as e:
+            print(f"Error parsing stored data: {e}")
+            raise HTTPException(status_code=500, detail="Invalid stored idempotency data")
+
+    def _add_lead(self, lead_request: LeadRequest, idempotency_key: str, fingerprint: str) -> Tuple[Lead, Dict[str, Any]]:
+        """
+        Добавляет в сессию лид, ключ идемпотентности и событие outbox; фиксирует вызывающий.
+        Возвращает лид и запись ключа для кеша
+        """
         lead_id = str(uuid.uuid4())
         lead_db = LeadDB(
             id=lead_id,
@@ -59,56 +302,28 @@ class LeadService:
             source=lead_request.source,
             created_at=datetime.utcnow()
         )
-        
-        try:
-            self.db.add(lead_db)
-            self.db.flush()  
-            
-            lead_response = Lead.model_validate(lead_db)
-            
-            response_data = {
-                "request": lead_request.model_dump(),
-                "lead": lead_response.model_dump()
-            }
-            
-            idempotency_record = IdempotencyKeyDB(
-                key=idempotency_key,
-                response_data=json.dumps(response_data, default=str),
-                created_at=datetime.utcnow()
-            )
-            self.db.add(idempotency_record)
-            
-            content_hash = generate_content_hash(lead_request.note)
-            event = QueueEvent(
-                event_id=str(uuid.uuid4()),
-                type="lead.created",
-                lead_id=lead_id,
-                content_hash=content_hash,
-                occurred_at=datetime.utcnow()
-            )
-            
-            await queue.publish_event(event)
-            print(f"Published event for lead {lead_id}")
-            
-            self.db.commit()
-            print(f"Successfully created lead {lead_id}")
-            
-            return lead_response, 201  
-            
-        except IntegrityError as e:
-            self.db.rollback()
-            print(f"Integrity error: {e}")
-            raise HTTPException(status_code=400, detail="Failed to create lead")
-        except Exception as e:
-            self.db.rollback()
-            print(f"Unexpected error: {e}")
-            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+        self.db.add(lead_db)
 
-    async def get_lead(self, lead_id: str) -> Lead:
-        """Получает лид по ID"""
-        lead_db = self.db.query(LeadDB).filter(LeadDB.id == lead_id).first()
-        
-        if not lead_db:
-            raise HTTPException(status_code=404, detail="Lead not found")
-        
-        return Lead.model_validate(lead_db)
\ No newline at end of file
+        lead_response = Lead.model_validate(lead_db)
+
+        idempotency_record = IdempotencyKeyDB(
+            key=idempotency_key,
+            request_fingerprint=fingerprint,
+            lead_id=lead_id,
+            created_at=datetime.utcnow()
+        )
+        self.db.add(idempotency_record)
+
+        content_hash = generate_content_hash(lead_request.note)
+        event = QueueEvent(
+            event_id=str(uuid.uuid4()),
+            type="lead.created",
+            lead_id=lead_id,
+            content_hash=content_hash,
+            occurred_at=datetime.utcnow()
+        )
+
+        # Событие фиксируется в outbox той же транзакцией, в Redis его доставит OutboxRelay
+        add_outbox_events(self.db, [event])
+
+        return lead_response, self._record(fingerprint, lead_response)
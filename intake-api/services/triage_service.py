@@ -0,0 +1,83 @@
+import asyncio
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from shared.config import config
+from shared.database import InsightDB, latest_insight_update
+from shared.llm import HedgedLLMAdapter, LLMAdapter, get_llm_adapter
+from shared.message_queue import queue
+from shared.models import Lead, Insight
+from shared.rollups import count_buckets, rollup_increment
+from shared.utils import generate_content_hash
+
+_llm_adapter: Optional[LLMAdapter] = None
+
+def get_inline_adapter() -> LLMAdapter:
+    """Адаптер создается один раз на процесс, чтобы кеш и пул соединений переиспользовались"""
+    global _llm_adapter
+    if _llm_adapter is None:
+        _llm_adapter = get_llm_adapter()
+    return _llm_adapter
+
+class TriageService:
+    def __init__(self, db: AsyncSession, llm_adapter: Optional[LLMAdapter] = None):
+        self.db = db
+        self.llm_adapter = llm_adapter or get_inline_adapter()
+
+    async def triage_inline(self, lead: Lead, budget: Optional[float] = None) -> Optional[Insight]:
+        """
+        Анализирует лид в процессе API в пределах бюджета времени и сохраняет инсайт
+        с тем же content_hash, что и событие в очереди, поэтому воркер его пропустит.
+        Возвращает None, если анализ не уложился в бюджет или завершился ошибкой: инсайт создаст воркер
+        """
+        budget = budget if budget is not None else config.INLINE_TRIAGE_BUDGET
+        content_hash = generate_content_hash(lead.note)
+
+        existing = await self._find_insight(lead.id, content_hash)
+        if existing:
+            return Insight.from_db(existing)
+
+        context = {"content_hash": content_hash}
+        if isinstance(self.llm_adapter, HedgedLLMAdapter):
+            # Хедж получает бюджет запроса, чтобы запасной адаптер успел ответить до его истечения
+            triage = self.llm_adapter.triage(lead.note, context, budget=budget)
+        else:
+            triage = asyncio.wait_for(self.llm_adapter.triage(lead.note, context), budget)
+
+        try:
+            insight_payload = await triage
+        except asyncio.TimeoutError:
+            print(f"Inline triage for lead {lead.id} exceeded {budget}s budget, leaving it to the worker")
+            return None
+        except Exception as e:
+            print(f"Inline triage for lead {lead.id} failed, leaving it to the worker: {e}")
+            return None
+
+        insight_db = InsightDB.from_payload(lead.id, content_hash, insight_payload)
+        try:
+            self.db.add(insight_db)
+            await self.db.execute(latest_insight_update(insight_db))
+            await self.db.execute(rollup_increment(
+                count_buckets([(insight_db, lead.source)]), self.db.bind.dialect.name
+            ))
+            await self.db.commit()
+        except IntegrityError:
+            # Воркер успел сохранить инсайт раньше
+            await self.db.rollback()
+            insight_db = await self._find_insight(lead.id, content_hash)
+            return Insight.from_db(insight_db) if insight_db else None
+
+        print(f"Created inline insight {insight_db.id} for lead {lead.id}")
+        await queue.notify_insights_ready_async([lead.id])
+        return Insight.from_db(insight_db)
+
+    async def _find_insight(self, lead_id: str, content_hash: str) -> Optional[InsightDB]:
+        return await self.db.scalar(
+            select(InsightDB).where(InsightDB.lead_id == lead_id, InsightDB.content_hash == content_hash)
+        )
@@ -9,7 +9,67 @@ class Config:
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
     QUEUE_STREAM_NAME = os.getenv("QUEUE_STREAM_NAME", "lead_events")
     CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "triage_workers")
+    DEAD_LETTER_STREAM_NAME = os.getenv("DEAD_LETTER_STREAM_NAME", f"{QUEUE_STREAM_NAME}:dead")
+    INSIGHT_CHANNEL = os.getenv("INSIGHT_CHANNEL", "insights_ready")
+    
+    IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+    IDEMPOTENCY_EXPIRY_BATCH_SIZE = int(os.getenv("IDEMPOTENCY_EXPIRY_BATCH_SIZE", "1000"))
+    IDEMPOTENCY_EXPIRY_INTERVAL = float(os.getenv("IDEMPOTENCY_EXPIRY_INTERVAL", "60"))
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "600"))
+    IDEMPOTENCY_CACHE_REDIS = os.getenv("IDEMPOTENCY_CACHE_REDIS", "false").lower() == "true"
+    IDEMPOTENCY_LOCK_REDIS = os.getenv("IDEMPOTENCY_LOCK_REDIS", "false").lower() == "true"
+    IDEMPOTENCY_LOCK_TTL = float(os.getenv("IDEMPOTENCY_LOCK_TTL", "5"))
+    IDEMPOTENCY_LOCK_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_LOCK_POLL_INTERVAL", "0.02"))
+    
+    INSIGHT_BATCH_MAX_SIZE = int(os.getenv("INSIGHT_BATCH_MAX_SIZE", "500"))
+    INSIGHT_MAX_WAIT = float(os.getenv("INSIGHT_MAX_WAIT", "30"))
+    INSIGHT_WAIT_POLL_INTERVAL = float(os.getenv("INSIGHT_WAIT_POLL_INTERVAL", "1"))
+    INSIGHT_STREAM_TIMEOUT = float(os.getenv("INSIGHT_STREAM_TIMEOUT", "60"))
+    INSIGHT_STREAM_KEEPALIVE = float(os.getenv("INSIGHT_STREAM_KEEPALIVE", "15"))
+    INSIGHT_PAGE_SIZE = int(os.getenv("INSIGHT_PAGE_SIZE", "50"))
+    INSIGHT_PAGE_MAX_SIZE = int(os.getenv("INSIGHT_PAGE_MAX_SIZE", "500"))
+    EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+    
+    INLINE_TRIAGE_BUDGET = float(os.getenv("INLINE_TRIAGE_BUDGET", "1.5"))
+    
+    LEAD_BATCH_MAX_SIZE = int(os.getenv("LEAD_BATCH_MAX_SIZE", "10000"))
+    LEAD_STREAM_CHUNK_SIZE = int(os.getenv("LEAD_STREAM_CHUNK_SIZE", "500"))
+    LEAD_STREAM_MAX_LINE_BYTES = int(os.getenv("LEAD_STREAM_MAX_LINE_BYTES", "1048576"))
+    
+    OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+    OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.1"))
+    OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", "3600"))
+    OUTBOX_CLEANUP_INTERVAL = float(os.getenv("OUTBOX_CLEANUP_INTERVAL", "60"))
+    
+    WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "1"))
+    WORKER_BATCH_MAX_WAIT_MS = int(os.getenv("WORKER_BATCH_MAX_WAIT_MS", "50"))
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+    WORKER_IO_THREADS = int(os.getenv("WORKER_IO_THREADS", "8"))
+    WORKER_RECLAIM_INTERVAL = float(os.getenv("WORKER_RECLAIM_INTERVAL", "5"))
+    WORKER_RECLAIM_COUNT = int(os.getenv("WORKER_RECLAIM_COUNT", "100"))
+    WORKER_RETRY_BASE_MS = int(os.getenv("WORKER_RETRY_BASE_MS", "10000"))
+    WORKER_RETRY_MAX_MS = int(os.getenv("WORKER_RETRY_MAX_MS", "600000"))
+    WORKER_MAX_DELIVERIES = int(os.getenv("WORKER_MAX_DELIVERIES", "5"))
+    WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))  # 0 - по числу CPU
+    WORKER_NAME_PREFIX = os.getenv("WORKER_NAME_PREFIX", "")
+    WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "30"))
+    WORKER_STATS_INTERVAL = float(os.getenv("WORKER_STATS_INTERVAL", "60"))
     
     LLM_ADAPTER: Literal["rule_based", "openai_like"] = os.getenv("LLM_ADAPTER", "rule_based")
+    LLM_API_BASE = os.getenv("LLM_API_BASE", "https://api.openai.com/v1")
+    LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+    LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "10"))
+    LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+    LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+    LLM_LATENCY_BUDGET = float(os.getenv("LLM_LATENCY_BUDGET", "2.0"))
+    LLM_HEDGE_MODE: Literal["fallback", "race"] = os.getenv("LLM_HEDGE_MODE", "fallback")
+    
+    TRIAGE_CACHE_ENABLED = os.getenv("TRIAGE_CACHE_ENABLED", "true").lower() == "true"
+    TRIAGE_CACHE_SIZE = int(os.getenv("TRIAGE_CACHE_SIZE", "10000"))
+    TRIAGE_CACHE_TTL = int(os.getenv("TRIAGE_CACHE_TTL", "3600"))
+    TRIAGE_CACHE_REDIS = os.getenv("TRIAGE_CACHE_REDIS", "false").lower() == "true"
 
 config = Config()
\ No newline at end of file
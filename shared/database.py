@@ -1,9 +1,13 @@
-from sqlalchemy import create_engine, String, Float, DateTime, Text, UniqueConstraint, ForeignKey
-from sqlalchemy.orm import sessionmaker, mapped_column, Mapped, relationship, declarative_base
-from typing import Optional, List
+from sqlalchemy import create_engine, inspect, text, update, select, exists, bindparam, String, Float, DateTime, Text, Integer, UniqueConstraint, ForeignKey, Index
+from sqlalchemy.orm import sessionmaker, mapped_column, Mapped, relationship, declarative_base, aliased
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from typing import Optional, List, AsyncIterator
+from contextlib import aclosing
+import json
 import uuid
 from datetime import datetime
 from .config import config
+from .utils import generate_request_fingerprint
 from datetime import datetime, timezone
 
 DATABASE_URL = config.DATABASE_URL
@@ -11,6 +15,18 @@ engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def to_async_url(url: str) -> str:
+    """Подбирает async драйвер для URL базы: aiosqlite для SQLite, asyncpg для PostgreSQL"""
+    for prefix, async_prefix in (("sqlite://", "sqlite+aiosqlite://"), ("postgresql://", "postgresql+asyncpg://")):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+# Async путь используется API-сервисами, синхронный engine остается для воркера
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 def create_str_primary_key():
     return mapped_column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
 
@@ -24,8 +40,15 @@ class LeadDB(Base):
     note: Mapped[str] = mapped_column(Text, nullable=False)
     source: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Последний инсайт лида, его поддерживает воркер; без внешнего ключа, чтобы не зациклить leads и insights
+    latest_insight_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     
     insights: Mapped[List["InsightDB"]] = relationship("InsightDB", back_populates="lead")
+    
+    __table_args__ = (
+        # Выгрузка лидов по порядку времени с продолжением с курсора
+        Index('ix_leads_created', 'created_at', 'id'),
+    )
 
 class InsightDB(Base):
     __tablename__ = "insights"
@@ -36,22 +59,145 @@ class InsightDB(Base):
     priority: Mapped[str] = mapped_column(String, nullable=False)
     next_action: Mapped[str] = mapped_column(String, nullable=False)
     confidence: Mapped[float] = mapped_column(Float, nullable=False)
-    tags: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     content_hash: Mapped[str] = mapped_column(String, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
     
     lead: Mapped["LeadDB"] = relationship("LeadDB", back_populates="insights")
+    # selectin: теги всех инсайтов результата подгружаются одним запросом, в том числе в async сессии
+    tag_rows: Mapped[List["InsightTagDB"]] = relationship(
+        "InsightTagDB", back_populates="insight", cascade="all, delete-orphan",
+        lazy="selectin", order_by="InsightTagDB.position"
+    )
+    
+    @property
+    def tags(self) -> List[str]:
+        return [tag_row.tag for tag_row in self.tag_rows]
+    
+    @classmethod
+    def from_payload(cls, lead_id: str, content_hash: str, insight_payload,
+                     created_at: Optional[datetime] = None) -> "InsightDB":
+        """Строит инсайт из результата LLM адаптера; теги сохраняются строками insight_tags вместе с ним"""
+        created_at = created_at or datetime.utcnow()
+        return cls(
+            id=str(uuid.uuid4()),
+            lead_id=lead_id,
+            intent=insight_payload.intent,
+            priority=insight_payload.priority,
+            next_action=insight_payload.next_action,
+            confidence=insight_payload.confidence,
+            content_hash=content_hash,
+            created_at=created_at,
+            tag_rows=[
+                InsightTagDB(tag=tag, position=position, created_at=created_at)
+                for position, tag in enumerate(dict.fromkeys(insight_payload.tags or []))
+            ]
+        )
     
     __table_args__ = (
         UniqueConstraint('lead_id', 'content_hash', name='uq_lead_content'),
+        # Последний инсайт лида без сортировки: поиск по lead_id и обратный проход по created_at
+        Index('ix_insights_lead_created', 'lead_id', 'created_at', 'id'),
+        # Список инсайтов постранично по (created_at, id), в том числе с фильтром по приоритету или намерению
+        Index('ix_insights_created', 'created_at', 'id'),
+        Index('ix_insights_priority_created', 'priority', 'created_at', 'id'),
+        Index('ix_insights_intent_created', 'intent', 'created_at', 'id'),
+    )
+
+class InsightTagDB(Base):
+    """Тег инсайта; created_at повторяет время инсайта, чтобы выборка по тегу шла по индексу в порядке времени"""
+    __tablename__ = "insight_tags"
+    
+    insight_id: Mapped[str] = mapped_column(String, ForeignKey("insights.id"), primary_key=True)
+    tag: Mapped[str] = mapped_column(String, primary_key=True)
+    position: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    
+    insight: Mapped["InsightDB"] = relationship("InsightDB", back_populates="tag_rows")
+    
+    __table_args__ = (
+        Index('ix_insight_tags_tag_created', 'tag', 'created_at', 'insight_id'),
+    )
+
+class TriageRollupDB(Base):
+    """Число инсайтов в часовом или дневном интервале по измерениям; обновляется вместе со вставкой инсайта"""
+    __tablename__ = "triage_rollups"
+    
+    granularity: Mapped[str] = mapped_column(String, primary_key=True)  # hour или day
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    intent: Mapped[str] = mapped_column(String, primary_key=True)
+    priority: Mapped[str] = mapped_column(String, primary_key=True)
+    next_action: Mapped[str] = mapped_column(String, primary_key=True)
+    source: Mapped[str] = mapped_column(String, primary_key=True)  # пустая строка для лидов без источника
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+def latest_insight_update(insight: InsightDB):
+    """
+    UPDATE, переводящий leads.latest_insight_id на insight, если текущий последний инсайт не новее.
+    Выполняется в транзакции, сохраняющей инсайт
+    """
+    current = aliased(InsightDB)
+    newer = select(current.id).where(
+        current.id == LeadDB.latest_insight_id,
+        current.created_at > insight.created_at
+    )
+    return (
+        update(LeadDB)
+        .where(LeadDB.id == insight.lead_id, ~exists(newer))
+        .values(latest_insight_id=insight.id)
+    )
+
+def update_latest_insights(db, insights: List[InsightDB]) -> None:
+    """
+    Переводит leads.latest_insight_id на инсайты пачки одним executemany UPDATE вместо запроса на инсайт.
+    Инсайты одного лида применяются от старых к новым, чтобы указатель остался на последнем
+    """
+    if not insights:
+        return
+
+    leads, current = LeadDB.__table__, InsightDB.__table__.alias("current")
+    newer = select(current.c.id).where(
+        current.c.id == leads.c.latest_insight_id,
+        current.c.created_at > bindparam("insight_created_at")
+    )
+    statement = (
+        update(leads)
+        .where(leads.c.id == bindparam("lead"), ~exists(newer))
+        .values(latest_insight_id=bindparam("insight"))
     )
+    db.execute(statement, [
+        {"lead": insight.lead_id, "insight": insight.id, "insight_created_at": insight.created_at}
+        for insight in sorted(insights, key=lambda insight: insight.created_at)
+    ])
 
 class IdempotencyKeyDB(Base):
+    """Ключ идемпотентности: отпечаток исходного запроса и созданный по нему лид"""
     __tablename__ = "idempotency_keys"
     
     key: Mapped[str] = mapped_column(String, primary_key=True)
-    response_data: Mapped[str] = mapped_column(Text, nullable=False)
+    request_fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    lead_id: Mapped[str] = mapped_column(String, ForeignKey("leads.id"), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        # Для удаления просроченных ключей пачками
+        Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+class OutboxEventDB(Base):
+    """События, записанные в одной транзакции с лидом и ожидающие публикации в Redis Stream"""
+    __tablename__ = "outbox_events"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    event_id: Mapped[str] = mapped_column(String, nullable=False)
+    type: Mapped[str] = mapped_column(String, nullable=False, default="lead.created")
+    lead_id: Mapped[str] = mapped_column(String, nullable=False)
+    content_hash: Mapped[str] = mapped_column(String, nullable=False)
+    occurred_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    published_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_outbox_unpublished', 'published_at', 'id'),
+    )
 
 def get_db():
     db = SessionLocal()
@@ -60,5 +206,116 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def closing_session(db: AsyncSession, stream: AsyncIterator) -> AsyncIterator:
+    """
+    Отдает элементы потокового ответа и закрывает сессию по его окончании.
+    FastAPI может завершить зависимость get_async_db до начала стриминга, поэтому сессию закрывает сам поток
+    """
+    try:
+        async with aclosing(stream):
+            async for item in stream:
+                yield item
+    finally:
+        await db.close()
+
+def migrate_idempotency_keys(bind=engine):
+    """
+    Переводит idempotency_keys со старого формата (полная JSON-копия запроса и ответа в response_data)
+    на отпечаток запроса и lead_id
+    """
+    columns = {column["name"] for column in inspect(bind).get_columns("idempotency_keys")}
+    if "response_data" not in columns:
+        return
+
+    print("Migrating idempotency_keys to request fingerprints...")
+    with bind.begin() as conn:
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN request_fingerprint VARCHAR(64)"))
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN lead_id VARCHAR REFERENCES leads (id)"))
+
+        rows = conn.execute(text("SELECT key, response_data FROM idempotency_keys")).all()
+        updates = []
+        for key, response_data in rows:
+            try:
+                stored_data = json.loads(response_data)
+                updates.append({
+                    "key": key,
+                    "fingerprint": generate_request_fingerprint(stored_data["request"]),
+                    "lead_id": stored_data["lead"]["id"]
+                })
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                print(f"Dropping unreadable idempotency key {key}: {e}")
+                conn.execute(text("DELETE FROM idempotency_keys WHERE key = :key"), {"key": key})
+
+        if updates:
+            conn.execute(
+                text("UPDATE idempotency_keys SET request_fingerprint = :fingerprint, lead_id = :lead_id WHERE key = :key"),
+                updates
+            )
+        # Ключ без лида при повторе запроса вернул бы 500, поэтому такие ключи удаляются
+        orphans = conn.execute(text(
+            "DELETE FROM idempotency_keys WHERE lead_id IS NULL OR lead_id NOT IN (SELECT id FROM leads)"
+        )).rowcount
+        if orphans:
+            print(f"Dropped {orphans} idempotency keys of missing leads")
+        conn.execute(text("ALTER TABLE idempotency_keys DROP COLUMN response_data"))
+    print(f"Migrated {len(updates) - orphans} idempotency keys")
+
+def migrate_latest_insight(bind=engine):
+    """Добавляет leads.latest_insight_id и заполняет его по существующим инсайтам"""
+    columns = {column["name"] for column in inspect(bind).get_columns("leads")}
+    if "latest_insight_id" in columns:
+        return
+
+    print("Adding leads.latest_insight_id...")
+    with bind.begin() as conn:
+        conn.execute(text("ALTER TABLE leads ADD COLUMN latest_insight_id VARCHAR"))
+        # Подзапрос идет по ix_insights_lead_created, поэтому индексы создаются до миграции
+        result = conn.execute(text(
+            "UPDATE leads SET latest_insight_id = ("
+            "SELECT insights.id FROM insights WHERE insights.lead_id = leads.id "
+            "ORDER BY insights.created_at DESC, insights.id DESC LIMIT 1"
+            ") WHERE EXISTS (SELECT 1 FROM insights WHERE insights.lead_id = leads.id)"
+        ))
+    print(f"Backfilled latest insight for {result.rowcount} leads")
+
+def migrate_insight_tags(bind=engine, batch_size: int = 1000):
+    """Переносит теги из строки через запятую insights.tags в таблицу insight_tags и удаляет колонку"""
+    columns = {column["name"] for column in inspect(bind).get_columns("insights")}
+    if "tags" not in columns:
+        return
+
+    print("Migrating insights.tags to insight_tags...")
+    migrated = 0
+    with bind.begin() as conn:
+        rows = conn.execute(text(
+            "SELECT id, tags, created_at FROM insights WHERE tags IS NOT NULL AND tags != ''"
+        ))
+        while batch := rows.fetchmany(batch_size):
+            tag_rows = [
+                {"insight_id": insight_id, "tag": tag, "position": position, "created_at": created_at}
+                for insight_id, tags, created_at in batch
+                for position, tag in enumerate(dict.fromkeys(tag for tag in tags.split(",") if tag))
+            ]
+            if tag_rows:
+                conn.execute(
+                    text("INSERT INTO insight_tags (insight_id, tag, position, created_at) "
+                         "VALUES (:insight_id, :tag, :position, :created_at)"),
+                    tag_rows
+                )
+            migrated += len(batch)
+        conn.execute(text("ALTER TABLE insights DROP COLUMN tags"))
+    print(f"Migrated tags of {migrated} insights")
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    migrate_idempotency_keys()
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    migrate_latest_insight()
+    migrate_insight_tags()
\ No newline at end of file
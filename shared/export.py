@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import config
+from .database import InsightDB, InsightTagDB, LeadDB
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_COLUMNS = (
+    "lead_id", "email", "phone", "name", "note", "source", "lead_created_at",
+    "insight_id", "intent", "priority", "next_action", "confidence", "tags", "insight_created_at",
+)
+
+
+class ExportFormatUnavailable(RuntimeError):
+    """Формат выгрузки требует не установленную зависимость"""
+
+
+def export_query(created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                 after: Optional[Tuple[datetime, str]] = None) -> Select:
+    """
+    Лиды с последним инсайтом (по leads.latest_insight_id) в порядке (created_at, id).
+    after - (lead_created_at, lead_id) последней выгруженной строки, выгрузка продолжится после нее
+    """
+    query = (
+        select(
+            LeadDB.id.label("lead_id"), LeadDB.email, LeadDB.phone, LeadDB.name, LeadDB.note, LeadDB.source,
+            LeadDB.created_at.label("lead_created_at"),
+            InsightDB.id.label("insight_id"), InsightDB.intent, InsightDB.priority, InsightDB.next_action,
+            InsightDB.confidence, InsightDB.created_at.label("insight_created_at"),
+        )
+        .outerjoin(InsightDB, InsightDB.id == LeadDB.latest_insight_id)
+    )
+    if created_after is not None:
+        query = query.where(LeadDB.created_at >= created_after)
+    if created_before is not None:
+        query = query.where(LeadDB.created_at < created_before)
+    if after is not None:
+        query = query.where(tuple_(LeadDB.created_at, LeadDB.id) > tuple_(*after))
+    return query.order_by(LeadDB.created_at, LeadDB.id)
+
+
+async def export_batches(db: AsyncSession, created_after: Optional[datetime] = None,
+                         created_before: Optional[datetime] = None, after: Optional[Tuple[datetime, str]] = None,
+                         chunk_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Строки выгрузки порциями по chunk_size. Запрос читается курсором на стороне сервера (yield_per),
+    теги подгружаются одним запросом на порцию, поэтому память не зависит от размера таблиц
+    """
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    result = await db.stream(
+        export_query(created_after, created_before, after).execution_options(yield_per=chunk_size)
+    )
+    try:
+        async for partition in result.partitions():
+            insight_ids = [row.insight_id for row in partition if row.insight_id]
+            tags: Dict[str, List[str]] = {}
+            if insight_ids:
+                for insight_id, tag in await db.execute(
+                    select(InsightTagDB.insight_id, InsightTagDB.tag)
+                    .where(InsightTagDB.insight_id.in_(insight_ids))
+                    .order_by(InsightTagDB.insight_id, InsightTagDB.position)
+                ):
+                    tags.setdefault(insight_id, []).append(tag)
+
+            yield [
+                {**row._asdict(), "tags": tags.get(row.insight_id, []) if row.insight_id else None}
+                for row in partition
+            ]
+    finally:
+        await result.close()
+
+
+class CSVEncoder:
+    def header(self) -> bytes:
+        return self._line(EXPORT_COLUMNS)
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        return b"".join(self._line([self._value(row[column]) for column in EXPORT_COLUMNS]) for row in rows)
+
+    def finish(self) -> bytes:
+        return b""
+
+    def _line(self, values) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(values)
+        return buffer.getvalue().encode()
+
+    def _value(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, list):
+            return ",".join(value)
+        return value
+
+
+class NDJSONEncoder:
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        return "".join(
+            json.dumps({column: row[column] for column in EXPORT_COLUMNS}, default=self._value) + "\n"
+            for row in rows
+        ).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+    def _value(self, value):
+        return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class _ParquetSink(io.RawIOBase):
+    """Файл для ParquetWriter, который отдает записанные байты порциями вместо хранения файла целиком"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ParquetEncoder:
+    """Каждая порция строк записывается отдельной row group и сразу отдается"""
+
+    def __init__(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ExportFormatUnavailable("Parquet export requires pyarrow") from e
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ("lead_id", pa.string()), ("email", pa.string()), ("phone", pa.string()), ("name", pa.string()),
+            ("note", pa.string()), ("source", pa.string()), ("lead_created_at", pa.timestamp("us")),
+            ("insight_id", pa.string()), ("intent", pa.string()), ("priority", pa.string()),
+            ("next_action", pa.string()), ("confidence", pa.float64()), ("tags", pa.list_(pa.string())),
+            ("insight_created_at", pa.timestamp("us")),
+        ])
+        self._sink = _ParquetSink()
+        self._writer = pq.ParquetWriter(self._sink, self._schema)
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def get_encoder(export_format: str):
+    """Кодировщик формата; для parquet нужен pyarrow"""
+    encoders = {"csv": CSVEncoder, "ndjson": NDJSONEncoder, "parquet": ParquetEncoder}
+    if export_format not in encoders:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return encoders[export_format]()
+
+
+async def export_stream(db: AsyncSession, encoder, **filters) -> AsyncIterator[bytes]:
+    """Выгрузка в формате encoder порциями байтов"""
+    yield encoder.header()
+    async for rows in export_batches(db, **filters):
+        yield encoder.encode(rows)
+    yield encoder.finish()
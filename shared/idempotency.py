@@ -0,0 +1,292 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .config import config
+from .database import SessionLocal, IdempotencyKeyDB
+from .message_queue import queue
+
+
+class IdempotencyCache:
+    """
+    Двухуровневый кеш сохраненных ответов по ключам идемпотентности:
+    LRU с TTL в памяти процесса и, опционально, общий Redis.
+    Кешируются только существующие ключи; значения разделяются между вызовами и не должны изменяться.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None,
+                 use_redis: Optional[bool] = None, key_prefix: str = "idempotency"):
+        self.max_size = max_size or config.IDEMPOTENCY_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.IDEMPOTENCY_CACHE_TTL
+        self.use_redis = use_redis if use_redis is not None else config.IDEMPOTENCY_CACHE_REDIS
+        self.key_prefix = key_prefix
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Возвращает найденные в кеше записи; ключей без записи в результате нет"""
+        found = {}
+        missing = []
+        now = time.monotonic()
+
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                missing.append(key)
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[1]
+
+        if missing and self.use_redis:
+            for key, data in (await self._get_shared(missing)).items():
+                self._set_local(key, data)
+                found[key] = data
+
+        return found
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return (await self.get_many([key])).get(key)
+
+    async def set_many(self, records: Dict[str, Dict[str, Any]]) -> None:
+        for key, data in records.items():
+            self._set_local(key, data)
+
+        if records and self.use_redis:
+            await self._set_shared(records)
+
+    async def set(self, key: str, data: Dict[str, Any]) -> None:
+        await self.set_many({key: data})
+
+    def _set_local(self, key: str, data: Dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _get_shared(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            values = await queue.get_async_redis().mget([f"{self.key_prefix}:{key}" for key in keys])
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"Idempotency cache redis error: {e}")
+            return {}
+
+        found = {}
+        for key, value in zip(keys, values):
+            if value is None:
+                self.redis_misses += 1
+            else:
+                self.redis_hits += 1
+                found[key] = json.loads(value)
+        return found
+
+    async def _set_shared(self, records: Dict[str, Dict[str, Any]]) -> None:
+        try:
+            pipe = queue.get_async_redis().pipeline(transaction=False)
+            for key, data in records.items():
+                pipe.set(f"{self.key_prefix}:{key}", json.dumps(data, default=str), ex=int(self.ttl))
+            await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"Idempotency cache redis error: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий, промахов и вытеснений кеша"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self),
+            "redis_hits": self.redis_hits,
+            "redis_misses": self.redis_misses,
+            "redis_errors": self.redis_errors,
+        }
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные запросы с одним ключом идемпотентности.
+    В процессе последующие запросы ждут результата первого; между процессами
+    первый берет короткую блокировку ключа в Redis, остальные ждут появления записи ключа.
+    """
+
+    def __init__(self, use_redis: Optional[bool] = None, lock_ttl: Optional[float] = None,
+                 poll_interval: Optional[float] = None, key_prefix: str = "idempotency_lock"):
+        self.use_redis = use_redis if use_redis is not None else config.IDEMPOTENCY_LOCK_REDIS
+        self.lock_ttl = lock_ttl if lock_ttl is not None else config.IDEMPOTENCY_LOCK_TTL
+        self.poll_interval = poll_interval if poll_interval is not None else config.IDEMPOTENCY_LOCK_POLL_INTERVAL
+        self.key_prefix = key_prefix
+        self._flights: Dict[str, asyncio.Future] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock_waits = 0
+        self.redis_errors = 0
+
+    async def run(
+        self,
+        key: str,
+        load: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+        create: Callable[[], Awaitable[Tuple[Dict[str, Any], bool]]]
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Возвращает запись ключа: уже сохраненную (load) или созданную create.
+        create возвращает (запись, создана ли она этим вызовом); флаг в результате
+        истинен только у вызова, который действительно создал запись
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            record, _ = await asyncio.shield(flight)
+            return record, False
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        self.leaders += 1
+        try:
+            record = await load()
+            result = (record, False) if record is not None else await self._run_locked(key, load, create)
+        except BaseException as e:
+            flight.set_exception(e)
+            # Исключение получат ожидающие; если их нет, не оставляем его неполученным
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+    async def _run_locked(self, key, load, create) -> Tuple[Dict[str, Any], bool]:
+        if not self.use_redis:
+            return await create()
+
+        lock = queue.get_async_redis().lock(f"{self.key_prefix}:{key}", timeout=self.lock_ttl)
+        deadline = time.monotonic() + self.lock_ttl
+
+        while not await self._try_acquire(lock):
+            # Ключ обрабатывает другой процесс: ждем его запись, но не дольше TTL блокировки
+            self.lock_waits += 1
+            record = await load()
+            if record is not None:
+                return record, False
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            return await create()
+        finally:
+            try:
+                await lock.release()
+            except Exception:
+                pass
+
+    async def _try_acquire(self, lock) -> bool:
+        try:
+            return await lock.acquire(blocking=False)
+        except Exception as e:
+            # Без Redis остается защита первичным ключом idempotency_keys
+            self.redis_errors += 1
+            print(f"Idempotency lock redis error: {e}")
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики схлопнутых запросов и ожиданий блокировки"""
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "lock_waits": self.lock_waits,
+            "redis_errors": self.redis_errors,
+        }
+
+
+class IdempotencyKeyExpiry:
+    """Периодически удаляет ключи идемпотентности старше TTL ограниченными пачками"""
+
+    def __init__(self, ttl: Optional[float] = None, batch_size: Optional[int] = None,
+                 interval: Optional[float] = None, session_factory=None):
+        self.SessionLocal = session_factory or SessionLocal
+        self.ttl = ttl if ttl is not None else config.IDEMPOTENCY_KEY_TTL
+        self.batch_size = batch_size or config.IDEMPOTENCY_EXPIRY_BATCH_SIZE
+        self.interval = interval if interval is not None else config.IDEMPOTENCY_EXPIRY_INTERVAL
+        self._stopping = False
+
+    async def run(self):
+        """Основной цикл: удаление идет в отдельном потоке, чтобы не блокировать event loop"""
+        print("Idempotency key expiry started")
+
+        while not self._stopping:
+            try:
+                await asyncio.to_thread(self.expire)
+            except Exception as e:
+                print(f"Error expiring idempotency keys: {e}")
+
+            # Спим короткими шагами, чтобы быстро реагировать на stop()
+            deadline = time.monotonic() + self.interval
+            while not self._stopping and time.monotonic() < deadline:
+                await asyncio.sleep(min(1.0, self.interval))
+
+        print("Idempotency key expiry stopped")
+
+    def stop(self):
+        self._stopping = True
+
+    def expire(self) -> int:
+        """Удаляет просроченные ключи пачками по batch_size, каждая пачка в своей транзакции"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        deleted = 0
+
+        db = self.SessionLocal()
+        try:
+            while not self._stopping:
+                keys = [
+                    row.key for row in
+                    db.query(IdempotencyKeyDB.key)
+                    .filter(IdempotencyKeyDB.created_at < cutoff)
+                    .limit(self.batch_size)
+                ]
+                if not keys:
+                    break
+
+                db.query(IdempotencyKeyDB).filter(IdempotencyKeyDB.key.in_(keys)).delete(synchronize_session=False)
+                db.commit()
+                deleted += len(keys)
+
+        finally:
+            db.close()
+
+        if deleted:
+            print(f"Expired {deleted} idempotency keys")
+        return deleted
+
+
+idempotency_cache = IdempotencyCache()
+idempotency_flights = SingleFlight()
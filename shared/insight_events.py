@@ -0,0 +1,93 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Set
+
+from .config import config
+from .message_queue import queue
+
+
+RECONNECT_DELAY = 5.0
+
+
+class InsightNotifier:
+    """
+    Будит запросы insights-api, ожидающие инсайт лида.
+    На процесс держится одна подписка на pub/sub канал, в который воркер публикует id лидов
+    с новыми инсайтами. Пока подписка не установлена, ожидающие перепроверяют базу раз в poll_interval.
+    """
+
+    def __init__(self, channel: Optional[str] = None, poll_interval: Optional[float] = None):
+        self.channel = channel or config.INSIGHT_CHANNEL
+        self.poll_interval = poll_interval if poll_interval is not None else config.INSIGHT_WAIT_POLL_INTERVAL
+        self.connected = False
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def subscribe(self, lead_id: str) -> AsyncIterator[asyncio.Event]:
+        """
+        Регистрирует ожидание инсайта лида. Регистрироваться нужно до проверки базы,
+        чтобы не пропустить уведомление между проверкой и ожиданием
+        """
+        self._ensure_listener()
+        ready = asyncio.Event()
+        self._waiters.setdefault(lead_id, set()).add(ready)
+        try:
+            yield ready
+        finally:
+            waiters = self._waiters.get(lead_id)
+            if waiters is not None:
+                waiters.discard(ready)
+                if not waiters:
+                    del self._waiters[lead_id]
+
+    async def wait(self, ready: asyncio.Event, timeout: float) -> bool:
+        """Ждет уведомления не дольше timeout; без подписки - не дольше poll_interval"""
+        if not self.connected:
+            timeout = min(timeout, self.poll_interval)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        ready.clear()
+        return True
+
+    def notify(self, lead_id: str) -> None:
+        for ready in self._waiters.get(lead_id, ()):
+            ready.set()
+
+    def _ensure_listener(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._listener is None or self._listener.done() or self._listener.get_loop() is not loop:
+            self.connected = False
+            self._listener = loop.create_task(self._listen(queue.get_async_redis()))
+
+    async def _listen(self, client) -> None:
+        while True:
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    self.connected = True
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.notify(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Insight notifications unavailable, falling back to polling: {e}")
+            finally:
+                self.connected = False
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def aclose(self) -> None:
+        """Останавливает подписку; общий клиент закрывает queue.aclose()"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+
+insight_notifier = InsightNotifier()
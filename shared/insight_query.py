@@ -0,0 +1,68 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import Select, exists, select, tuple_
+from sqlalchemy.orm import aliased
+
+from .database import InsightDB, InsightTagDB, LeadDB
+from .models import InsightFilters
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы не удалось разобрать"""
+
+
+def encode_cursor(insight_db: InsightDB) -> str:
+    """Курсор - ключ (created_at, id) последнего инсайта страницы"""
+    raw = json.dumps([insight_db.created_at.isoformat(), insight_db.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, insight_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(insight_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def insight_query(filters: InsightFilters, after: Optional[Tuple[datetime, str]] = None) -> Select:
+    """
+    Инсайты по фильтрам от новых к старым. Страницы идут по ключу (created_at, id) после курсора,
+    а не через OFFSET, поэтому стоимость страницы не зависит от ее номера
+    """
+    query = select(InsightDB)
+    created_at, insight_id = InsightDB.created_at, InsightDB.id
+
+    tags = list(dict.fromkeys(filters.tag))
+    if tags:
+        # Выборку ведет первый тег: тот же ключ (created_at, id) лежит в ix_insight_tags_tag_created,
+        # остальные теги проверяются по первичному ключу insight_tags
+        first = aliased(InsightTagDB)
+        query = query.join(first, first.insight_id == InsightDB.id).where(first.tag == tags[0])
+        created_at, insight_id = first.created_at, first.insight_id
+        for tag in tags[1:]:
+            other = aliased(InsightTagDB)
+            query = query.where(exists().where(other.insight_id == InsightDB.id, other.tag == tag))
+
+    for column, value in (
+        (InsightDB.intent, filters.intent),
+        (InsightDB.priority, filters.priority),
+        (InsightDB.next_action, filters.next_action),
+    ):
+        if value is not None:
+            query = query.where(column == value)
+
+    if filters.source is not None:
+        query = query.join(LeadDB, LeadDB.id == InsightDB.lead_id).where(LeadDB.source == filters.source)
+    if filters.created_after is not None:
+        query = query.where(created_at >= filters.created_after)
+    if filters.created_before is not None:
+        query = query.where(created_at < filters.created_before)
+    if after is not None:
+        query = query.where(tuple_(created_at, insight_id) < tuple_(*after))
+
+    return query.order_by(created_at.desc(), insight_id.desc())
@@ -1,6 +1,55 @@
+from typing import Dict
+
+import redis.asyncio as aioredis
+
+from ..config import config
 from .base import LLMAdapter
 from .rule_based import RuleBasedLLM
+from .openai_like import OpenAILikeLLM
+from .cache import CachedLLMAdapter, TriageCache
+from .hedged import HedgedLLMAdapter, FALLBACK_TAG
+
+__all__ = [
+    "LLMAdapter", "RuleBasedLLM", "OpenAILikeLLM", "CachedLLMAdapter", "TriageCache",
+    "HedgedLLMAdapter", "FALLBACK_TAG", "create_base_adapter", "get_llm_adapter", "adapter_stats",
+]
+
+def create_base_adapter(name: str) -> LLMAdapter:
+    """Создает адаптер по имени из Config.LLM_ADAPTER"""
+    if name == "rule_based":
+        return RuleBasedLLM()
+    if name == "openai_like":
+        return OpenAILikeLLM()
+    raise ValueError(f"Unknown LLM adapter: {name}")
 
 def get_llm_adapter() -> LLMAdapter:
-    """Возвращает rule-based LLM адаптер"""
-    return RuleBasedLLM()
\ No newline at end of file
+    """
+    Возвращает LLM адаптер из конфигурации: при включенном кеше он обернут в CachedLLMAdapter,
+    удаленный адаптер дополнительно ограничен бюджетом времени с rule-based запасным вариантом
+    """
+    adapter = create_base_adapter(config.LLM_ADAPTER)
+
+    if config.TRIAGE_CACHE_ENABLED:
+        redis_client = None
+        if config.TRIAGE_CACHE_REDIS:
+            redis_client = aioredis.from_url(config.REDIS_URL, decode_responses=True)
+        adapter = CachedLLMAdapter(adapter, redis_client=redis_client)
+
+    # Кеш внутри: в него попадают только ответы основного адаптера, но не запасного
+    if config.LLM_ADAPTER != "rule_based" and config.LLM_LATENCY_BUDGET > 0:
+        adapter = HedgedLLMAdapter(adapter)
+
+    return adapter
+
+def adapter_stats(adapter: LLMAdapter) -> Dict[str, Dict[str, int]]:
+    """Счетчики оберток адаптера: кеша результатов (triage_cache) и бюджета времени (hedge)"""
+    stats = {}
+    while True:
+        if isinstance(adapter, HedgedLLMAdapter):
+            stats["hedge"] = adapter.stats()
+            adapter = adapter.primary
+        elif isinstance(adapter, CachedLLMAdapter):
+            stats["triage_cache"] = adapter.stats()
+            adapter = adapter.adapter
+        else:
+            return stats
@@ -1,9 +1,17 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from ..models import InsightPayload
 
 class LLMAdapter(ABC):
+    # Версия адаптера/набора правил; входит в ключ кеша результатов triage
+    version: str = "v1"
+
     @abstractmethod
     async def triage(self, note: str, context: Optional[Dict] = None) -> InsightPayload:
         """Анализирует заметку лида и возвращает структурированный инсайт"""
-        pass
\ No newline at end of file
+        pass
+
+    async def triage_many(self, notes: List[str], contexts: Optional[List[Optional[Dict]]] = None) -> List[InsightPayload]:
+        """Анализирует пачку заметок; по умолчанию вызывает triage для каждой по очереди"""
+        contexts = contexts or [None] * len(notes)
+        return [await self.triage(note, context) for note, context in zip(notes, contexts)]
@@ -0,0 +1,214 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .base import LLMAdapter
+from ..config import config
+from ..models import InsightPayload
+from ..utils import generate_content_hash
+
+
+class TriageCache:
+    """LRU-кеш результатов triage с TTL в памяти процесса"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, InsightPayload]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[InsightPayload]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, payload = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def set(self, key: str, payload: InsightPayload) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, payload)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+class CachedLLMAdapter(LLMAdapter):
+    """
+    Кеширует результаты вложенного адаптера по хешу заметки и версии адаптера.
+    Предполагается, что результат зависит только от текста заметки, а не от context.
+    Одновременные промахи по одному ключу анализируются один раз: остальные вызовы ждут результат первого.
+    Кешированные InsightPayload разделяются между вызовами и не должны изменяться.
+    """
+
+    def __init__(self, adapter: LLMAdapter, cache: Optional[TriageCache] = None,
+                 redis_client=None, key_prefix: str = "triage_cache"):
+        self.adapter = adapter
+        self.version = adapter.version
+        self.cache = cache if cache is not None else TriageCache(config.TRIAGE_CACHE_SIZE, config.TRIAGE_CACHE_TTL)
+        self.redis = redis_client
+        self.key_prefix = key_prefix
+        self._flights: Dict[str, asyncio.Future] = {}
+
+        self.coalesced = 0
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    def _cache_key(self, note: str, context: Optional[Dict]) -> str:
+        content_hash = (context or {}).get("content_hash") or generate_content_hash(note)
+        return f"{self.version}:{content_hash}"
+
+    async def triage(self, note: str, context: Optional[Dict] = None) -> InsightPayload:
+        key = self._cache_key(note, context)
+
+        payload = self.cache.get(key)
+        if payload is not None:
+            return payload
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(flight)
+
+        self._start_flights([key])
+        try:
+            payload = (await self._get_shared([key]))[0]
+            if payload is None:
+                payload = await self.adapter.triage(note, context)
+                await self._set_shared({key: payload})
+        except BaseException as e:
+            self._fail_flights([key], e)
+            raise
+
+        self._finish_flights({key: payload})
+        return payload
+
+    async def triage_many(self, notes: List[str], contexts: Optional[List[Optional[Dict]]] = None) -> List[InsightPayload]:
+        contexts = contexts or [None] * len(notes)
+        keys = [self._cache_key(note, context) for note, context in zip(notes, contexts)]
+        results: List[Optional[InsightPayload]] = [self.cache.get(key) for key in keys]
+
+        # Одинаковые заметки внутри пачки анализируем один раз
+        missing: Dict[str, int] = {}
+        for index, payload in enumerate(results):
+            if payload is None:
+                missing.setdefault(keys[index], index)
+
+        if missing:
+            # Ключи, которые уже анализирует другой вызов, ждем, а не отправляем повторно
+            waiting = {key: self._flights[key] for key in missing if key in self._flights}
+            leading = [key for key in missing if key not in waiting]
+            self._start_flights(leading)
+
+            try:
+                resolved = dict(zip(leading, await self._get_shared(leading))) if leading else {}
+
+                to_triage = [key for key, payload in resolved.items() if payload is None]
+                if to_triage:
+                    payloads = await self.adapter.triage_many(
+                        [notes[missing[key]] for key in to_triage],
+                        [contexts[missing[key]] for key in to_triage]
+                    )
+                    triaged = dict(zip(to_triage, payloads))
+                    await self._set_shared(triaged)
+                    resolved.update(triaged)
+            except BaseException as e:
+                self._fail_flights(leading, e)
+                raise
+
+            self._finish_flights(resolved)
+
+            self.coalesced += len(waiting)
+            for key, flight in waiting.items():
+                resolved[key] = await asyncio.shield(flight)
+
+            results = [payload if payload is not None else resolved[key] for key, payload in zip(keys, results)]
+
+        return results
+
+    def _start_flights(self, keys: List[str]) -> None:
+        loop = asyncio.get_running_loop()
+        for key in keys:
+            self._flights[key] = loop.create_future()
+
+    def _finish_flights(self, payloads: Dict[str, InsightPayload]) -> None:
+        for key, payload in payloads.items():
+            self.cache.set(key, payload)
+            self._flights.pop(key).set_result(payload)
+
+    def _fail_flights(self, keys: List[str], error: BaseException) -> None:
+        for key in keys:
+            if isinstance(error, asyncio.CancelledError):
+                # Отмена первого вызова (например, по бюджету хеджа) не отменяет ожидающих, а дает им ошибку
+                error = RuntimeError("Triage of the same note was cancelled")
+            flight = self._flights.pop(key)
+            flight.set_exception(error)
+            # Исключение получат ожидающие; если их нет, не оставляем его неполученным
+            flight.exception()
+
+    async def _get_shared(self, keys: List[str]) -> List[Optional[InsightPayload]]:
+        if self.redis is None:
+            return [None] * len(keys)
+
+        try:
+            values = await self.redis.mget([f"{self.key_prefix}:{key}" for key in keys])
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"Triage cache redis error: {e}")
+            return [None] * len(keys)
+
+        payloads = []
+        for value in values:
+            if value is None:
+                self.redis_misses += 1
+                payloads.append(None)
+            else:
+                self.redis_hits += 1
+                payloads.append(InsightPayload.model_validate_json(value))
+        return payloads
+
+    async def _set_shared(self, payloads: Dict[str, InsightPayload]) -> None:
+        if self.redis is None or not payloads:
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, payload in payloads.items():
+                pipe.set(f"{self.key_prefix}:{key}", payload.model_dump_json(), ex=int(self.cache.ttl))
+            await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"Triage cache redis error: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий, промахов и вытеснений кеша"""
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "evictions": self.cache.evictions,
+            "expirations": self.cache.expirations,
+            "size": len(self.cache),
+            "coalesced": self.coalesced,
+            "redis_hits": self.redis_hits,
+            "redis_misses": self.redis_misses,
+            "redis_errors": self.redis_errors,
+        }
@@ -0,0 +1,121 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from .base import LLMAdapter
+from .rule_based import RuleBasedLLM
+from ..config import config
+from ..models import InsightPayload
+from ..utils import generate_content_hash
+
+# Тег инсайтов, полученных запасным адаптером; по нему их можно найти для повторного анализа
+FALLBACK_TAG = "fallback"
+
+
+class HedgedLLMAdapter(LLMAdapter):
+    """
+    Дает основному адаптеру бюджет времени, при превышении или ошибке отвечает запасным.
+    В режиме "fallback" запасной адаптер вызывается после истечения бюджета,
+    в режиме "race" он запускается параллельно с основным.
+    Ответы запасного адаптера помечаются тегом FALLBACK_TAG и пониженной уверенностью.
+    """
+
+    def __init__(
+        self,
+        primary: LLMAdapter,
+        fallback: Optional[LLMAdapter] = None,
+        budget: Optional[float] = None,
+        mode: Optional[str] = None,
+        fallback_confidence: float = 0.5
+    ):
+        self.primary = primary
+        self.fallback = fallback or RuleBasedLLM()
+        self.budget = budget if budget is not None else config.LLM_LATENCY_BUDGET
+        self.mode = mode or config.LLM_HEDGE_MODE
+        self.fallback_confidence = fallback_confidence
+        self.version = f"hedged:{primary.version}"
+
+        if self.mode not in ("fallback", "race"):
+            raise ValueError(f"Unknown hedge mode: {self.mode}")
+
+        self.primary_count = 0
+        self.fallback_count = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def triage(self, note: str, context: Optional[Dict] = None, budget: Optional[float] = None) -> InsightPayload:
+        """budget сокращает бюджет основного адаптера, например до бюджета вызывающего запроса"""
+        budget = self.budget if budget is None else min(self.budget, budget)
+        payloads = await self._hedge(lambda adapter: self._as_list(adapter.triage(note, context)), budget)
+        return payloads[0]
+
+    async def triage_many(self, notes: List[str], contexts: Optional[List[Optional[Dict]]] = None) -> List[InsightPayload]:
+        """
+        Уникальные заметки пачки уходят в основной адаптер одним вызовом triage_many с общим бюджетом,
+        поэтому сохраняются дедупликация кеша и группировка запросов к удаленному API.
+        Если основной адаптер не уложился в бюджет или упал, эти заметки одним вызовом анализирует запасной
+        """
+        contexts = contexts or [None] * len(notes)
+        keys = [self._note_key(note, context) for note, context in zip(notes, contexts)]
+
+        unique: Dict[str, int] = {}
+        for index, key in enumerate(keys):
+            unique.setdefault(key, index)
+        unique_notes = [notes[index] for index in unique.values()]
+        unique_contexts = [contexts[index] for index in unique.values()]
+
+        payloads = await self._hedge(lambda adapter: adapter.triage_many(unique_notes, unique_contexts), self.budget)
+        resolved = dict(zip(unique, payloads))
+        return [resolved[key] for key in keys]
+
+    async def _hedge(self, call, budget: float) -> List[InsightPayload]:
+        fallback_task = asyncio.ensure_future(call(self.fallback)) if self.mode == "race" else None
+        primary_task = asyncio.ensure_future(call(self.primary))
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=budget)
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            if fallback_task is not None:
+                fallback_task.cancel()
+            raise
+
+        if not done:
+            primary_task.cancel()
+            self.timeouts += 1
+            print(f"Primary LLM adapter exceeded {budget}s budget, using fallback")
+        elif primary_task.exception() is not None:
+            self.errors += 1
+            print(f"Primary LLM adapter failed, using fallback: {primary_task.exception()}")
+        else:
+            if fallback_task is not None:
+                fallback_task.cancel()
+            payloads = primary_task.result()
+            self.primary_count += len(payloads)
+            return payloads
+
+        payloads = await (fallback_task if fallback_task is not None else call(self.fallback))
+        self.fallback_count += len(payloads)
+        return [self._mark_fallback(payload) for payload in payloads]
+
+    @staticmethod
+    async def _as_list(triage) -> List[InsightPayload]:
+        return [await triage]
+
+    @staticmethod
+    def _note_key(note: str, context: Optional[Dict]) -> str:
+        return (context or {}).get("content_hash") or generate_content_hash(note)
+
+    def _mark_fallback(self, payload: InsightPayload) -> InsightPayload:
+        return payload.model_copy(update={
+            "confidence": min(payload.confidence, self.fallback_confidence),
+            "tags": [*(payload.tags or []), FALLBACK_TAG]
+        })
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики ответов основного и запасного адаптеров"""
+        return {
+            "primary": self.primary_count,
+            "fallback": self.fallback_count,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
@@ -0,0 +1,120 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import httpx
+
+from .base import LLMAdapter
+from ..config import config
+from ..models import InsightPayload
+
+# Ревизию нужно увеличивать при изменении промпта
+PROMPT_REVISION = 1
+
+SYSTEM_PROMPT = (
+    "You triage inbound sales leads. Reply with a single JSON object and nothing else. "
+    "Keys: intent (one of: buy, support, spam, job, other), "
+    "priority (one of: P0, P1, P2, P3; P0 is the most urgent), "
+    "next_action (one of: call, email, ignore, qualify), "
+    "confidence (number from 0 to 1), tags (list of short lowercase strings)."
+)
+
+
+class OpenAILikeLLM(LLMAdapter):
+    """
+    Адаптер к OpenAI-совместимому HTTP API.
+    Использует постоянный пул соединений и ограничивает число одновременных запросов.
+    При batch_size > 1 triage_many отправляет пачки заметок одним запросом в /completions.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        max_in_flight: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.base_url = base_url or config.LLM_API_BASE
+        self.api_key = api_key if api_key is not None else config.LLM_API_KEY
+        self.model = model or config.LLM_MODEL
+        self.timeout = timeout or config.LLM_TIMEOUT
+        self.max_connections = max_connections or config.LLM_MAX_CONNECTIONS
+        self.batch_size = batch_size or config.LLM_BATCH_SIZE
+        self.transport = transport
+        self.version = f"openai_like:{self.model}:{PROMPT_REVISION}"
+
+        self._semaphore = asyncio.Semaphore(max_in_flight or config.LLM_MAX_IN_FLIGHT)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                transport=self.transport
+            )
+        return self._client
+
+    async def aclose(self):
+        """Закрывает пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def triage(self, note: str, context: Optional[Dict] = None) -> InsightPayload:
+        data = await self._post("/chat/completions", {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": note}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0
+        })
+        return self._parse(data["choices"][0]["message"]["content"])
+
+    async def triage_many(self, notes: List[str], contexts: Optional[List[Optional[Dict]]] = None) -> List[InsightPayload]:
+        if self.batch_size <= 1:
+            contexts = contexts or [None] * len(notes)
+            return list(await asyncio.gather(*(
+                self.triage(note, context) for note, context in zip(notes, contexts)
+            )))
+
+        chunks = [notes[i:i + self.batch_size] for i in range(0, len(notes), self.batch_size)]
+        results = await asyncio.gather(*(self._triage_batch(chunk) for chunk in chunks))
+        return [insight for chunk in results for insight in chunk]
+
+    async def _triage_batch(self, notes: List[str]) -> List[InsightPayload]:
+        data = await self._post("/completions", {
+            "model": self.model,
+            "prompt": [f"{SYSTEM_PROMPT}\n\nLead note:\n{note}\n\nJSON:" for note in notes],
+            "max_tokens": 256,
+            "temperature": 0
+        })
+
+        choices = sorted(data["choices"], key=lambda choice: choice["index"])
+        if len(choices) != len(notes):
+            raise ValueError(f"Expected {len(notes)} completions, got {len(choices)}")
+
+        return [self._parse(choice["text"]) for choice in choices]
+
+    async def _post(self, path: str, body: Dict) -> Dict:
+        async with self._semaphore:
+            response = await self._get_client().post(path, json=body)
+        response.raise_for_status()
+        return response.json()
+
+    def _parse(self, content: str) -> InsightPayload:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end < start:
+            raise ValueError(f"LLM response is not a JSON object: {content[:200]!r}")
+        return InsightPayload.model_validate_json(content[start:end + 1])
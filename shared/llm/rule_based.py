@@ -1,78 +1,178 @@
 import re
-from typing import Dict, Optional
+from itertools import accumulate
+from typing import Dict, FrozenSet, List, Optional, Tuple
 from .base import LLMAdapter
 from ..models import InsightPayload
+from ..utils import generate_content_hash
+
+# (класс, ключевые слова, только целое слово)
+KEYWORD_CLASSES: List[Tuple[str, Tuple[str, ...], bool]] = [
+    ("buy", ("price", "pricing", "стоимость", "купить", "счёт", "invoice", "purchase", "buy", "order",
+             "trial", "discount", "скидка", "пробная", "демо"), True),
+    ("support", ("support", "поддержка", "помощь", "не работает", "bug", "error", "проблема", "issue",
+                 "сломан", "broken", "fix", "repair", "troubleshoot"), True),
+    ("job", ("вакансия", "резюме", "собеседование", "job", "career", "vacancy", "cv", "resume", "interview",
+             "работа", "position", "hiring", "recruit"), True),
+    ("spam", ("spam", "реклама", "продам", "купим", "массовая", "рассылка",
+              "win", "won", "lottery", "prize", "congratulations"), True),
+    ("urgent", ("urgent", "срочно", "asap", "emergency", "critical", "немедленно",
+                "сегодня", "today", "now", "right now", "сейчас"), True),
+    ("high", ("next week", "на следующей неделе", "завтра", "tomorrow",
+              "important", "важно", "приоритет"), True),
+    ("clear_buy", ("price", "pricing", "купить", "invoice"), True),
+    ("clear_support", ("support", "не работает", "bug"), True),
+    ("clear_job", ("резюме", "interview", "вакансия"), True),
+    ("clear_spam", ("spam", "реклама", "win"), True),
+    ("tag_small_business", ("small", "startup", "начинающ"), False),
+    ("tag_urgent", ("urgent", "срочно", "asap"), False),
+    ("tag_technical", ("api", "integration", "техническ"), False),
+]
+
+SEATS_PATTERN = r'\d+\s*(?:seat|license|user|пользователь)'
+
+# Ревизию нужно увеличивать при изменении логики выбора intent/priority/next_action/confidence/tags
+RULESET_REVISION = 1
+RULESET_VERSION = f"rule_based:{RULESET_REVISION}:{generate_content_hash(repr((KEYWORD_CLASSES, SEATS_PATTERN)))[:12]}"
+
+_WORD_BOUNDARY = re.compile(r'\b')
+
+
+def _trie_regex(words) -> str:
+    """Собирает регулярное выражение-префиксное дерево, предпочитающее самое длинное совпадение"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Находит все классы ключевых слов за один проход по тексту"""
+
+    def __init__(self, keyword_classes=KEYWORD_CLASSES, seats_pattern: str = SEATS_PATTERN):
+        self._entries: Dict[str, List[Tuple[str, bool]]] = {}
+        for keyword_class, words, whole_word in keyword_classes:
+            for word in words:
+                self._entries.setdefault(word, []).append((keyword_class, whole_word))
+
+        # Все ключевые слова, совпадающие в одной позиции, являются префиксами самого длинного из них,
+        # поэтому для каждого слова заранее раскладываем классы его префиксов
+        self._prefix_classes: Dict[str, Tuple[FrozenSet[str], List[Tuple[int, FrozenSet[str]]]]] = {}
+        for word in self._entries:
+            always = set()
+            whole_word_checks = []
+            for prefix, entries in self._entries.items():
+                if not word.startswith(prefix):
+                    continue
+                always.update(keyword_class for keyword_class, whole_word in entries if not whole_word)
+                whole_word_classes = frozenset(keyword_class for keyword_class, whole_word in entries if whole_word)
+                if whole_word_classes:
+                    whole_word_checks.append((len(prefix), whole_word_classes))
+            self._prefix_classes[word] = (frozenset(always), whole_word_checks)
+
+        self._class_count = len({keyword_class for keyword_class, _, _ in keyword_classes}) + 1
+
+        self._pattern = re.compile(
+            r'\b(?=(?:(?P<keyword>%s)|(?P<seats>%s)))' % (_trie_regex(self._entries), seats_pattern)
+        )
+
+    def match(self, text: str) -> FrozenSet[str]:
+        """Возвращает множество классов, найденных в тексте (ожидается текст в нижнем регистре)"""
+        found = set()
+
+        for match in self._pattern.finditer(text):
+            self._collect(match, text, found)
+
+            if len(found) == self._class_count:
+                break
+
+        return frozenset(found)
+
+    def match_many(self, texts: List[str]) -> List[FrozenSet[str]]:
+        """Находит классы для пачки текстов за один проход по их склейке"""
+        # \x00 не является ни символом слова, ни пробелом, поэтому совпадения не пересекают границы текстов
+        joined = "\x00".join(texts)
+        ends = list(accumulate(len(text) + 1 for text in texts))
+        found = [set() for _ in texts]
+
+        index = 0
+        for match in self._pattern.finditer(joined):
+            start = match.start()
+            while start >= ends[index]:
+                index += 1
+            self._collect(match, joined, found[index])
+
+        return [frozenset(classes) for classes in found]
+
+    def _collect(self, match: re.Match, text: str, found: set) -> None:
+        keyword = match.group("keyword")
+        if keyword is None:
+            found.add("tag_enterprise")
+            return
+
+        always, whole_word_checks = self._prefix_classes[keyword]
+        found.update(always)
+        start = match.start()
+        for length, classes in whole_word_checks:
+            if not classes <= found and _WORD_BOUNDARY.match(text, start + length):
+                found.update(classes)
+
 
 class RuleBasedLLM(LLMAdapter):
+    version = RULESET_VERSION
+
+    def __init__(self):
+        self.matcher = KeywordMatcher()
+
     async def triage(self, note: str, context: Optional[Dict] = None) -> InsightPayload:
-        note_lower = note.lower()
-        
-        intent = self._detect_intent(note_lower)
-        
-        priority = self._detect_priority(note_lower, intent)
-        
+        return InsightPayload(**self._build_fields(self.matcher.match(note.lower())))
+
+    async def triage_many(self, notes: List[str], contexts: Optional[List[Optional[Dict]]] = None) -> List[InsightPayload]:
+        matches = self.matcher.match_many([note.lower() for note in notes])
+
+        return [InsightPayload(**self._build_fields(note_matches)) for note_matches in matches]
+
+    def _build_fields(self, matches: FrozenSet[str]) -> Dict:
+        intent = self._detect_intent(matches)
+
+        priority = self._detect_priority(matches, intent)
+
         next_action = self._detect_next_action(intent, priority)
-        
-        confidence = self._calculate_confidence(note_lower, intent)
-        
-        tags = self._extract_tags(note_lower)
-        
-        return InsightPayload(
-            intent=intent,
-            priority=priority,
-            next_action=next_action,
-            confidence=confidence,
-            tags=tags
-        )
-    
-    def _detect_intent(self, note: str) -> str:
-        buy_patterns = [
-            r'\b(price|pricing|стоимость|купить|счёт|invoice|purchase|buy|order)\b',
-            r'\b(trial|discount|скидка|пробная|демо)\b'
-        ]
-        
-        support_patterns = [
-            r'\b(support|поддержка|помощь|не работает|bug|error|проблема|issue)\b',
-            r'\b(сломан|broken|fix|repair|troubleshoot)\b'
-        ]
-        
-        job_patterns = [
-            r'\b(вакансия|резюме|собеседование|job|career|vacancy|cv|resume|interview)\b',
-            r'\b(работа|position|hiring|recruit)\b'
-        ]
-        
-        spam_patterns = [
-            r'\b(spam|реклама|продам|купим|массовая|рассылка)\b',
-            r'\b(win|won|lottery|prize|congratulations)\b'
-        ]
-        
-        if any(re.search(pattern, note) for pattern in buy_patterns):
-            return "buy"
-        elif any(re.search(pattern, note) for pattern in support_patterns):
-            return "support"
-        elif any(re.search(pattern, note) for pattern in job_patterns):
-            return "job"
-        elif any(re.search(pattern, note) for pattern in spam_patterns):
-            return "spam"
-        else:
-            return "other"
-    
-    def _detect_priority(self, note: str, intent: str) -> str:
-        urgent_patterns = [
-            r'\b(urgent|срочно|asap|emergency|critical|немедленно)\b',
-            r'\b(сегодня|today|now|right now|сейчас)\b'
-        ]
-        
-        high_patterns = [
-            r'\b(next week|на следующей неделе|завтра|tomorrow)\b',
-            r'\b(important|важно|приоритет)\b'
-        ]
-        
+
+        confidence = self._calculate_confidence(matches, intent)
+
+        tags = self._extract_tags(matches)
+
+        return {
+            "intent": intent,
+            "priority": priority,
+            "next_action": next_action,
+            "confidence": confidence,
+            "tags": tags
+        }
+
+    def _detect_intent(self, matches: FrozenSet[str]) -> str:
+        for intent in ("buy", "support", "job", "spam"):
+            if intent in matches:
+                return intent
+        return "other"
+
+    def _detect_priority(self, matches: FrozenSet[str], intent: str) -> str:
         if intent == "spam":
             return "P3"
-        elif any(re.search(pattern, note) for pattern in urgent_patterns):
+        elif "urgent" in matches:
             return "P0"
-        elif any(re.search(pattern, note) for pattern in high_patterns):
+        elif "high" in matches:
             return "P1"
         elif intent == "buy":
             return "P1"
@@ -80,7 +180,7 @@ class RuleBasedLLM(LLMAdapter):
             return "P2"
         else:
             return "P3"
-    
+
     def _detect_next_action(self, intent: str, priority: str) -> str:
         if intent == "spam":
             return "ignore"
@@ -94,37 +194,27 @@ class RuleBasedLLM(LLMAdapter):
             return "call"
         else:
             return "qualify"
-    
-    def _calculate_confidence(self, note: str, intent: str) -> float:
+
+    def _calculate_confidence(self, matches: FrozenSet[str], intent: str) -> float:
         base_confidence = 0.7
-        
-        clear_patterns = {
-            "buy": [r'\b(price|pricing|купить|invoice)\b'],
-            "support": [r'\b(support|не работает|bug)\b'],
-            "job": [r'\b(резюме|interview|вакансия)\b'],
-            "spam": [r'\b(spam|реклама|win)\b']
-        }
-        
-        if intent in clear_patterns:
-            pattern_matches = sum(1 for pattern in clear_patterns[intent] 
-                                if re.search(pattern, note))
-            if pattern_matches > 0:
-                base_confidence = min(0.95, base_confidence + 0.1 * pattern_matches)
-        
+
+        if f"clear_{intent}" in matches:
+            base_confidence = min(0.95, base_confidence + 0.1)
+
         return round(base_confidence, 2)
-    
-    def _extract_tags(self, note: str) -> list:
+
+    def _extract_tags(self, matches: FrozenSet[str]) -> list:
         tags = []
-        
-        if re.search(r'\b(\d+)\s*(seat|license|user|пользователь)', note):
+
+        if "tag_enterprise" in matches:
             tags.append("enterprise")
-        elif re.search(r'\b(small|startup|начинающ)', note):
+        elif "tag_small_business" in matches:
             tags.append("small_business")
-        
-        if re.search(r'\b(urgent|срочно|asap)', note):
+
+        if "tag_urgent" in matches:
             tags.append("urgent")
-        
-        if re.search(r'\b(api|integration|техническ)', note):
+
+        if "tag_technical" in matches:
             tags.append("technical")
-        
-        return tags
\ No newline at end of file
+
+        return tags
@@ -1,7 +1,9 @@
+import asyncio
 import redis
+import redis.asyncio as aioredis
 import json
 import uuid
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 from .config import config
 from .models import QueueEvent
@@ -11,17 +13,51 @@ class RedisQueue:
         self.redis = redis.from_url(config.REDIS_URL, decode_responses=True)
         self.stream_name = config.QUEUE_STREAM_NAME
         self.consumer_group = config.CONSUMER_GROUP
+        self.dead_letter_stream = config.DEAD_LETTER_STREAM_NAME
+        self.insight_channel = config.INSIGHT_CHANNEL
         
-    async def publish_event(self, event: QueueEvent) -> str:
-        """Публикует событие в Redis Stream"""
+        # Публикация идет через async клиент, чтобы не блокировать event loop API
+        self._async_redis = None
+        self._async_loop = None
+    
+    def get_async_redis(self):
+        """
+        Async клиент с общим пулом соединений процесса: через него работают и кеш ключей идемпотентности,
+        и блокировки single-flight, и подписка на инсайты. Привязан к event loop, поэтому пересоздается при его смене
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_redis is None or self._async_loop is not loop:
+            self._async_redis = aioredis.from_url(config.REDIS_URL, decode_responses=True)
+            self._async_loop = loop
+        return self._async_redis
+    
+    async def aclose(self):
+        """Закрывает общий async клиент; вызывается при остановке сервиса"""
+        if self._async_redis is not None:
+            await self._async_redis.aclose()
+            self._async_redis = None
+            self._async_loop = None
+    
+    def _serialize(self, event: QueueEvent) -> Dict[str, Any]:
         event_data = event.model_dump()
         event_data["occurred_at"] = event_data["occurred_at"].isoformat()
+        return event_data
         
-        message_id = self.redis.xadd(
-            self.stream_name,
-            event_data
-        )
-        return message_id
+    async def publish_event(self, event: QueueEvent) -> str:
+        """Публикует событие в Redis Stream"""
+        return await self.get_async_redis().xadd(self.stream_name, self._serialize(event))
+    
+    async def publish_events(self, events: List[QueueEvent]) -> List[str]:
+        """
+        Публикует пачку событий одним pipeline. События лидов публикует outbox relay пачками из outbox,
+        поэтому XADD конкурентных запросов API объединять в окне времени не нужно
+        """
+        if not events:
+            return []
+        pipe = self.get_async_redis().pipeline(transaction=False)
+        for event in events:
+            pipe.xadd(self.stream_name, self._serialize(event))
+        return await pipe.execute()
     
     def create_consumer_group(self, consumer_group: Optional[str] = None):
         """Создает consumer group если не существует"""
@@ -45,20 +81,149 @@ class RedisQueue:
             
             events = []
             for stream, msgs in messages:
-                for msg_id, fields in msgs:
-                    if "occurred_at" in fields:
-                        fields["occurred_at"] = datetime.fromisoformat(fields["occurred_at"])
-                    
-                    event = QueueEvent(**fields)
-                    events.append((msg_id, event))
+                events.extend(self._parse_messages(msgs))
             
             return events
         except Exception as e:
             print(f"Error consuming events: {e}")
             return []
     
+    def _parse_messages(self, messages) -> List[Tuple[str, QueueEvent]]:
+        """
+        Превращает сообщения стрима в события.
+        Нечитаемые сообщения пропускаются и остаются в PEL, откуда после
+        исчерпания попыток доставки попадают в dead-letter стрим.
+        """
+        events = []
+        for msg_id, fields in messages:
+            if fields is None:
+                continue
+            try:
+                fields = dict(fields)
+                if "occurred_at" in fields:
+                    fields["occurred_at"] = datetime.fromisoformat(fields["occurred_at"])
+                
+                events.append((msg_id, QueueEvent(**fields)))
+            except Exception as e:
+                print(f"Invalid message {msg_id}: {e}")
+        return events
+    
+    def pending_entries(self, min_idle_ms: int, count: int = 100, start: str = "-") -> List[Dict[str, Any]]:
+        """
+        Возвращает страницу записей PEL группы, простаивающих не меньше min_idle_ms, вместе с числом доставок.
+        start - id, с которого начинается страница; "(<id>" продолжает после записи id
+        """
+        return self.redis.xpending_range(
+            self.stream_name,
+            self.consumer_group,
+            min=start,
+            max="+",
+            count=count,
+            idle=min_idle_ms
+        )
+    
+    def claim_events(self, consumer_name: str, message_ids: List[str], min_idle_ms: int) -> List[Tuple[str, QueueEvent]]:
+        """Забирает зависшие сообщения себе (XCLAIM) и возвращает их как события"""
+        if not message_ids:
+            return []
+        
+        messages = self.redis.xclaim(
+            self.stream_name,
+            self.consumer_group,
+            consumer_name,
+            min_idle_ms,
+            message_ids
+        )
+        return self._parse_messages(messages)
+    
+    def dead_letter(self, consumer_name: str, message_ids: List[str], min_idle_ms: int, reason: str) -> int:
+        """Переносит сообщения в dead-letter стрим и снимает их с PEL основной группы"""
+        if not message_ids:
+            return 0
+        
+        # XCLAIM гарантирует, что сообщение не забрал параллельно другой consumer, и отдает его поля
+        messages = self.redis.xclaim(
+            self.stream_name,
+            self.consumer_group,
+            consumer_name,
+            min_idle_ms,
+            message_ids
+        )
+        
+        pipe = self.redis.pipeline()
+        moved = []
+        for msg_id, fields in messages:
+            if fields is None:
+                continue
+            pipe.xadd(self.dead_letter_stream, {
+                **fields,
+                "dead_letter_original_id": msg_id,
+                "dead_letter_reason": reason,
+                "dead_letter_at": datetime.utcnow().isoformat()
+            })
+            moved.append(msg_id)
+        if moved:
+            pipe.xack(self.stream_name, self.consumer_group, *moved)
+            pipe.execute()
+        return len(moved)
+    
+    def read_dead_letters(self, count: int = 100, start: str = "-") -> List[Tuple[str, Dict[str, str]]]:
+        """Возвращает сообщения dead-letter стрима для просмотра"""
+        return self.redis.xrange(self.dead_letter_stream, min=start, max="+", count=count)
+    
+    def replay_dead_letters(self, message_ids: List[str]) -> int:
+        """Возвращает сообщения из dead-letter стрима в основной стрим"""
+        replayed = 0
+        for msg_id in message_ids:
+            entries = self.redis.xrange(self.dead_letter_stream, min=msg_id, max=msg_id)
+            if not entries:
+                print(f"Dead letter {msg_id} not found")
+                continue
+            
+            _, fields = entries[0]
+            original = {key: value for key, value in fields.items() if not key.startswith("dead_letter_")}
+            
+            pipe = self.redis.pipeline()
+            pipe.xadd(self.stream_name, original)
+            pipe.xdel(self.dead_letter_stream, msg_id)
+            pipe.execute()
+            replayed += 1
+        return replayed
+    
     def ack_message(self, message_id: str):
         """Подтверждает обработку сообщения"""
         self.redis.xack(self.stream_name, self.consumer_group, message_id)
+    
+    def ack_messages(self, message_ids: List[str]):
+        """Подтверждает обработку пачки сообщений одним XACK"""
+        if message_ids:
+            self.redis.xack(self.stream_name, self.consumer_group, *message_ids)
+    
+    def notify_insights_ready(self, lead_ids: List[str]):
+        """
+        Сообщает через pub/sub, что для лидов сохранены инсайты; их ждут long-poll и SSE клиенты insights-api.
+        Уведомление не гарантировано, поэтому ошибки Redis только логируются
+        """
+        if not lead_ids:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for lead_id in lead_ids:
+                pipe.publish(self.insight_channel, lead_id)
+            pipe.execute()
+        except Exception as e:
+            print(f"Failed to notify about ready insights: {e}")
+    
+    async def notify_insights_ready_async(self, lead_ids: List[str]):
+        """То же, что notify_insights_ready, через async клиент"""
+        if not lead_ids:
+            return
+        try:
+            pipe = self.get_async_redis().pipeline(transaction=False)
+            for lead_id in lead_ids:
+                pipe.publish(self.insight_channel, lead_id)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Failed to notify about ready insights: {e}")
 
 queue = RedisQueue()
\ No newline at end of file
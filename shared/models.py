@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Dict, Any
 from datetime import datetime
 from uuid import UUID
 
@@ -24,6 +24,26 @@ class Lead(BaseModel):
     class Config:
         from_attributes = True  
 
+class LeadBatchRequest(BaseModel):
+    """
+    Пачка лидов для массовой загрузки.
+    Элементы валидируются по LeadRequest поштучно, чтобы одна ошибка не отклоняла всю пачку;
+    ключ идемпотентности задается полем idempotency_key элемента или выводится из ключа пачки
+    """
+    items: List[Any] = Field(..., min_length=1)
+
+class LeadBatchItemResult(BaseModel):
+    """Результат обработки одного элемента пачки"""
+    index: int
+    status_code: int
+    idempotency_key: Optional[str] = None
+    lead: Optional[Lead] = None
+    error: Optional[str] = None
+
+class LeadBatchResponse(BaseModel):
+    """Ответ на массовую загрузку лидов"""
+    results: List[LeadBatchItemResult]
+
 class InsightPayload(BaseModel):
     """Результат работы LLM адаптера"""
     intent: Literal["buy", "support", "spam", "job", "other"]
@@ -46,6 +66,66 @@ class Insight(BaseModel):
     class Config:
         from_attributes = True
 
+    @classmethod
+    def from_db(cls, insight_db) -> "Insight":
+        """Строит ответ из InsightDB: теги хранятся отдельными строками insight_tags"""
+        return cls(
+            id=insight_db.id,
+            lead_id=insight_db.lead_id,
+            intent=insight_db.intent,
+            priority=insight_db.priority,
+            next_action=insight_db.next_action,
+            confidence=insight_db.confidence,
+            tags=insight_db.tags,
+            created_at=insight_db.created_at
+        )
+
+class InsightBatchRequest(BaseModel):
+    """Запрос последних инсайтов для пачки лидов"""
+    lead_ids: List[str] = Field(..., min_length=1)
+
+class InsightBatchResponse(BaseModel):
+    """Последний инсайт по каждому запрошенному лиду; None, если инсайта еще нет"""
+    insights: Dict[str, Optional[Insight]]
+
+class InsightFilters(BaseModel):
+    """Фильтры списка инсайтов; created_after включительно, created_before исключительно"""
+    intent: Optional[Literal["buy", "support", "spam", "job", "other"]] = None
+    priority: Optional[Literal["P0", "P1", "P2", "P3"]] = None
+    next_action: Optional[Literal["call", "email", "ignore", "qualify"]] = None
+    source: Optional[str] = None
+    tag: List[str] = Field(default_factory=list, description="Теги, которые все должны быть у инсайта")
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+class InsightPageQuery(InsightFilters):
+    """Параметры страницы списка инсайтов"""
+    cursor: Optional[str] = Field(None, description="next_cursor предыдущей страницы")
+    limit: Optional[int] = Field(None, ge=1, description="Размер страницы (не больше INSIGHT_PAGE_MAX_SIZE)")
+
+class InsightPage(BaseModel):
+    """Страница списка инсайтов от новых к старым; next_cursor передается в следующий запрос"""
+    items: List[Insight]
+    next_cursor: Optional[str] = None
+
+class TriageStatsBucket(BaseModel):
+    """Число инсайтов в интервале; измерения, по которым не группировали, равны None"""
+    bucket_start: datetime
+    intent: Optional[str] = None
+    priority: Optional[str] = None
+    next_action: Optional[str] = None
+    source: Optional[str] = None
+    count: int
+
+class TriageStatsResponse(BaseModel):
+    """Статистика анализа по часовым или дневным интервалам"""
+    granularity: Literal["hour", "day"]
+    buckets: List[TriageStatsBucket]
+
+class LeadWithInsight(Lead):
+    """Лид вместе с инсайтом, полученным при inline-анализе; None, если анализ не уложился в бюджет"""
+    insight: Optional[Insight] = Field(...)
+
 class QueueEvent(BaseModel):
     """Событие в очереди"""
     event_id: str
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from .config import config
+from .database import SessionLocal, OutboxEventDB
+from .message_queue import queue
+from .models import QueueEvent
+
+
+def add_outbox_events(db: Session, events: List[QueueEvent]):
+    """Добавляет события в outbox текущей транзакции; публикацией займется OutboxRelay"""
+    db.add_all([
+        OutboxEventDB(
+            event_id=event.event_id,
+            type=event.type,
+            lead_id=event.lead_id,
+            content_hash=event.content_hash,
+            occurred_at=event.occurred_at
+        )
+        for event in events
+    ])
+
+
+class OutboxRelay:
+    """
+    Переносит события из outbox в Redis Stream пачками.
+    Доставка at-least-once: при сбое между XADD и фиксацией прогресса пачка будет опубликована
+    повторно, дубликаты отсекает дедупликация воркера по (lead_id, content_hash).
+    Рассчитан на один экземпляр relay.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, poll_interval: Optional[float] = None,
+                 retention: Optional[float] = None, session_factory=None):
+        self.SessionLocal = session_factory or SessionLocal
+        self.batch_size = batch_size or config.OUTBOX_BATCH_SIZE
+        self.poll_interval = poll_interval if poll_interval is not None else config.OUTBOX_POLL_INTERVAL
+        self.retention = retention if retention is not None else config.OUTBOX_RETENTION
+        self._next_cleanup_at = 0.0
+        self._stopping = False
+
+    async def run(self):
+        """Основной цикл relay"""
+        print("Outbox relay started")
+
+        while not self._stopping:
+            try:
+                published = await self.relay_batch()
+
+                if time.monotonic() >= self._next_cleanup_at:
+                    self._next_cleanup_at = time.monotonic() + config.OUTBOX_CLEANUP_INTERVAL
+                    self.cleanup()
+
+                if published < self.batch_size:
+                    await asyncio.sleep(self.poll_interval)
+
+            except Exception as e:
+                print(f"Error in outbox relay: {e}")
+                await asyncio.sleep(1)
+
+        print("Outbox relay stopped")
+
+    def stop(self):
+        self._stopping = True
+
+    async def relay_batch(self) -> int:
+        """Публикует следующую пачку неопубликованных событий одним pipeline и отмечает их"""
+        db = self.SessionLocal()
+        try:
+            rows = (
+                db.query(OutboxEventDB)
+                .filter(OutboxEventDB.published_at.is_(None))
+                .order_by(OutboxEventDB.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                return 0
+
+            await queue.publish_events([
+                QueueEvent(
+                    event_id=row.event_id,
+                    type=row.type,
+                    lead_id=row.lead_id,
+                    content_hash=row.content_hash,
+                    occurred_at=row.occurred_at
+                )
+                for row in rows
+            ])
+
+            db.query(OutboxEventDB).filter(
+                OutboxEventDB.id.in_([row.id for row in rows])
+            ).update({OutboxEventDB.published_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+
+            print(f"Published {len(rows)} outbox events")
+            return len(rows)
+
+        except Exception:
+            db.rollback()
+            raise
+
+        finally:
+            db.close()
+
+    def cleanup(self) -> int:
+        """Удаляет опубликованные события старше retention ограниченными пачками"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        deleted = 0
+
+        db = self.SessionLocal()
+        try:
+            while True:
+                ids = [
+                    row.id for row in
+                    db.query(OutboxEventDB.id)
+                    .filter(OutboxEventDB.published_at.is_not(None), OutboxEventDB.published_at < cutoff)
+                    .limit(self.batch_size)
+                ]
+                if not ids:
+                    break
+
+                db.query(OutboxEventDB).filter(OutboxEventDB.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+                deleted += len(ids)
+
+        finally:
+            db.close()
+
+        if deleted:
+            print(f"Deleted {deleted} published outbox events")
+        return deleted
@@ -0,0 +1,110 @@
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, InsightDB, LeadDB, TriageRollupDB
+
+GRANULARITIES = ("hour", "day")
+REBUILD_BATCH_SIZE = 10000
+# 7 параметров на строку, SQLite ограничивает число параметров запроса
+INCREMENT_CHUNK_SIZE = 1000
+
+
+def bucket_start(created_at: datetime, granularity: str) -> datetime:
+    """Начало часового или дневного интервала, в который попадает created_at"""
+    bucket = created_at.replace(minute=0, second=0, microsecond=0)
+    return bucket.replace(hour=0) if granularity == "day" else bucket
+
+
+def count_buckets(insights: Iterable[Tuple[InsightDB, Optional[str]]]) -> Counter:
+    """
+    Считает инсайты (с источником их лида) по ключам роллапов всех гранулярностей.
+    Вместо InsightDB подойдет любая строка с created_at, intent, priority и next_action
+    """
+    counts = Counter()
+    for insight, source in insights:
+        for granularity in GRANULARITIES:
+            counts[(
+                granularity,
+                bucket_start(insight.created_at, granularity),
+                insight.intent,
+                insight.priority,
+                insight.next_action,
+                source or ""
+            )] += 1
+    return counts
+
+
+def rollup_increment(counts: Counter, dialect_name: str):
+    """
+    INSERT ... ON CONFLICT DO UPDATE, прибавляющий counts к роллапам.
+    Выполняется в транзакции, сохраняющей инсайты, поэтому роллапы не расходятся с таблицей insights
+    """
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    statement = insert(TriageRollupDB).values([
+        {
+            "granularity": granularity,
+            "bucket_start": bucket,
+            "intent": intent,
+            "priority": priority,
+            "next_action": next_action,
+            "source": source,
+            "count": count
+        }
+        for (granularity, bucket, intent, priority, next_action, source), count in counts.items()
+    ])
+    return statement.on_conflict_do_update(
+        index_elements=[column.name for column in TriageRollupDB.__table__.primary_key],
+        set_={"count": TriageRollupDB.count + statement.excluded["count"]}
+    )
+
+
+def add_to_rollups(db: Session, insights: Iterable[Tuple[InsightDB, Optional[str]]]):
+    """Добавляет инсайты в роллапы в текущей транзакции синхронной сессии"""
+    counts = count_buckets(insights)
+    if counts:
+        db.execute(rollup_increment(counts, db.get_bind().dialect.name))
+
+
+def rebuild_rollups(since: Optional[datetime] = None, session_factory=None,
+                    batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """
+    Пересчитывает роллапы по таблице insights одной транзакцией: с начала дня since или полностью.
+    Инсайты читаются порциями по batch_size, в памяти держатся только счетчики интервалов.
+    Возвращает число пересчитанных инсайтов
+    """
+    since = bucket_start(since, "day") if since else None
+    db = (session_factory or SessionLocal)()
+    try:
+        deleted = db.query(TriageRollupDB)
+        if since:
+            deleted = deleted.filter(TriageRollupDB.bucket_start >= since)
+        deleted.delete(synchronize_session=False)
+
+        query = db.query(
+            InsightDB.created_at, InsightDB.intent, InsightDB.priority, InsightDB.next_action, LeadDB.source
+        ).outerjoin(LeadDB, LeadDB.id == InsightDB.lead_id)
+        if since:
+            query = query.filter(InsightDB.created_at >= since)
+
+        counts = count_buckets((row, row.source) for row in query.yield_per(batch_size))
+        # Каждый инсайт попадает ровно в один дневной интервал
+        total = sum(count for key, count in counts.items() if key[0] == "day")
+
+        items = list(counts.items())
+        for i in range(0, len(items), INCREMENT_CHUNK_SIZE):
+            db.execute(rollup_increment(Counter(dict(items[i:i + INCREMENT_CHUNK_SIZE])), db.get_bind().dialect.name))
+        db.commit()
+
+    except Exception:
+        db.rollback()
+        raise
+
+    finally:
+        db.close()
+
+    print(f"Rebuilt triage rollups from {total} insights ({len(counts)} buckets)")
+    return total
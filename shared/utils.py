@@ -1,10 +1,17 @@
 import hashlib
+import json
 from datetime import datetime
+from typing import Any, Dict
 
 def generate_content_hash(content: str) -> str:
     """Генерирует SHA-256 хеш для контента"""
     return hashlib.sha256(content.encode()).hexdigest()
 
+def generate_request_fingerprint(data: Dict[str, Any]) -> str:
+    """SHA-256 канонического JSON запроса: не зависит от порядка ключей и форматирования"""
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return generate_content_hash(canonical)
+
 def mask_email(email: str) -> str:
     """Маскирует email для логов"""
     if not email or '@' not in email:
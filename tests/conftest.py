@@ -0,0 +1,105 @@
+import os
+import sys
+import uuid
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from shared.database import Base, get_async_db
+from shared.message_queue import queue
+
+
+def load_service_app(service: str):
+    """
+    Импортирует app сервиса (intake-api или insights-api). У сервисов одинаковые имена модулей
+    main/routes/services, поэтому каталог сервиса ставится первым, а ранее импортированные модули удаляются
+    """
+    service_dir = str(project_root / service)
+    if service_dir in sys.path:
+        sys.path.remove(service_dir)
+    sys.path.insert(0, service_dir)
+
+    for module in [k for k in sys.modules.keys() if k.startswith('main') or k.startswith('routes') or k.startswith('services')]:
+        del sys.modules[module]
+
+    original_cwd = os.getcwd()
+    os.chdir(service_dir)
+    try:
+        import main
+    finally:
+        os.chdir(original_cwd)
+    return main.app
+
+
+@contextmanager
+def service_client(service: str, db_path: Path, **engine_options):
+    """TestClient сервиса, async сессии которого открываются на тестовой базе db_path"""
+    app = load_service_app(service)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", **engine_options)
+    session_factory = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        with TestClient(app) as client:
+            client.async_engine = async_engine
+            yield client
+            client.portal.call(async_engine.dispose)
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Отдельная SQLite база со схемой, чтобы не трогать database.sqlite"""
+    path = tmp_path / "test.sqlite"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def session_factory(db_path):
+    """Синхронные сессии тестовой базы; путь к ней доступен как session_factory.db_path"""
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    factory.db_path = db_path
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def app_client(db_path):
+    """Открывает TestClient сервиса на тестовой базе: app_client("insights-api", pool_size=2)"""
+    with ExitStack() as stack:
+        yield lambda service, **engine_options: stack.enter_context(service_client(service, db_path, **engine_options))
+
+
+@pytest.fixture
+def redis_queue(monkeypatch):
+    """Общая очередь на отдельном стриме реального Redis; тест пропускается, если Redis недоступен"""
+    try:
+        queue.redis.ping()
+    except Exception as e:
+        pytest.skip(f"Redis unavailable: {e}")
+
+    suffix = uuid.uuid4().hex[:8]
+    monkeypatch.setattr(queue, "stream_name", f"test_events:{suffix}")
+    monkeypatch.setattr(queue, "consumer_group", f"test_workers:{suffix}")
+    monkeypatch.setattr(queue, "dead_letter_stream", f"test_events:{suffix}:dead")
+    queue.create_consumer_group()
+    yield queue
+    queue.redis.delete(queue.stream_name, queue.dead_letter_stream)
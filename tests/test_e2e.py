@@ -23,8 +23,10 @@ class TestRealE2E:
             intake_dir = project_root / "intake-api"
             os.chdir(intake_dir)
             
-            if str(intake_dir) not in sys.path:
-                sys.path.insert(0, str(intake_dir))
+            # Каталог сервиса должен идти первым, иначе импортируется main другого сервиса
+            if str(intake_dir) in sys.path:
+                sys.path.remove(str(intake_dir))
+            sys.path.insert(0, str(intake_dir))
             
             modules_to_clear = [k for k in sys.modules.keys() if k.startswith('main') or k.startswith('routes')]
             for module in modules_to_clear:
@@ -34,6 +36,8 @@ class TestRealE2E:
             import main as intake_main
             os.chdir(original_cwd)
             
+            # TestClient без with не вызывает startup, а схема database.sqlite обновляется миграциями init_db
+            intake_main.init_db()
             return TestClient(intake_main.app)
             
         except Exception as e:
@@ -48,8 +52,10 @@ class TestRealE2E:
             insights_dir = project_root / "insights-api"
             os.chdir(insights_dir)
             
-            if str(insights_dir) not in sys.path:
-                sys.path.insert(0, str(insights_dir))
+            # Каталог сервиса должен идти первым, иначе импортируется main другого сервиса
+            if str(insights_dir) in sys.path:
+                sys.path.remove(str(insights_dir))
+            sys.path.insert(0, str(insights_dir))
             
             modules_to_clear = [k for k in sys.modules.keys() if k.startswith('main') or k.startswith('routes')]
             for module in modules_to_clear:
@@ -59,6 +65,8 @@ class TestRealE2E:
             import main as insights_main
             os.chdir(original_cwd)
             
+            # TestClient без with не вызывает startup, а схема database.sqlite обновляется миграциями init_db
+            insights_main.init_db()
             return TestClient(insights_main.app)
             
         except Exception as e:
@@ -0,0 +1,113 @@
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from shared.config import config
+from shared.llm import HedgedLLMAdapter, CachedLLMAdapter, OpenAILikeLLM, RuleBasedLLM, FALLBACK_TAG, get_llm_adapter
+from shared.llm.cache import TriageCache
+from shared.llm.base import LLMAdapter
+
+
+class SlowLLM(RuleBasedLLM):
+    """Основной адаптер с искусственной задержкой ответа"""
+
+    def __init__(self, delay, fail=False):
+        super().__init__()
+        self.delay = delay
+        self.fail = fail
+
+    async def triage(self, note, context=None):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("backend unavailable")
+        payload = await super().triage(note, context)
+        return payload.model_copy(update={"confidence": 0.99})
+
+    triage_many = LLMAdapter.triage_many
+
+
+class CountingLLM(RuleBasedLLM):
+    """Основной адаптер, запоминающий заметки каждого вызова triage_many"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def triage_many(self, notes, contexts=None):
+        self.calls.append(list(notes))
+        return await super().triage_many(notes, contexts)
+
+
+class TestHedgedLLMAdapter:
+    @pytest.mark.parametrize("mode", ["fallback", "race"])
+    def test_fast_primary_wins(self, mode):
+        """Основной адаптер, уложившийся в бюджет, отвечает без пометок"""
+        adapter = HedgedLLMAdapter(SlowLLM(0), budget=1, mode=mode)
+
+        insight = asyncio.run(adapter.triage("Need pricing"))
+
+        assert insight.confidence == 0.99
+        assert FALLBACK_TAG not in insight.tags
+        assert adapter.stats()["primary"] == 1
+
+    @pytest.mark.parametrize("mode", ["fallback", "race"])
+    def test_slow_primary_falls_back(self, mode):
+        """При превышении бюджета отвечает rule-based адаптер с тегом fallback"""
+        adapter = HedgedLLMAdapter(SlowLLM(5), budget=0.05, mode=mode)
+
+        insights = asyncio.run(adapter.triage_many(["Need pricing asap", "bug"]))
+
+        print(f"\n📊 Hedge stats: {adapter.stats()}")
+        assert [insight.intent for insight in insights] == ["buy", "support"]
+        assert all(FALLBACK_TAG in insight.tags and insight.confidence <= 0.5 for insight in insights)
+        assert insights[0].tags == ["urgent", FALLBACK_TAG]
+        assert adapter.stats() == {"primary": 0, "fallback": 2, "timeouts": 1, "errors": 0}
+
+    def test_batch_reaches_primary_in_one_call(self):
+        """Пачка уходит в основной адаптер одним triage_many, повторяющиеся заметки - один раз"""
+        primary = CountingLLM()
+        adapter = HedgedLLMAdapter(primary, budget=1)
+
+        insights = asyncio.run(adapter.triage_many(["Need pricing"] * 20 + ["bug"]))
+
+        print(f"\n📊 Primary calls: {primary.calls}")
+        assert primary.calls == [["Need pricing", "bug"]]
+        assert [insight.intent for insight in insights] == ["buy"] * 20 + ["support"]
+        assert adapter.stats()["primary"] == 2
+
+    def test_repeated_notes_reach_backend_once_through_cache(self):
+        """С кешем внутри хеджа одинаковые заметки пачки дают один вызов бэкенда"""
+        backend = CountingLLM()
+        adapter = HedgedLLMAdapter(CachedLLMAdapter(backend, cache=TriageCache(100, 60)), budget=1)
+
+        asyncio.run(adapter.triage_many(["spam spam"] * 20))
+        asyncio.run(adapter.triage_many(["spam spam"] * 5))
+
+        assert backend.calls == [["spam spam"]]
+
+    def test_failing_primary_falls_back(self):
+        """Ошибка основного адаптера тоже приводит к запасному ответу"""
+        adapter = HedgedLLMAdapter(SlowLLM(0, fail=True), budget=1)
+
+        insight = asyncio.run(adapter.triage("job interview"))
+
+        assert insight.intent == "job"
+        assert FALLBACK_TAG in insight.tags
+        assert adapter.stats()["errors"] == 1
+
+    def test_factory_wraps_remote_adapter(self, monkeypatch):
+        """Удаленный адаптер из фабрики ограничен бюджетом, кеш находится внутри"""
+        monkeypatch.setattr(config, "LLM_ADAPTER", "openai_like")
+        monkeypatch.setattr(config, "TRIAGE_CACHE_ENABLED", True)
+        monkeypatch.setattr(config, "LLM_LATENCY_BUDGET", 1.5)
+
+        adapter = get_llm_adapter()
+
+        assert isinstance(adapter, HedgedLLMAdapter)
+        assert adapter.budget == 1.5
+        assert isinstance(adapter.primary, CachedLLMAdapter)
+        assert isinstance(adapter.primary.adapter, OpenAILikeLLM)
@@ -21,8 +21,10 @@ class TestIdempotencyDetailed:
             intake_dir = project_root / "intake-api"
             os.chdir(intake_dir)
             
-            if str(intake_dir) not in sys.path:
-                sys.path.insert(0, str(intake_dir))
+            # Каталог сервиса должен идти первым, иначе импортируется main другого сервиса
+            if str(intake_dir) in sys.path:
+                sys.path.remove(str(intake_dir))
+            sys.path.insert(0, str(intake_dir))
             
             modules_to_clear = [k for k in sys.modules.keys() if k.startswith('main') or k.startswith('routes')]
             for module in modules_to_clear:
@@ -32,6 +34,8 @@ class TestIdempotencyDetailed:
             import main as intake_main
             os.chdir(original_cwd)
             
+            # TestClient без with не вызывает startup, а схема database.sqlite обновляется миграциями init_db
+            intake_main.init_db()
             return TestClient(intake_main.app)
             
         except Exception as e:
@@ -0,0 +1,255 @@
+import pytest
+import sys
+import asyncio
+import importlib.util
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import create_engine, inspect, text, event as sa_event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from shared.database import IdempotencyKeyDB, migrate_idempotency_keys
+from shared.idempotency import IdempotencyCache, IdempotencyKeyExpiry, SingleFlight
+from shared.message_queue import queue as shared_queue
+from shared.models import LeadRequest
+from shared.utils import generate_request_fingerprint
+
+
+def load_lead_service_module():
+    spec = importlib.util.spec_from_file_location(
+        "intake_lead_service_module", project_root / "intake-api" / "services" / "lead_service.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestIdempotencyCache:
+    def test_lru_eviction_and_ttl(self, monkeypatch):
+        """Старые записи вытесняются по размеру, просроченные считаются промахом"""
+        cache = IdempotencyCache(max_size=2, ttl=10, use_redis=False)
+        now = [1000.0]
+        monkeypatch.setattr("shared.idempotency.time.monotonic", lambda: now[0])
+
+        async def scenario():
+            await cache.set_many({"a": {"n": 1}, "b": {"n": 2}})
+            assert await cache.get("a") == {"n": 1}
+            await cache.set("c", {"n": 3})
+            assert await cache.get("b") is None
+
+            now[0] += 11
+            assert await cache.get_many(["a", "c"]) == {}
+
+        asyncio.run(scenario())
+
+        print(f"\n📊 Cache stats: {cache.stats()}")
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 3
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["expirations"] == 2
+
+    def test_retries_do_not_reach_database(self, db_path):
+        """Повтор запроса с тем же ключом отвечается из кеша без обращения к базе"""
+        module = load_lead_service_module()
+        statements = []
+
+        async def scenario():
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+            sa_event.listen(async_engine.sync_engine, "before_cursor_execute",
+                            lambda conn, cursor, statement, *args: statements.append(statement.split()[0]))
+            session_factory = async_sessionmaker(async_engine, expire_on_commit=False)
+            cache = IdempotencyCache(use_redis=False)
+            request = LeadRequest(note="Need pricing")
+
+            try:
+                async with session_factory() as db:
+                    lead, status_code = await module.LeadService(db, cache).create_lead(request, "retry-key")
+                    assert status_code == 201
+
+                statements.clear()
+                for _ in range(3):
+                    async with session_factory() as db:
+                        replayed, status_code = await module.LeadService(db, cache).create_lead(request, "retry-key")
+                        assert (replayed.id, status_code) == (lead.id, 200)
+            finally:
+                await async_engine.dispose()
+
+            return cache
+
+        cache = asyncio.run(scenario())
+
+        assert statements == []
+        assert cache.hits == 3
+
+
+class TestSingleFlight:
+    def _run_with_sessions(self, db_path, scenario):
+        async def run():
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+            try:
+                return await scenario(async_sessionmaker(async_engine, expire_on_commit=False))
+            finally:
+                await async_engine.dispose()
+
+        return asyncio.run(run())
+
+    def test_concurrent_requests_with_same_key_coalesce(self, db_path):
+        """Одновременные запросы с одним ключом получают 201 и 200 с тем же лидом, лид создается один раз"""
+        module = load_lead_service_module()
+        cache, flights = IdempotencyCache(use_redis=False), SingleFlight(use_redis=False)
+
+        async def scenario(session_factory):
+            async def call():
+                async with session_factory() as db:
+                    return await module.LeadService(db, cache, flights).create_lead(LeadRequest(note="retry storm"), "storm-key")
+
+            return await asyncio.gather(*(call() for _ in range(10)))
+
+        results = self._run_with_sessions(db_path, scenario)
+
+        print(f"\n📊 Single-flight stats: {flights.stats()}")
+        assert sorted(status_code for _, status_code in results) == [200] * 9 + [201]
+        assert len({lead.id for lead, _ in results}) == 1
+        assert flights.stats()["coalesced"] == 9
+
+        engine = create_engine(f"sqlite:///{db_path}")
+        with engine.connect() as conn:
+            assert conn.scalar(text("SELECT count(*) FROM leads")) == 1
+        engine.dispose()
+
+    def test_key_taken_by_other_process_is_replayed(self, db_path):
+        """Если ключ успел сохранить другой процесс, ответ строится из его записи, а не 400"""
+        module = load_lead_service_module()
+        request = LeadRequest(note="two processes")
+
+        async def scenario(session_factory):
+            async with session_factory() as db:
+                lead, _ = await module.LeadService(db, IdempotencyCache(use_redis=False)).create_lead(request, "shared-key")
+
+            async with session_factory() as db:
+                service = module.LeadService(db, IdempotencyCache(use_redis=False), SingleFlight(use_redis=False))
+                record, created = await service._insert_lead(request, "shared-key", generate_request_fingerprint(request.model_dump()))
+
+            return lead, record, created
+
+        lead, record, created = self._run_with_sessions(db_path, scenario)
+
+        assert created is False
+        assert record["lead"]["id"] == lead.id
+
+
+class RecordingRedis:
+    """Async клиент, записывающий обращения кеша и блокировок вместо отправки в Redis"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def mget(self, keys):
+        self.calls.append("mget")
+        return [None] * len(keys)
+
+    def lock(self, name, timeout):
+        self.calls.append("lock")
+        client = self
+
+        class Lock:
+            async def acquire(self, blocking=True):
+                return True
+
+            async def release(self):
+                client.calls.append("release")
+
+        return Lock()
+
+
+class TestSharedRedisClient:
+    def test_cache_and_locks_use_queue_client(self, monkeypatch):
+        """Кеш и single-flight работают через общий async клиент очереди, а не открывают свои пулы"""
+        cache, flights = IdempotencyCache(use_redis=True), SingleFlight(use_redis=True)
+
+        async def scenario():
+            shared_queue.get_async_redis()
+            monkeypatch.setattr(shared_queue, "_async_redis", RecordingRedis())
+            await cache.get("key")
+            await flights.run("key", lambda: asyncio.sleep(0), lambda: asyncio.sleep(0, ({"lead": {}}, True)))
+            return shared_queue._async_redis.calls
+
+        assert asyncio.run(scenario()) == ["mget", "lock", "release"]
+        assert cache.stats()["redis_errors"] == 0
+
+
+class TestIdempotencyKeyExpiry:
+    def test_expire_deletes_old_keys_in_batches(self, session_factory):
+        """Ключи старше TTL удаляются пачками, свежие остаются"""
+        db = session_factory()
+        old = datetime.utcnow() - timedelta(hours=2)
+        db.add_all([IdempotencyKeyDB(key=f"old-{i}", request_fingerprint="f", lead_id="l", created_at=old) for i in range(5)])
+        db.add(IdempotencyKeyDB(key="fresh", request_fingerprint="f", lead_id="l", created_at=datetime.utcnow()))
+        db.commit()
+        db.close()
+
+        deletes = []
+        sa_event.listen(session_factory.kw["bind"], "before_cursor_execute",
+                        lambda conn, cursor, statement, *args: statement.startswith("DELETE") and deletes.append(statement))
+
+        expiry = IdempotencyKeyExpiry(ttl=3600, batch_size=2, session_factory=session_factory)
+        assert expiry.expire() == 5
+        assert len(deletes) == 3
+
+        db = session_factory()
+        assert [row.key for row in db.query(IdempotencyKeyDB)] == ["fresh"]
+        db.close()
+
+
+class TestIdempotencyKeyMigration:
+    def test_legacy_records_become_fingerprints(self, tmp_path):
+        """Старые записи с JSON-копией ответа переводятся на отпечаток запроса и lead_id"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+        request = {"email": None, "phone": None, "name": "Ann", "note": "Need pricing", "source": None}
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE leads (id VARCHAR PRIMARY KEY)"))
+            conn.execute(text("INSERT INTO leads VALUES ('lead-1')"))
+            conn.execute(text(
+                "CREATE TABLE idempotency_keys (key VARCHAR PRIMARY KEY, response_data TEXT NOT NULL, created_at DATETIME)"
+            ))
+            conn.execute(text("INSERT INTO idempotency_keys VALUES (:key, :data, CURRENT_TIMESTAMP)"), [
+                {"key": "legacy", "data": json.dumps({"request": request, "lead": {"id": "lead-1"}})},
+                {"key": "broken", "data": "not json"},
+            ])
+
+        migrate_idempotency_keys(engine)
+        migrate_idempotency_keys(engine)
+
+        columns = {column["name"] for column in inspect(engine).get_columns("idempotency_keys")}
+        assert "response_data" not in columns
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT key, request_fingerprint, lead_id FROM idempotency_keys")).all()
+        assert rows == [("legacy", generate_request_fingerprint(LeadRequest(name="Ann", note="Need pricing").model_dump()), "lead-1")]
+        engine.dispose()
+
+    def test_keys_of_missing_leads_are_dropped(self, tmp_path):
+        """Ключи, чей лид уже удален, не переносятся: повтор запроса создаст лид заново вместо 500"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+        request = {"email": None, "phone": None, "name": "Ann", "note": "Need pricing", "source": None}
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE leads (id VARCHAR PRIMARY KEY)"))
+            conn.execute(text("INSERT INTO leads VALUES ('lead-1')"))
+            conn.execute(text(
+                "CREATE TABLE idempotency_keys (key VARCHAR PRIMARY KEY, response_data TEXT NOT NULL, created_at DATETIME)"
+            ))
+            conn.execute(text("INSERT INTO idempotency_keys VALUES (:key, :data, CURRENT_TIMESTAMP)"), [
+                {"key": "kept", "data": json.dumps({"request": request, "lead": {"id": "lead-1"}})},
+                {"key": "orphan", "data": json.dumps({"request": request, "lead": {"id": "lead-gone"}})},
+            ])
+
+        migrate_idempotency_keys(engine)
+
+        with engine.connect() as conn:
+            keys = conn.execute(text("SELECT key FROM idempotency_keys")).scalars().all()
+        print(f"\n🧹 Keys after migration: {keys}")
+        assert keys == ["kept"]
+        engine.dispose()
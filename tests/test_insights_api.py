@@ -0,0 +1,431 @@
+import pytest
+import sys
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import create_engine, event, inspect, text
+
+from shared.database import (
+    Base, LeadDB, InsightDB, latest_insight_update, migrate_latest_insight, migrate_insight_tags
+)
+from shared.insight_events import insight_notifier
+from shared.models import InsightPayload
+from shared.rollups import rebuild_rollups
+
+
+class InsightsTestBase:
+    @pytest.fixture
+    def client(self, app_client):
+        return app_client("insights-api")
+
+    @pytest.fixture
+    def statements(self, client):
+        """Перехватывает SELECT-запросы, которые insights-api отправляет в базу"""
+        captured = []
+        sync_engine = client.async_engine.sync_engine
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                captured.append((statement, parameters))
+
+        event.listen(sync_engine, "before_cursor_execute", capture)
+        yield captured
+        event.remove(sync_engine, "before_cursor_execute", capture)
+
+    def _query_plans(self, session_factory, statements):
+        engine = create_engine(f"sqlite:///{session_factory.db_path}")
+        with engine.connect() as conn:
+            plans = [
+                " | ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+                for statement, parameters in statements
+            ]
+        engine.dispose()
+        return plans
+
+    def _add_lead(self, session_factory, note="Need pricing", source=None):
+        db = session_factory()
+        lead_id = str(uuid.uuid4())
+        db.add(LeadDB(id=lead_id, note=note, source=source, created_at=datetime.utcnow()))
+        db.commit()
+        db.close()
+        return lead_id
+
+    def _add_insight(self, session_factory, lead_id, intent="buy", priority="P1", tags=None, content_hash=None,
+                     created_at=None, update_latest=True):
+        """Сохраняет инсайт как воркер: вместе с указателем leads.latest_insight_id"""
+        db = session_factory()
+        insight = InsightDB.from_payload(
+            lead_id,
+            content_hash or uuid.uuid4().hex,
+            InsightPayload(intent=intent, priority=priority, next_action="call", confidence=0.9, tags=tags or []),
+            created_at=created_at
+        )
+        db.add(insight)
+        if update_latest:
+            db.execute(latest_insight_update(insight))
+        db.commit()
+        insight_id = insight.id
+        db.close()
+        return insight_id
+
+
+class TestInsightWaiting(InsightsTestBase):
+    @pytest.fixture
+    def notifications(self, monkeypatch):
+        """Вместо подписки на Redis уведомления шлет сам тест"""
+        monkeypatch.setattr(insight_notifier, "_ensure_listener", lambda: None)
+        monkeypatch.setattr(insight_notifier, "connected", True)
+
+    def _write_later(self, client, session_factory, lead_id, delay=0.2):
+        def write():
+            time.sleep(delay)
+            self._add_insight(session_factory, lead_id)
+            client.portal.call(insight_notifier.notify, lead_id)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread
+
+    def test_long_poll_returns_when_worker_notifies(self, client, session_factory, notifications):
+        """?wait= возвращает инсайт сразу после уведомления, не дожидаясь конца ожидания"""
+        lead_id = self._add_lead(session_factory)
+        thread = self._write_later(client, session_factory, lead_id)
+
+        started = time.monotonic()
+        response = client.get(f"/leads/{lead_id}/insight?wait=10")
+        elapsed = time.monotonic() - started
+        thread.join()
+
+        print(f"\n⏱️ Long-poll answered in {elapsed:.2f}s")
+        assert response.status_code == 200
+        assert response.json()["lead_id"] == lead_id
+        assert elapsed < 5
+
+    def test_long_poll_times_out_with_404(self, client, session_factory, notifications):
+        """Без инсайта long-poll завершается 404 по истечении wait"""
+        response = client.get(f"/leads/{self._add_lead(session_factory)}/insight?wait=0.1")
+
+        assert response.status_code == 404
+
+    def test_waiters_do_not_hold_pool_connections(self, app_client, session_factory, notifications):
+        """Ожидающих запросов больше, чем соединений в пуле, а обычный запрос отвечает сразу"""
+        client = app_client("insights-api", pool_size=2, max_overflow=0, pool_timeout=5)
+        lead_ids = [self._add_lead(session_factory) for _ in range(4)]
+        waiters = [
+            threading.Thread(target=client.get, args=(f"/leads/{lead_id}/insight?wait=2",))
+            for lead_id in lead_ids
+        ]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.3)
+
+        started = time.monotonic()
+        response = client.get(f"/leads/{self._add_lead(session_factory)}/insight")
+        elapsed = time.monotonic() - started
+        for waiter in waiters:
+            waiter.join()
+
+        print(f"\n⏱️ Plain read during long-polls: {elapsed:.2f}s")
+        assert response.status_code == 404
+        assert elapsed < 1
+
+    def test_sse_stream_sends_insight_event(self, client, session_factory, notifications):
+        """SSE поток отправляет событие insight и закрывается"""
+        lead_id = self._add_lead(session_factory)
+        thread = self._write_later(client, session_factory, lead_id)
+
+        response = client.get(f"/leads/{lead_id}/insight/stream?timeout=10")
+        thread.join()
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        event, data = response.text.strip().split("\n")
+        assert event == "event: insight"
+        assert json.loads(data.removeprefix("data: "))["lead_id"] == lead_id
+
+
+class TestInsightBatch(InsightsTestBase):
+    def test_batch_returns_latest_insight_per_lead(self, client, session_factory):
+        """Для каждого лида возвращается последний инсайт, для лидов без инсайта - null"""
+        first, second, empty = (self._add_lead(session_factory) for _ in range(3))
+        self._add_insight(session_factory, first, intent="support", created_at=datetime(2024, 1, 1))
+        latest_id = self._add_insight(session_factory, first, intent="buy", created_at=datetime(2024, 1, 2))
+        self._add_insight(session_factory, second, intent="job")
+
+        response = client.post("/leads/insights/batch", json={"lead_ids": [empty, first, second, first]})
+
+        assert response.status_code == 200
+        insights = response.json()["insights"]
+        assert list(insights) == [empty, first, second]
+        assert insights[empty] is None
+        assert (insights[first]["id"], insights[first]["intent"]) == (latest_id, "buy")
+        assert insights[second]["intent"] == "job"
+
+    def test_batch_size_limit(self, client, monkeypatch):
+        """Слишком большая пачка отклоняется с 413"""
+        from shared.config import config
+        monkeypatch.setattr(config, "INSIGHT_BATCH_MAX_SIZE", 2)
+
+        response = client.post("/leads/insights/batch", json={"lead_ids": ["a", "b", "c"]})
+
+        assert response.status_code == 413
+
+
+class TestLatestInsightLookup(InsightsTestBase):
+    def test_pointer_keeps_newest_insight(self, session_factory):
+        """Указатель переходит только на более новый инсайт, даже если старый записан позже"""
+        lead_id = self._add_lead(session_factory)
+        newest_id = self._add_insight(session_factory, lead_id, created_at=datetime(2024, 1, 2))
+        self._add_insight(session_factory, lead_id, created_at=datetime(2024, 1, 1))
+
+        db = session_factory()
+        assert db.get(LeadDB, lead_id).latest_insight_id == newest_id
+        db.close()
+
+    def test_hot_read_is_primary_key_lookup(self, client, session_factory, statements):
+        """GET /leads/{id}/insight идет по первичным ключам leads и insights без сортировки и полного прохода"""
+        lead_id = self._add_lead(session_factory)
+        for day in range(1, 6):
+            latest_id = self._add_insight(session_factory, lead_id, tags=["vip"], created_at=datetime(2024, 1, day))
+
+        response = client.get(f"/leads/{lead_id}/insight")
+
+        assert response.json()["id"] == latest_id
+        assert response.json()["tags"] == ["vip"]
+        # Инсайт и его теги: по запросу на каждое
+        assert len(statements) == 2
+        plan, tags_plan = self._query_plans(session_factory, statements)
+        print(f"\n🔎 Hot read plan: {plan} || {tags_plan}")
+        assert "SCAN" not in plan and "TEMP B-TREE" not in plan
+        assert "sqlite_autoindex_leads_1" in plan and "sqlite_autoindex_insights_1" in plan
+        assert "SEARCH insight_tags USING INDEX sqlite_autoindex_insight_tags_1" in tags_plan
+
+    def test_fallback_uses_composite_index(self, client, session_factory, statements):
+        """Без указателя последний инсайт берется по ix_insights_lead_created без сортировки"""
+        lead_id = self._add_lead(session_factory)
+        self._add_insight(session_factory, lead_id, created_at=datetime(2024, 1, 1), update_latest=False)
+        latest_id = self._add_insight(session_factory, lead_id, created_at=datetime(2024, 1, 2), update_latest=False)
+
+        response = client.get(f"/leads/{lead_id}/insight")
+
+        assert response.json()["id"] == latest_id
+        # Последним запросом подгружаются теги инсайта
+        plan = self._query_plans(session_factory, statements)[-2]
+        print(f"\n🔎 Fallback plan: {plan}")
+        assert "USING INDEX ix_insights_lead_created (lead_id=?)" in plan
+        assert "TEMP B-TREE" not in plan
+
+    def test_migration_adds_and_backfills_pointer(self, tmp_path):
+        """Миграция добавляет leads.latest_insight_id и заполняет его последним инсайтом лида"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE leads (id VARCHAR PRIMARY KEY, note TEXT)"))
+            conn.execute(text("CREATE TABLE insights (id VARCHAR PRIMARY KEY, lead_id VARCHAR, created_at DATETIME)"))
+            conn.execute(text("INSERT INTO leads VALUES ('lead-1', 'a'), ('lead-2', 'b')"))
+            conn.execute(text(
+                "INSERT INTO insights VALUES ('old', 'lead-1', '2024-01-01 00:00:00'), ('new', 'lead-1', '2024-01-02 00:00:00')"
+            ))
+
+        migrate_latest_insight(engine)
+        migrate_latest_insight(engine)
+
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, latest_insight_id FROM leads ORDER BY id")).all()
+        assert rows == [("lead-1", "new"), ("lead-2", None)]
+        engine.dispose()
+
+
+class TestInsightListing(InsightsTestBase):
+    def _list_all(self, client, **params):
+        """Обходит все страницы списка и возвращает id инсайтов по порядку"""
+        ids, cursor = [], None
+        while True:
+            response = client.get("/insights", params={**params, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            page = response.json()
+            ids.extend(item["id"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                return ids
+
+    def test_filters_and_keyset_pages(self, client, session_factory):
+        """Фильтры сочетаются, страницы идут от новых к старым без пропусков и повторов"""
+        partner = self._add_lead(session_factory, source="partner")
+        organic = self._add_lead(session_factory, source="organic")
+        start = datetime(2024, 1, 1)
+        hot = [
+            self._add_insight(session_factory, lead_id, priority="P0", tags=["pricing", "vip"],
+                              created_at=start + timedelta(minutes=minute))
+            for minute, lead_id in enumerate([partner, organic, partner, partner, organic])
+        ]
+        self._add_insight(session_factory, partner, intent="support", priority="P0", created_at=start)
+        self._add_insight(session_factory, partner, priority="P2", tags=["pricing_old"], created_at=start)
+
+        all_p0_buy = self._list_all(client, priority="P0", intent="buy", limit=2)
+        print(f"\n📄 P0 buy insights: {len(all_p0_buy)}")
+        assert all_p0_buy == hot[::-1]
+        assert self._list_all(client, priority="P0", source="partner", intent="buy") == [hot[3], hot[2], hot[0]]
+        assert self._list_all(client, tag="pricing", created_after="2024-01-01T00:02:00") == hot[:1:-1]
+        assert self._list_all(client, tag="pricing_") == []
+
+    def test_page_query_uses_index_without_sort(self, client, session_factory, statements):
+        """Страница по приоритету с курсором идет по ix_insights_priority_created без сортировки"""
+        lead_id = self._add_lead(session_factory)
+        for minute in range(5):
+            self._add_insight(session_factory, lead_id, priority="P0", created_at=datetime(2024, 1, 1, 0, minute))
+
+        cursor = client.get("/insights", params={"priority": "P0", "limit": 2}).json()["next_cursor"]
+        statements.clear()
+        response = client.get("/insights", params={"priority": "P0", "limit": 2, "cursor": cursor})
+
+        assert len(response.json()["items"]) == 2
+        plan = self._query_plans(session_factory, statements)[0]
+        print(f"\n🔎 Page plan: {plan}")
+        assert "USING INDEX ix_insights_priority_created (priority=? AND " in plan
+        assert "TEMP B-TREE" not in plan
+
+    def test_tag_filter_requires_all_tags(self, client, session_factory, statements):
+        """Несколько tag отбирают инсайты со всеми тегами; выборку ведет индекс ix_insight_tags_tag_created"""
+        lead_id = self._add_lead(session_factory)
+        start = datetime(2024, 1, 1)
+        both = [
+            self._add_insight(session_factory, lead_id, tags=["urgent", "enterprise"], created_at=start + timedelta(minutes=i))
+            for i in range(3)
+        ]
+        self._add_insight(session_factory, lead_id, tags=["urgent"], created_at=start)
+        self._add_insight(session_factory, lead_id, tags=["enterprise", "smb"], created_at=start)
+
+        statements.clear()
+        assert self._list_all(client, tag=["urgent", "enterprise"], limit=2) == both[::-1]
+
+        plan = self._query_plans(session_factory, statements)[-2]
+        print(f"\n🔎 Tag page plan: {plan}")
+        assert "INDEX ix_insight_tags_tag_created (tag=? AND " in plan
+        assert "SCAN" not in plan and "TEMP B-TREE" not in plan
+
+    def test_invalid_cursor(self, client):
+        """Неразборчивый курсор отклоняется с 400"""
+        response = client.get("/insights", params={"cursor": "not-a-cursor"})
+
+        assert response.status_code == 400
+
+
+class TestTriageStats(InsightsTestBase):
+    def test_stats_read_rollups_only(self, client, session_factory, statements):
+        """Статистика по интервалам берется из роллапов, таблица insights не читается"""
+        partner = self._add_lead(session_factory, source="partner")
+        organic = self._add_lead(session_factory)
+        for hour, lead_id, priority in [(9, partner, "P0"), (9, organic, "P0"), (9, partner, "P1"), (14, partner, "P0")]:
+            self._add_insight(session_factory, lead_id, priority=priority, created_at=datetime(2024, 1, 1, hour, 30))
+        self._add_insight(session_factory, partner, intent="spam", created_at=datetime(2024, 1, 2, 8))
+        rebuild_rollups(session_factory=session_factory)
+
+        hourly = client.get("/insights/stats", params={"group_by": "priority", "intent": "buy"}).json()
+        daily = client.get("/insights/stats", params={
+            "granularity": "day", "group_by": ["source"], "since": "2024-01-01T00:00:00", "until": "2024-01-02T00:00:00"
+        }).json()
+
+        print(f"\n📊 Hourly buckets: {hourly['buckets']}")
+        assert [(b["bucket_start"], b["priority"], b["count"]) for b in hourly["buckets"]] == [
+            ("2024-01-01T09:00:00", "P0", 2),
+            ("2024-01-01T09:00:00", "P1", 1),
+            ("2024-01-01T14:00:00", "P0", 1),
+        ]
+        assert [(b["source"], b["count"]) for b in daily["buckets"]] == [(None, 1), ("partner", 3)]
+        assert all("insights" not in statement for statement, _ in statements)
+
+
+class TestInsightTagMigration:
+    def test_comma_joined_tags_move_to_table(self, tmp_path):
+        """Теги из строки через запятую переносятся в insight_tags в исходном порядке, колонка удаляется"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE insights (id VARCHAR PRIMARY KEY, tags TEXT, created_at DATETIME)"))
+            conn.execute(text(
+                "INSERT INTO insights VALUES ('a', 'urgent,enterprise', '2024-01-01 00:00:00.000000'), "
+                "('b', NULL, '2024-01-01 00:00:00.000000'), ('c', 'vip,,vip', '2024-01-02 00:00:00.000000')"
+            ))
+        Base.metadata.tables["insight_tags"].create(bind=engine)
+
+        migrate_insight_tags(engine)
+        migrate_insight_tags(engine)
+
+        assert "tags" not in {column["name"] for column in inspect(engine).get_columns("insights")}
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT insight_id, tag, position FROM insight_tags ORDER BY insight_id, position")).all()
+        assert rows == [("a", "urgent", 0), ("a", "enterprise", 1), ("c", "vip", 0)]
+        engine.dispose()
+
+
+class TestLeadExport(InsightsTestBase):
+    def _seed(self, session_factory):
+        """Пять лидов с шагом в минуту; у первого два инсайта, у последнего инсайта нет"""
+        lead_ids = []
+        db = session_factory()
+        for minute in range(5):
+            lead_id = f"lead-{minute}"
+            db.add(LeadDB(id=lead_id, note=f"note {minute}", source="crm", created_at=datetime(2024, 1, 1, 0, minute)))
+            lead_ids.append(lead_id)
+        db.commit()
+        db.close()
+
+        self._add_insight(session_factory, lead_ids[0], intent="support", created_at=datetime(2024, 1, 1, 1))
+        latest = {lead_ids[0]: self._add_insight(session_factory, lead_ids[0], tags=["urgent", "enterprise"],
+                                                 created_at=datetime(2024, 1, 1, 2))}
+        for lead_id in lead_ids[1:4]:
+            latest[lead_id] = self._add_insight(session_factory, lead_id, created_at=datetime(2024, 1, 1, 3))
+        return lead_ids, latest
+
+    def test_ndjson_export_streams_in_chunks_and_resumes(self, client, session_factory, statements, monkeypatch):
+        """Выгрузка идет порциями в порядке лидов с последним инсайтом и продолжается после курсора"""
+        from shared.config import config
+        monkeypatch.setattr(config, "EXPORT_CHUNK_SIZE", 2)
+        lead_ids, latest = self._seed(session_factory)
+
+        rows = [json.loads(line) for line in client.get("/insights/export?format=ndjson").text.splitlines()]
+
+        assert [row["lead_id"] for row in rows] == lead_ids
+        assert [row["insight_id"] for row in rows] == [latest.get(lead_id) for lead_id in lead_ids]
+        assert (rows[0]["intent"], rows[0]["tags"]) == ("buy", ["urgent", "enterprise"])
+        assert rows[4]["tags"] is None
+        # Один запрос лидов на все три порции и запрос тегов на каждую порцию с инсайтами (у последней их нет)
+        print(f"\n📤 Export statements: {len(statements)}")
+        assert len(statements) == 3
+
+        statements.clear()
+        resumed = client.get("/insights/export", params={
+            "format": "ndjson", "after_created_at": rows[2]["lead_created_at"], "after_id": rows[2]["lead_id"]
+        })
+        assert [json.loads(line)["lead_id"] for line in resumed.text.splitlines()] == lead_ids[3:]
+        plan = self._query_plans(session_factory, statements[:1])[0]
+        print(f"🔎 Resume plan: {plan}")
+        assert "ix_leads_created ((created_at,id)>(?,?))" in plan and "TEMP B-TREE" not in plan
+
+    def test_csv_and_parquet_formats(self, client, session_factory):
+        """CSV и Parquet содержат те же строки, что и NDJSON"""
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        lead_ids, latest = self._seed(session_factory)
+
+        csv_response = client.get("/insights/export?format=csv&created_after=2024-01-01T00:01:00")
+        parquet_response = client.get("/insights/export?format=parquet")
+
+        assert csv_response.headers["content-type"].startswith("text/csv")
+        csv_lines = csv_response.text.splitlines()
+        assert csv_lines[0].startswith("lead_id,email,phone,name,note,source,lead_created_at,insight_id")
+        assert [line.split(",")[0] for line in csv_lines[1:]] == lead_ids[1:]
+
+        table = pq.read_table(pa.BufferReader(parquet_response.content))
+        assert table.column("lead_id").to_pylist() == lead_ids
+        assert table.column("tags").to_pylist()[0] == ["urgent", "enterprise"]
+
+    def test_resume_requires_both_cursor_fields(self, client):
+        response = client.get("/insights/export", params={"after_id": "lead-1"})
+
+        assert response.status_code == 400
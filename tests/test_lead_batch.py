@@ -0,0 +1,206 @@
+import pytest
+import sys
+import asyncio
+import hashlib
+import json
+import uuid
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import create_engine, select, func
+
+from shared.database import LeadDB, InsightDB, IdempotencyKeyDB, OutboxEventDB
+from shared.idempotency import idempotency_cache
+from shared.llm import FALLBACK_TAG, CachedLLMAdapter, HedgedLLMAdapter, RuleBasedLLM, TriageCache
+
+
+class IntakeTestBase:
+    @pytest.fixture
+    def client(self, app_client):
+        # Кеш ключей общий на процесс, а база у каждого теста своя
+        idempotency_cache.clear()
+        return app_client("intake-api")
+
+    def _count(self, db_path, model):
+        engine = create_engine(f"sqlite:///{db_path}")
+        with engine.connect() as conn:
+            count = conn.scalar(select(func.count()).select_from(model))
+        engine.dispose()
+        return count
+
+
+class TestLeadBatch(IntakeTestBase):
+    def test_batch_creates_leads_in_one_request(self, client, db_path):
+        """Пачка создает все лиды, ключи и события outbox, результаты идут в исходном порядке"""
+        batch_key = f"batch-{uuid.uuid4()}"
+        items = [{"note": f"Need pricing for {i} seats", "source": "partner"} for i in range(50)]
+
+        response = client.post("/leads/batch", json={"items": items}, headers={"Idempotency-Key": batch_key})
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        print(f"\n📦 Created {len(results)} leads in one request")
+        assert [result["index"] for result in results] == list(range(50))
+        assert all(result["status_code"] == 201 for result in results)
+        assert results[7]["idempotency_key"] == f"{batch_key}:7"
+        assert results[7]["lead"]["note"] == "Need pricing for 7 seats"
+
+        assert self._count(db_path, LeadDB) == 50
+        assert self._count(db_path, IdempotencyKeyDB) == 50
+        assert self._count(db_path, OutboxEventDB) == 50
+
+    def test_batch_per_item_statuses(self, client, db_path):
+        """Повторы, конфликты и невалидные элементы получают свой статус, не отклоняя пачку"""
+        existing = client.post("/leads", json={"note": "first"}, headers={"Idempotency-Key": "item-existing"})
+        assert existing.status_code == 201
+
+        items = [
+            {"note": "first", "idempotency_key": "item-existing"},
+            {"note": "changed", "idempotency_key": "item-existing"},
+            {"note": "", "idempotency_key": "item-invalid"},
+            {"note": "no key"},
+            {"note": "new", "idempotency_key": "item-new"},
+            {"note": "new", "idempotency_key": "item-new"},
+            "not an object",
+        ]
+        response = client.post("/leads/batch", json={"items": items})
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["status_code"] for result in results] == [200, 409, 422, 400, 201, 200, 422]
+        assert results[6]["error"] == "Item must be a JSON object"
+        assert results[0]["lead"]["id"] == existing.json()["id"]
+        assert results[5]["lead"]["id"] == results[4]["lead"]["id"]
+        assert self._count(db_path, LeadDB) == 2
+
+
+class TestLeadStream(IntakeTestBase):
+    def test_stream_commits_in_chunks_and_reports_lines(self, client, db_path, monkeypatch):
+        """NDJSON тело разбирается построчно, результаты идут по строкам в исходном порядке"""
+        from shared.config import config
+        monkeypatch.setattr(config, "LEAD_STREAM_CHUNK_SIZE", 4)
+
+        lines = [json.dumps({"note": f"lead {i}", "idempotency_key": f"stream-{i}"}) for i in range(10)]
+        lines[3] = "{not json"
+        lines[5] = ""
+        body = "\n".join(lines).encode()
+
+        def chunks():
+            # Отдаем тело кусками, разрезающими строки посередине
+            for i in range(0, len(body), 7):
+                yield body[i:i + 7]
+
+        response = client.post("/leads/stream", content=chunks(), headers={"Content-Type": "application/x-ndjson"})
+
+        assert response.status_code == 200
+        results = [json.loads(line) for line in response.text.splitlines()]
+        print(f"\n📦 Stream results: {[(r['index'], r['status_code']) for r in results]}")
+        assert [r["index"] for r in results] == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+        assert [r["status_code"] for r in results] == [201, 201, 201, 422, 201, 201, 201, 201, 201]
+        assert self._count(db_path, LeadDB) == 8
+
+    def test_stream_rejects_oversized_line(self, client, monkeypatch):
+        """Слишком длинная строка завершает поток строкой с ошибкой 413"""
+        from shared.config import config
+        monkeypatch.setattr(config, "LEAD_STREAM_MAX_LINE_BYTES", 64)
+
+        body = json.dumps({"note": "ok", "idempotency_key": "stream-ok"}) + "\n" + json.dumps({"note": "x" * 200})
+
+        response = client.post("/leads/stream", content=body.encode())
+
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert results[0]["status_code"] == 201
+        assert results[-1]["status_code"] == 413
+
+    def test_stream_rejects_oversized_line_inside_chunk(self, client, db_path, monkeypatch):
+        """Длинная строка, целиком пришедшая в одном чанке с переводом строки, тоже отклоняется"""
+        from shared.config import config
+        monkeypatch.setattr(config, "LEAD_STREAM_MAX_LINE_BYTES", 64)
+
+        lines = [
+            json.dumps({"note": "ok", "idempotency_key": "chunk-ok"}),
+            json.dumps({"note": "x" * 200, "idempotency_key": "chunk-long"}),
+            json.dumps({"note": "after", "idempotency_key": "chunk-after"}),
+        ]
+
+        response = client.post("/leads/stream", content=("\n".join(lines) + "\n").encode())
+
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["status_code"] for r in results] == [201, 413]
+        assert self._count(db_path, LeadDB) == 1
+
+
+class TestInlineTriage(IntakeTestBase):
+    def test_inline_triage_returns_and_stores_insight(self, client, db_path):
+        """?triage=inline возвращает лид с инсайтом и сохраняет его с content_hash события"""
+        note = "Need pricing for 20 seats today"
+
+        response = client.post("/leads?triage=inline", json={"note": note}, headers={"Idempotency-Key": "inline-1"})
+        plain = client.post("/leads", json={"note": "hello"}, headers={"Idempotency-Key": "inline-2"})
+
+        assert response.status_code == 201
+        insight = response.json()["insight"]
+        print(f"\n🧠 Inline insight: {insight}")
+        assert (insight["intent"], insight["priority"]) == ("buy", "P0")
+        assert "insight" not in plain.json()
+
+        engine = create_engine(f"sqlite:///{db_path}")
+        with engine.connect() as conn:
+            stored = conn.execute(select(InsightDB.lead_id, InsightDB.content_hash)).all()
+        engine.dispose()
+        assert stored == [(response.json()["id"], hashlib.sha256(note.encode()).hexdigest())]
+
+    def test_metrics_report_inline_triage_cache(self, client, monkeypatch):
+        """/metrics показывает счетчики кеша адаптера inline triage"""
+        monkeypatch.setattr(
+            sys.modules["services.triage_service"], "_llm_adapter",
+            CachedLLMAdapter(RuleBasedLLM(), cache=TriageCache(10, 60))
+        )
+
+        for key in ("metrics-1", "metrics-2"):
+            client.post("/leads?triage=inline", json={"note": "Need pricing"}, headers={"Idempotency-Key": key})
+
+        triage_cache = client.get("/metrics").json()["triage_cache"]
+        print(f"\n📊 Inline triage cache: {triage_cache}")
+        assert (triage_cache["hits"], triage_cache["misses"]) == (1, 1)
+
+    def test_inline_triage_over_budget_leaves_it_to_worker(self, client, db_path, monkeypatch):
+        """Если анализ не укладывается в бюджет, лид возвращается без инсайта"""
+        from shared.config import config
+
+        class SlowLLM(RuleBasedLLM):
+            async def triage(self, note, context=None):
+                await asyncio.sleep(1)
+                return await super().triage(note, context)
+
+        monkeypatch.setattr(config, "INLINE_TRIAGE_BUDGET", 0.05)
+        monkeypatch.setattr(sys.modules["services.triage_service"], "_llm_adapter", SlowLLM())
+
+        response = client.post("/leads?triage=inline", json={"note": "bug"}, headers={"Idempotency-Key": "inline-slow"})
+
+        assert response.status_code == 201
+        assert response.json()["insight"] is None
+        assert self._count(db_path, InsightDB) == 0
+
+    def test_inline_triage_hedge_falls_back_within_budget(self, client, db_path, monkeypatch):
+        """Бюджет хеджа больше бюджета запроса: запасной адаптер все равно отвечает до его истечения"""
+        from shared.config import config
+
+        class SlowLLM(RuleBasedLLM):
+            async def triage(self, note, context=None):
+                await asyncio.sleep(1)
+                return await super().triage(note, context)
+
+        monkeypatch.setattr(config, "INLINE_TRIAGE_BUDGET", 0.05)
+        monkeypatch.setattr(sys.modules["services.triage_service"], "_llm_adapter", HedgedLLMAdapter(SlowLLM(), budget=2.0))
+
+        response = client.post("/leads?triage=inline", json={"note": "bug"}, headers={"Idempotency-Key": "inline-hedge"})
+
+        assert response.status_code == 201
+        insight = response.json()["insight"]
+        print(f"\n🧠 Hedged inline insight: {insight}")
+        assert insight["intent"] == "support"
+        assert FALLBACK_TAG in insight["tags"]
+        assert self._count(db_path, InsightDB) == 1
@@ -0,0 +1,95 @@
+import pytest
+import sys
+import asyncio
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+from shared.database import OutboxEventDB
+from shared.message_queue import RedisQueue, queue as shared_queue
+from shared.models import QueueEvent
+from shared.outbox import OutboxRelay, add_outbox_events
+
+
+class RecordingAsyncRedis:
+    """Async клиент, записывающий выполненные pipeline вместо отправки в Redis"""
+
+    def __init__(self):
+        self.pipelines = []
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+
+            def xadd(self, stream, fields):
+                self.commands.append((stream, fields))
+
+            async def execute(self):
+                client.pipelines.append(self.commands)
+                return [f"{len(client.pipelines)}-{index}" for index in range(len(self.commands))]
+
+        return Pipeline()
+
+
+class TestRedisQueuePublishing:
+    def _event(self):
+        return QueueEvent(event_id=str(uuid.uuid4()), lead_id=str(uuid.uuid4()), content_hash="hash", occurred_at=datetime.utcnow())
+
+    def _run(self, queue, scenario):
+        async def with_client():
+            queue.get_async_redis()
+            queue._async_redis = RecordingAsyncRedis()
+            return await scenario()
+        return asyncio.run(with_client())
+
+    def test_publish_events_uses_single_pipeline(self):
+        """publish_events публикует всю пачку одним pipeline"""
+        queue = RedisQueue()
+
+        message_ids = self._run(queue, lambda: queue.publish_events([self._event() for _ in range(3)]))
+
+        assert len(queue._async_redis.pipelines) == 1
+        assert len(message_ids) == 3
+        assert isinstance(queue._async_redis.pipelines[0][0][1]["occurred_at"], str)
+
+
+class TestOutboxRelay:
+    def _add_events(self, session_factory, count):
+        db = session_factory()
+        events = [
+            QueueEvent(event_id=str(uuid.uuid4()), lead_id=str(uuid.uuid4()), content_hash="hash", occurred_at=datetime.utcnow())
+            for _ in range(count)
+        ]
+        add_outbox_events(db, events)
+        db.commit()
+        db.close()
+        return events
+
+    def test_relay_publishes_in_batches_and_tracks_progress(self, session_factory, monkeypatch):
+        """Relay публикует outbox пачками по одному pipeline и не публикует события повторно"""
+        events = self._add_events(session_factory, 5)
+        relay = OutboxRelay(batch_size=3, retention=0, session_factory=session_factory)
+
+        async def scenario():
+            shared_queue.get_async_redis()
+            monkeypatch.setattr(shared_queue, "_async_redis", RecordingAsyncRedis())
+            return [await relay.relay_batch() for _ in range(3)]
+
+        published = asyncio.run(scenario())
+
+        pipelines = shared_queue._async_redis.pipelines
+        assert published == [3, 2, 0]
+        assert [len(pipeline) for pipeline in pipelines] == [3, 2]
+        assert [fields["event_id"] for pipeline in pipelines for _, fields in pipeline] == [event.event_id for event in events]
+
+        assert relay.cleanup() == 5
+        db = session_factory()
+        assert db.query(OutboxEventDB).count() == 0
+        db.close()
@@ -0,0 +1,116 @@
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from fastapi import FastAPI, Request
+
+from shared.config import config
+from shared.llm import OpenAILikeLLM, RuleBasedLLM, get_llm_adapter
+
+
+def create_stub_app(state):
+    """Локальная заглушка OpenAI-совместимого API, отвечающая через RuleBasedLLM"""
+    app = FastAPI()
+    rules = RuleBasedLLM()
+
+    async def answer(note):
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        return (await rules.triage(note)).model_dump_json()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state["requests"].append(("chat", body))
+        content = await answer(body["messages"][-1]["content"])
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+    @app.post("/v1/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        state["requests"].append(("completions", body))
+        notes = [prompt.split("Lead note:\n", 1)[1].rsplit("\n\nJSON:", 1)[0] for prompt in body["prompt"]]
+        texts = [await answer(note) for note in notes]
+        choices = [{"index": index, "text": f" {text}"} for index, text in enumerate(texts)]
+        return {"choices": list(reversed(choices))}
+
+    return app
+
+
+class TestOpenAILikeLLM:
+    @pytest.fixture
+    def state(self):
+        return {"requests": [], "in_flight": 0, "max_in_flight": 0}
+
+    def _adapter(self, state, **kwargs):
+        transport = httpx.ASGITransport(app=create_stub_app(state))
+        return OpenAILikeLLM(base_url="http://stub/v1", api_key="test", model="stub-model", transport=transport, **kwargs)
+
+    def test_triage_via_chat_completions(self, state):
+        """Одиночный triage идет в /chat/completions и парсит JSON-ответ"""
+        async def scenario():
+            adapter = self._adapter(state)
+            try:
+                return await adapter.triage("Need pricing for 20 seats today")
+            finally:
+                await adapter.aclose()
+
+        insight = asyncio.run(scenario())
+
+        assert (insight.intent, insight.priority, insight.tags) == ("buy", "P0", ["enterprise"])
+        assert state["requests"][0][0] == "chat"
+        assert state["requests"][0][1]["model"] == "stub-model"
+
+    def test_in_flight_limit(self, state):
+        """Число одновременных запросов не превышает max_in_flight"""
+        async def scenario():
+            adapter = self._adapter(state, max_in_flight=3)
+            try:
+                return await adapter.triage_many([f"bug report {i}" for i in range(12)])
+            finally:
+                await adapter.aclose()
+
+        insights = asyncio.run(scenario())
+
+        print(f"\n📊 Max in flight: {state['max_in_flight']}")
+        assert len(insights) == 12
+        assert all(insight.intent == "support" for insight in insights)
+        assert state["max_in_flight"] <= 3
+
+    def test_batched_completions_keep_order(self, state):
+        """При batch_size > 1 заметки уходят пачками, порядок результатов сохраняется"""
+        notes = ["buy now", "job interview", "win a prize", "hello", "api bug"]
+
+        async def scenario():
+            adapter = self._adapter(state, batch_size=2)
+            try:
+                return await adapter.triage_many(notes)
+            finally:
+                await adapter.aclose()
+
+        insights = asyncio.run(scenario())
+
+        assert [insight.intent for insight in insights] == ["buy", "job", "spam", "other", "support"]
+        assert [kind for kind, _ in state["requests"]] == ["completions"] * 3
+
+    def test_factory_respects_config(self, monkeypatch):
+        """get_llm_adapter создает адаптер, указанный в Config.LLM_ADAPTER"""
+        monkeypatch.setattr(config, "TRIAGE_CACHE_ENABLED", False)
+        monkeypatch.setattr(config, "LLM_LATENCY_BUDGET", 0)
+
+        monkeypatch.setattr(config, "LLM_ADAPTER", "openai_like")
+        assert isinstance(get_llm_adapter(), OpenAILikeLLM)
+
+        monkeypatch.setattr(config, "LLM_ADAPTER", "rule_based")
+        assert isinstance(get_llm_adapter(), RuleBasedLLM)
+
+        monkeypatch.setattr(config, "LLM_ADAPTER", "unknown")
+        with pytest.raises(ValueError):
+            get_llm_adapter()
@@ -0,0 +1,64 @@
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from shared.llm.rule_based import RuleBasedLLM, KeywordMatcher
+
+
+class TestRuleBasedLLM:
+    @pytest.fixture(scope="class")
+    def adapter(self):
+        """Rule-based адаптер с однократно скомпилированным матчером"""
+        return RuleBasedLLM()
+
+    def _triage(self, adapter, note):
+        return asyncio.run(adapter.triage(note))
+
+    @pytest.mark.parametrize("note, expected", [
+        ("Need pricing for 50 seats ASAP", ("buy", "P0", "call", 0.8, ["enterprise", "urgent"])),
+        ("Хочу купить подписку, важно", ("buy", "P1", "call", 0.8, [])),
+        ("Our API integration is broken", ("support", "P2", "email", 0.7, ["technical"])),
+        ("Не работает вход, срочно!", ("support", "P0", "email", 0.8, ["urgent"])),
+        ("Send my resume for the interview", ("job", "P3", "email", 0.8, [])),
+        ("Congratulations, you won a prize", ("spam", "P3", "ignore", 0.7, [])),
+        ("Hello from a small startup, call me right now", ("other", "P0", "call", 0.7, ["small_business"])),
+        ("Just saying hi", ("other", "P3", "qualify", 0.7, [])),
+    ])
+    def test_triage_rules(self, adapter, note, expected):
+        """Проверяем intent/priority/next_action/confidence/tags для типовых заметок"""
+        insight = self._triage(adapter, note)
+        print(f"\n📋 {note!r} -> {insight}")
+
+        assert (insight.intent, insight.priority, insight.next_action, insight.confidence, insight.tags) == expected
+
+    def test_whole_word_and_prefix_keywords(self):
+        """Ключевые слова с границей слова не срабатывают внутри слов, префиксные - срабатывают"""
+        matcher = KeywordMatcher()
+
+        assert matcher.match("nowhere pricey winter") == frozenset()
+        assert "urgent" in matcher.match("right now")
+        assert {"tag_urgent", "tag_technical"} <= matcher.match("urgently need apis")
+        assert "urgent" not in matcher.match("urgently need apis")
+        assert "tag_enterprise" in matcher.match("10users")
+        assert "tag_enterprise" not in matcher.match("v10 users")
+
+    def test_triage_many_matches_single_triage(self, adapter):
+        """Пакетный triage_many дает те же результаты, что и поштучный triage"""
+        notes = [
+            "Need pricing for 50 seats ASAP",
+            "",
+            "now",
+            "Our API integration is broken\nright now",
+            "10\x00users",
+            "İstanbul office wants a trial today",
+            "Just saying hi",
+        ]
+
+        batch = asyncio.run(adapter.triage_many(notes))
+        single = [self._triage(adapter, note) for note in notes]
+
+        assert batch == single
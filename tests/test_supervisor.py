@@ -0,0 +1,123 @@
+import pytest
+import sys
+import importlib.util
+import signal
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def load_supervisor_module():
+    spec = importlib.util.spec_from_file_location(
+        "triage_supervisor_module", project_root / "triage-worker" / "supervisor.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _log(log_path, line):
+    with open(log_path, "a") as log:
+        log.write(line + "\n")
+
+
+# Заглушки воркера: выполняются в дочерних процессах вместо run_worker_process
+
+def crashing_worker(log_path, consumer_name):
+    _log(log_path, consumer_name)
+    sys.exit(1)
+
+
+def draining_worker(log_path, consumer_name):
+    def drain(signum, frame):
+        _log(log_path, f"drained {consumer_name}")
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, drain)
+    _log(log_path, f"ready {consumer_name}")
+    while True:
+        time.sleep(0.05)
+
+
+def stuck_worker(log_path, consumer_name):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _log(log_path, f"ready {consumer_name}")
+    while True:
+        time.sleep(0.05)
+
+
+class TestWorkerSupervisor:
+    @pytest.fixture
+    def log_path(self, tmp_path):
+        return tmp_path / "workers.log"
+
+    def _lines(self, log_path):
+        return log_path.read_text().splitlines() if log_path.exists() else []
+
+    def _wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "condition not met in time"
+            time.sleep(0.02)
+
+    def test_consumer_names_are_stable(self):
+        """Имя consumer'а зависит только от префикса и номера процесса"""
+        module = load_supervisor_module()
+        supervisor = module.WorkerSupervisor(processes=2, name_prefix="host")
+
+        assert [supervisor.consumer_name(index) for index in range(2)] == ["host-worker-0", "host-worker-1"]
+        assert supervisor.consumer_name(1) == module.WorkerSupervisor(name_prefix="host").consumer_name(1)
+
+    def test_dead_children_restart_under_same_name(self, log_path):
+        """Упавший воркер перезапускается с тем же именем consumer'а"""
+        module = load_supervisor_module()
+        supervisor = module.WorkerSupervisor(
+            processes=2, name_prefix="host", check_interval=0.05, target=partial(crashing_worker, log_path)
+        )
+
+        runner = threading.Thread(target=supervisor.supervise)
+        runner.start()
+        try:
+            self._wait_for(lambda: self._lines(log_path).count("host-worker-0") >= 3)
+        finally:
+            supervisor.stop()
+            runner.join(10)
+
+        starts = self._lines(log_path)
+        print(f"\n🔁 Worker starts: {starts}")
+        assert set(starts) == {"host-worker-0", "host-worker-1"}
+        assert starts.count("host-worker-1") >= 2
+        assert not runner.is_alive()
+
+    def test_shutdown_drains_workers_with_sigterm(self, log_path):
+        """По остановке воркер получает SIGTERM и завершается сам, без SIGKILL"""
+        module = load_supervisor_module()
+        supervisor = module.WorkerSupervisor(processes=1, name_prefix="host", target=partial(draining_worker, log_path))
+        supervisor.start_child(0)
+        self._wait_for(lambda: "ready host-worker-0" in self._lines(log_path))
+
+        started = time.monotonic()
+        supervisor.shutdown(timeout=5)
+
+        assert time.monotonic() - started < 5
+        assert supervisor.children[0].exitcode == 0
+        assert "drained host-worker-0" in self._lines(log_path)
+
+    def test_shutdown_kills_workers_after_timeout(self, log_path):
+        """Воркер, не завершившийся за таймаут после SIGTERM, добивается SIGKILL"""
+        module = load_supervisor_module()
+        supervisor = module.WorkerSupervisor(processes=1, name_prefix="host", target=partial(stuck_worker, log_path))
+        supervisor.start_child(0)
+        self._wait_for(lambda: "ready host-worker-0" in self._lines(log_path))
+
+        started = time.monotonic()
+        supervisor.shutdown(timeout=0.3)
+        elapsed = time.monotonic() - started
+
+        print(f"\n⏱️ Stuck worker killed after {elapsed:.2f}s")
+        assert supervisor.children[0].exitcode == -signal.SIGKILL
+        assert elapsed < 3
@@ -0,0 +1,120 @@
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from shared.llm import CachedLLMAdapter, HedgedLLMAdapter, TriageCache, RuleBasedLLM, adapter_stats
+
+
+class CountingLLM(RuleBasedLLM):
+    """Rule-based адаптер, считающий реальные вызовы анализа"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def triage(self, note, context=None):
+        self.calls += 1
+        return await super().triage(note, context)
+
+    async def triage_many(self, notes, contexts=None):
+        self.calls += len(notes)
+        return await super().triage_many(notes, contexts)
+
+
+class TestTriageCache:
+    def test_repeated_note_hits_cache(self):
+        """Повторная заметка не доходит до адаптера"""
+        inner = CountingLLM()
+        adapter = CachedLLMAdapter(inner, cache=TriageCache(max_size=10, ttl=60))
+
+        first = asyncio.run(adapter.triage("Need pricing ASAP"))
+        second = asyncio.run(adapter.triage("Need pricing ASAP"))
+
+        print(f"\n📊 Cache stats: {adapter.stats()}")
+        assert first == second
+        assert inner.calls == 1
+        assert adapter.stats()["hits"] == 1
+        assert adapter.stats()["misses"] == 1
+
+    def test_lru_eviction_and_ttl_expiry(self):
+        """Кеш ограничен по размеру и по времени жизни записей"""
+        cache = TriageCache(max_size=2, ttl=60)
+        adapter = CachedLLMAdapter(CountingLLM(), cache=cache)
+
+        for note in ["one", "two", "three"]:
+            asyncio.run(adapter.triage(note))
+
+        assert len(cache) == 2
+        assert cache.evictions == 1
+
+        cache.ttl = -1
+        asyncio.run(adapter.triage("four"))
+        asyncio.run(adapter.triage("four"))
+        assert cache.expirations == 1
+
+    def test_triage_many_deduplicates_batch(self):
+        """В пачке одинаковые заметки анализируются один раз, закешированные - ни разу"""
+        inner = CountingLLM()
+        adapter = CachedLLMAdapter(inner, cache=TriageCache(max_size=10, ttl=60))
+
+        asyncio.run(adapter.triage("cached note"))
+        results = asyncio.run(adapter.triage_many(["cached note", "spam win", "spam win", "bug"]))
+
+        assert inner.calls == 3
+        assert [insight.intent for insight in results] == ["other", "spam", "spam", "support"]
+
+    def test_version_is_part_of_key(self):
+        """Смена версии правил инвалидирует кеш"""
+        cache = TriageCache(max_size=10, ttl=60)
+        inner = CountingLLM()
+
+        asyncio.run(CachedLLMAdapter(inner, cache=cache).triage("hello"))
+        inner.version = inner.version + "-next"
+        asyncio.run(CachedLLMAdapter(inner, cache=cache).triage("hello"))
+
+        assert inner.calls == 2
+
+    def test_concurrent_misses_share_one_backend_call(self):
+        """Одновременные промахи по одной заметке ждут первый вызов вместо повторного анализа"""
+        class SlowCountingLLM(CountingLLM):
+            async def triage(self, note, context=None):
+                await asyncio.sleep(0.05)
+                return await super().triage(note, context)
+
+            async def triage_many(self, notes, contexts=None):
+                await asyncio.sleep(0.05)
+                return await super().triage_many(notes, contexts)
+
+        backend = SlowCountingLLM()
+        adapter = CachedLLMAdapter(backend, cache=TriageCache(10, 60))
+
+        async def burst():
+            return await asyncio.gather(
+                *(adapter.triage("spam spam") for _ in range(10)),
+                adapter.triage_many(["spam spam", "Need pricing"]),
+            )
+
+        results = asyncio.run(burst())
+
+        print(f"\n📊 Cache stats: {adapter.stats()}")
+        assert backend.calls == 2
+        assert len({id(payload) for payload in results[:10]}) == 1
+        assert results[10][0] is results[0]
+        assert adapter.stats()["coalesced"] == 10
+
+    def test_adapter_stats_reach_cache_inside_hedge(self):
+        """Счетчики кеша доступны и тогда, когда кеш обернут бюджетом времени"""
+        adapter = HedgedLLMAdapter(CachedLLMAdapter(CountingLLM(), cache=TriageCache(10, 60)), budget=1)
+
+        asyncio.run(adapter.triage("Need pricing"))
+        asyncio.run(adapter.triage("Need pricing"))
+
+        stats = adapter_stats(adapter)
+        print(f"\n📊 Adapter stats: {stats}")
+        assert (stats["triage_cache"]["hits"], stats["triage_cache"]["misses"]) == (1, 1)
+        assert stats["hedge"]["primary"] == 2
+        assert adapter_stats(RuleBasedLLM()) == {}
@@ -0,0 +1,329 @@
+import pytest
+import sys
+import asyncio
+import hashlib
+import importlib.util
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import event as sa_event
+
+from shared.database import LeadDB, InsightDB, TriageRollupDB
+from shared.message_queue import queue
+from shared.models import QueueEvent
+from shared.llm import LLMAdapter, RuleBasedLLM
+from shared.rollups import rebuild_rollups
+
+
+def load_worker_module():
+    spec = importlib.util.spec_from_file_location("triage_worker_module", project_root / "triage-worker" / "worker.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class WorkerTestBase:
+    @pytest.fixture
+    def acked(self, monkeypatch):
+        """Фиксируем подтверждения вместо обращения к Redis"""
+        acked = []
+        monkeypatch.setattr(queue, "ack_message", lambda message_id: acked.append([message_id]))
+        monkeypatch.setattr(queue, "ack_messages", lambda message_ids: acked.append(list(message_ids)))
+        return acked
+
+    def _add_lead(self, session_factory, note):
+        db = session_factory()
+        lead_id = str(uuid.uuid4())
+        db.add(LeadDB(id=lead_id, note=note, source="worker_test", created_at=datetime.utcnow()))
+        db.commit()
+        db.close()
+        return lead_id
+
+    def _event(self, lead_id, note):
+        return QueueEvent(
+            event_id=str(uuid.uuid4()),
+            lead_id=lead_id,
+            content_hash=hashlib.sha256(note.encode()).hexdigest(),
+            occurred_at=datetime.utcnow()
+        )
+
+    def _count_statements(self, session_factory):
+        statements = []
+        sa_event.listen(session_factory.kw["bind"], "before_cursor_execute",
+                        lambda conn, cursor, statement, *args: statements.append(statement.split()[0]))
+        return statements
+
+
+class TestTriageWorkerBatch(WorkerTestBase):
+    @pytest.fixture
+    def worker(self, session_factory):
+        module = load_worker_module()
+        worker = module.TriageWorker(batch_size=10)
+        worker.SessionLocal = session_factory
+        return worker
+
+    def test_process_batch_bulk_insert_and_single_ack(self, worker, session_factory, acked):
+        """Пачка обрабатывается двумя SELECT, вставками инсайтов, их тегов и роллапов, одним UPDATE указателей и одним XACK"""
+        notes = ["Need pricing asap", "Our api is broken", "Send my resume"]
+        lead_ids = [self._add_lead(session_factory, note) for note in notes]
+        events = [(f"{i}-0", self._event(lead_id, note)) for i, (lead_id, note) in enumerate(zip(lead_ids, notes))]
+        events.append(("3-0", events[0][1]))
+        events.append(("4-0", self._event("missing-lead", "whatever")))
+
+        statements = self._count_statements(session_factory)
+        asyncio.run(worker.process_batch(events))
+
+        print(f"\n📋 Statements: {statements}")
+        assert statements.count("SELECT") == 2
+        assert statements.count("INSERT") == 3
+        assert statements.count("UPDATE") == 1
+        assert acked == [["0-0", "1-0", "2-0", "3-0", "4-0"]]
+
+        db = session_factory()
+        intents = {insight.lead_id: insight.intent for insight in db.query(InsightDB)}
+        pointers = {lead.id: lead.latest_insight_id for lead in db.query(LeadDB)}
+        insight_ids = {insight.lead_id: insight.id for insight in db.query(InsightDB)}
+        db.close()
+        assert intents == dict(zip(lead_ids, ["buy", "support", "job"]))
+        assert pointers == insight_ids
+
+    def test_batch_failure_leaves_only_failing_event_pending(self, worker, session_factory, acked):
+        """Если пачка падает, события обрабатываются по одному и в PEL остается только сбойное"""
+        class PoisonLLM(RuleBasedLLM):
+            async def triage(self, note, context=None):
+                if "poison" in note:
+                    raise ValueError("bad adapter response")
+                return await super().triage(note, context)
+
+            triage_many = LLMAdapter.triage_many
+
+        worker.llm_adapter = PoisonLLM()
+        notes = ["Need pricing asap", "poison pill", "Send my resume"]
+        lead_ids = [self._add_lead(session_factory, note) for note in notes]
+        events = [(f"{i}-0", self._event(lead_id, note)) for i, (lead_id, note) in enumerate(zip(lead_ids, notes))]
+
+        asyncio.run(worker.process_batch(events))
+
+        print(f"\n📋 Acked after batch failure: {acked}")
+        assert acked == [["0-0"], ["2-0"]]
+        db = session_factory()
+        assert {insight.lead_id for insight in db.query(InsightDB)} == {lead_ids[0], lead_ids[2]}
+        db.close()
+
+    def test_process_batch_skips_existing_insights(self, worker, session_factory, acked):
+        """Уже обработанные события подтверждаются без повторного анализа"""
+        note = "Need pricing asap"
+        lead_id = self._add_lead(session_factory, note)
+
+        asyncio.run(worker.process_batch([("0-0", self._event(lead_id, note))]))
+        asyncio.run(worker.process_batch([("1-0", self._event(lead_id, note))]))
+
+        db = session_factory()
+        assert db.query(InsightDB).filter(InsightDB.lead_id == lead_id).count() == 1
+        db.close()
+        assert acked == [["0-0"], ["1-0"]]
+
+    def test_rollups_follow_insights_and_rebuild(self, worker, session_factory, acked):
+        """Роллапы обновляются в транзакции пачки и совпадают с полным пересчетом"""
+        notes = ["Need pricing asap", "Need pricing for 5 seats", "Our api is broken"]
+        events = [(f"{i}-0", self._event(self._add_lead(session_factory, note), note)) for i, note in enumerate(notes)]
+
+        asyncio.run(worker.process_batch(events[:2]))
+        asyncio.run(worker.process_event(*events[2]))
+
+        def rollups():
+            db = session_factory()
+            rows = Counter()
+            for row in db.query(TriageRollupDB):
+                rows[(row.granularity, row.intent, row.source)] += row.count
+            db.close()
+            return rows
+
+        incremental = rollups()
+        print(f"\n📊 Rollups: {incremental}")
+        assert incremental[("hour", "buy", "worker_test")] == 2
+        assert incremental[("day", "support", "worker_test")] == 1
+
+        assert rebuild_rollups(session_factory=session_factory, batch_size=2) == 3
+        assert rollups() == incremental
+
+
+class TestTriageWorkerConcurrency(WorkerTestBase):
+    class SlowLLM(RuleBasedLLM):
+        """Адаптер с сетевой задержкой, фиксирующий параллелизм и порядок вызовов"""
+
+        def __init__(self):
+            super().__init__()
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.calls = []
+
+        async def triage(self, note, context=None):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.calls.append(("start", note))
+            await asyncio.sleep(0.05)
+            self.calls.append(("end", note))
+            self.in_flight -= 1
+            return await super().triage(note, context)
+
+    @pytest.fixture
+    def worker(self, session_factory):
+        module = load_worker_module()
+        worker = module.TriageWorker(concurrency=4)
+        worker.SessionLocal = session_factory
+        worker.llm_adapter = self.SlowLLM()
+        return worker
+
+    def test_events_processed_concurrently(self, worker, session_factory, acked):
+        """Разные лиды обрабатываются параллельно, не больше concurrency одновременно"""
+        notes = [f"bug number {i}" for i in range(8)]
+        events = [
+            (f"{i}-0", self._event(self._add_lead(session_factory, note), note))
+            for i, note in enumerate(notes)
+        ]
+
+        async def scenario():
+            await worker.dispatch(events)
+            await worker.drain()
+
+        asyncio.run(scenario())
+
+        print(f"\n📊 Max in flight: {worker.llm_adapter.max_in_flight}")
+        assert worker.llm_adapter.max_in_flight == 4
+        assert sorted(message_id for [message_id] in acked) == sorted(message_id for message_id, _ in events)
+
+        db = session_factory()
+        assert db.query(InsightDB).count() == 8
+        db.close()
+
+    def test_same_lead_events_keep_order(self, worker, session_factory, acked):
+        """События одного лида не обрабатываются параллельно, дубликат отбрасывается дедупликацией"""
+        lead_id = self._add_lead(session_factory, "first")
+        other_id = self._add_lead(session_factory, "other")
+        events = [
+            ("0-0", self._event(lead_id, "first")),
+            ("1-0", self._event(other_id, "other")),
+            ("2-0", self._event(lead_id, "first")),
+        ]
+
+        async def scenario():
+            await worker.dispatch(events)
+            await worker.drain()
+
+        asyncio.run(scenario())
+
+        assert worker.llm_adapter.calls.count(("start", "first")) == 1
+        assert len(acked) == 3
+
+        db = session_factory()
+        assert db.query(InsightDB).filter(InsightDB.lead_id == lead_id).count() == 1
+        db.close()
+
+
+class TestTriageWorkerReclaim(WorkerTestBase):
+    @pytest.fixture
+    def worker(self, session_factory):
+        module = load_worker_module()
+        worker = module.TriageWorker()
+        worker.SessionLocal = session_factory
+        worker.retry_base_ms = 1000
+        worker.max_deliveries = 4
+        return worker
+
+    def test_retry_delay_grows_exponentially(self, worker):
+        """Задержка повтора удваивается с каждой доставкой"""
+        assert [worker.retry_delay_ms(deliveries) for deliveries in range(1, 5)] == [1000, 2000, 4000, 8000]
+
+    def test_reclaim_respects_backoff_and_dead_letters(self, worker, monkeypatch):
+        """Забираются сообщения с истекшей задержкой, исчерпавшие попытки уходят в dead-letter"""
+        entries = [
+            {"message_id": "1-0", "consumer": "dead-worker", "time_since_delivered": 1500, "times_delivered": 1},
+            {"message_id": "2-0", "consumer": "dead-worker", "time_since_delivered": 1500, "times_delivered": 2},
+            {"message_id": "3-0", "consumer": "other", "time_since_delivered": 4500, "times_delivered": 3},
+            {"message_id": "4-0", "consumer": "other", "time_since_delivered": 99000, "times_delivered": 4},
+        ]
+        calls = {}
+        monkeypatch.setattr(queue, "pending_entries", lambda min_idle_ms, count, start: entries)
+        monkeypatch.setattr(queue, "dead_letter", lambda consumer, ids, min_idle_ms, reason: calls.setdefault("dead", ids) and len(ids))
+        monkeypatch.setattr(queue, "claim_events", lambda consumer, ids, min_idle_ms: calls.setdefault("claim", ids) and [])
+
+        worker.reclaim_pending()
+
+        assert calls == {"dead": ["4-0"], "claim": ["1-0", "3-0"]}
+
+    def test_reclaim_pages_past_entries_in_backoff(self, worker, monkeypatch):
+        """Записи, ждущие задержку в начале PEL, не заслоняют готовые к повтору записи за ними"""
+        from shared.config import config
+        monkeypatch.setattr(config, "WORKER_RECLAIM_COUNT", 2)
+
+        pages = {
+            "-": [
+                {"message_id": "1-0", "consumer": "other", "time_since_delivered": 1500, "times_delivered": 3},
+                {"message_id": "2-0", "consumer": "other", "time_since_delivered": 1500, "times_delivered": 3},
+            ],
+            "(2-0": [
+                {"message_id": "3-0", "consumer": "other", "time_since_delivered": 1500, "times_delivered": 1},
+                {"message_id": "4-0", "consumer": "other", "time_since_delivered": 1500, "times_delivered": 1},
+            ],
+        }
+        starts = []
+        claimed = []
+
+        def pending_entries(min_idle_ms, count, start):
+            starts.append(start)
+            return pages.get(start, [])
+
+        monkeypatch.setattr(queue, "pending_entries", pending_entries)
+        monkeypatch.setattr(queue, "claim_events", lambda consumer, ids, min_idle_ms: claimed.extend(ids) or [])
+
+        worker.reclaim_pending()
+
+        assert starts == ["-", "(2-0"]
+        assert claimed == ["3-0", "4-0"]
+
+    def test_reclaim_skips_own_in_flight_messages(self, worker, monkeypatch):
+        """Сообщения, которые воркер еще обрабатывает, не забираются им же повторно"""
+        entries = [
+            {"message_id": "1-0", "consumer": worker.consumer_name, "time_since_delivered": 1500, "times_delivered": 1},
+            {"message_id": "2-0", "consumer": worker.consumer_name, "time_since_delivered": 1500, "times_delivered": 1},
+        ]
+        claimed = []
+        worker._in_flight.add("1-0")
+        monkeypatch.setattr(queue, "pending_entries", lambda min_idle_ms, count, start: entries)
+        monkeypatch.setattr(queue, "claim_events", lambda consumer, ids, min_idle_ms: claimed.extend(ids) or [])
+
+        worker.reclaim_pending()
+
+        assert claimed == ["2-0"]
+
+    def test_reclaim_against_redis(self, worker, redis_queue):
+        """Поля XPENDING и XCLAIM реального Redis: число доставок, простой и удаленные из стрима сообщения"""
+        events = [self._event(str(uuid.uuid4()), f"note {i}") for i in range(3)]
+        message_ids = [redis_queue.redis.xadd(redis_queue.stream_name, redis_queue._serialize(event)) for event in events]
+        assert len(redis_queue.consume_events("dead-worker", count=3, block=10)) == 3
+        redis_queue.redis.xdel(redis_queue.stream_name, message_ids[1])
+        time.sleep(0.05)
+
+        entries = redis_queue.pending_entries(min_idle_ms=10)
+        assert [(entry["message_id"], entry["consumer"], entry["times_delivered"]) for entry in entries] == [
+            (message_id, "dead-worker", 1) for message_id in message_ids
+        ]
+        assert all(entry["time_since_delivered"] >= 10 for entry in entries)
+
+        worker.retry_base_ms = 10
+        reclaimed = worker.reclaim_pending()
+
+        print(f"\n♻️ Reclaimed: {[message_id for message_id, _ in reclaimed]}")
+        assert [(message_id, event.event_id) for message_id, event in reclaimed] == [
+            (message_ids[0], events[0].event_id), (message_ids[2], events[2].event_id)
+        ]
+        owners = {entry["message_id"]: (entry["consumer"], entry["times_delivered"]) for entry in redis_queue.pending_entries(0)}
+        assert owners[message_ids[0]] == (worker.consumer_name, 2)
+        assert owners[message_ids[2]] == (worker.consumer_name, 2)
@@ -0,0 +1,57 @@
+import argparse
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.message_queue import queue
+
+
+def list_dead_letters(count: int):
+    """Печатает сообщения dead-letter стрима"""
+    entries = queue.read_dead_letters(count=count)
+    if not entries:
+        print(f"Dead-letter stream {queue.dead_letter_stream} is empty")
+        return
+
+    for msg_id, fields in entries:
+        print(
+            f"{msg_id}  lead={fields.get('lead_id')}  event={fields.get('event_id')}  "
+            f"original={fields.get('dead_letter_original_id')}  at={fields.get('dead_letter_at')}  "
+            f"reason={fields.get('dead_letter_reason')}"
+        )
+
+
+def replay_dead_letters(message_ids, replay_all: bool, count: int):
+    """Возвращает сообщения из dead-letter стрима в основной стрим"""
+    if replay_all:
+        message_ids = [msg_id for msg_id, _ in queue.read_dead_letters(count=count)]
+
+    replayed = queue.replay_dead_letters(message_ids)
+    print(f"Replayed {replayed} dead letters to {queue.stream_name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Просмотр и повторная отправка dead-letter сообщений")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="показать сообщения dead-letter стрима")
+    list_parser.add_argument("--count", type=int, default=100)
+
+    replay_parser = subparsers.add_parser("replay", help="вернуть сообщения в основной стрим")
+    replay_parser.add_argument("ids", nargs="*", help="id сообщений dead-letter стрима")
+    replay_parser.add_argument("--all", action="store_true", help="вернуть все сообщения (не больше --count)")
+    replay_parser.add_argument("--count", type=int, default=1000)
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_dead_letters(args.count)
+    elif args.command == "replay":
+        if not args.ids and not args.all:
+            parser.error("replay requires message ids or --all")
+        replay_dead_letters(args.ids, args.all, args.count)
+
+
+if __name__ == "__main__":
+    main()
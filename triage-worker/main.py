@@ -1,6 +1,8 @@
 import asyncio
+import signal
 import sys
 import os
+from typing import Optional
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
@@ -9,14 +11,23 @@ from shared.message_queue import queue
 from worker import TriageWorker
 
 
-async def main():
+async def main(consumer_name: Optional[str] = None, setup: bool = True):
     """Основная функция воркера"""
 
-    init_db()
+    if setup:
+        init_db()
 
-    queue.create_consumer_group()
+        queue.create_consumer_group()
+
+    worker = TriageWorker(consumer_name=consumer_name)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            pass
 
-    worker = TriageWorker()
     await worker.run()
 
 if __name__ == "__main__":
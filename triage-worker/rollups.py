@@ -0,0 +1,31 @@
+import argparse
+import sys
+import os
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.database import init_db
+from shared.rollups import rebuild_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание роллапов статистики анализа")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild", help="пересчитать роллапы по таблице insights")
+    rebuild_parser.add_argument(
+        "--since", type=datetime.fromisoformat,
+        help="пересчитать только интервалы с начала этого дня (ISO дата), по умолчанию все"
+    )
+    rebuild_parser.add_argument("--batch-size", type=int, default=10000, help="сколько инсайтов читать за раз")
+
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        init_db()
+        rebuild_rollups(since=args.since, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.config import config
+from shared.database import engine, init_db
+from shared.message_queue import queue
+
+
+def run_worker_process(consumer_name: str):
+    """Точка входа дочернего процесса"""
+    # Обработчики супервизора наследуются при fork, воркер ставит свои
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Соединения пула, открытые родителем, не должны использоваться в дочернем процессе
+    engine.dispose(close=False)
+
+    from main import main
+
+    try:
+        asyncio.run(main(consumer_name=consumer_name, setup=False))
+    except Exception as e:
+        print(f"Worker {consumer_name} error: {e}")
+        sys.exit(1)
+
+
+class WorkerSupervisor:
+    """Запускает N процессов воркера, перезапускает упавшие и корректно останавливает их по SIGTERM"""
+
+    def __init__(self, processes: Optional[int] = None, name_prefix: Optional[str] = None,
+                 check_interval: float = 1.0, target: Callable[[str], None] = run_worker_process):
+        self.processes = processes or config.WORKER_PROCESSES or os.cpu_count() or 1
+        self.name_prefix = name_prefix or config.WORKER_NAME_PREFIX or socket.gethostname()
+        self.check_interval = check_interval
+        # Функция дочернего процесса, получает имя consumer'а
+        self.target = target
+        self.children: Dict[int, multiprocessing.Process] = {}
+        self.stopping = False
+
+    def consumer_name(self, index: int) -> str:
+        """Стабильное имя consumer'а: перезапущенный процесс продолжает работу под тем же именем"""
+        return f"{self.name_prefix}-worker-{index}"
+
+    def start_child(self, index: int):
+        name = self.consumer_name(index)
+        process = multiprocessing.Process(target=self.target, args=(name,), name=name)
+        process.start()
+        self.children[index] = process
+        print(f"Started worker {name} (pid {process.pid})")
+
+    def stop(self, signum=None, frame=None):
+        if not self.stopping:
+            print("Supervisor stopping, draining workers")
+        self.stopping = True
+
+    def run(self):
+        init_db()
+        queue.create_consumer_group()
+        engine.dispose()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.supervise()
+
+    def supervise(self):
+        """Запускает воркеры и перезапускает упавшие, пока не вызван stop; затем останавливает их"""
+        print(f"Supervisor starting {self.processes} workers")
+        for index in range(self.processes):
+            self.start_child(index)
+
+        while not self.stopping:
+            for index, process in list(self.children.items()):
+                if not process.is_alive() and not self.stopping:
+                    print(f"Worker {process.name} exited with code {process.exitcode}, restarting")
+                    self.start_child(index)
+            time.sleep(self.check_interval)
+
+        self.shutdown()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Отправляет SIGTERM всем воркерам, ждет их завершения и добивает зависшие"""
+        timeout = timeout if timeout is not None else config.WORKER_SHUTDOWN_TIMEOUT
+
+        for process in self.children.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + timeout
+        for process in self.children.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"Worker {process.name} did not stop in {timeout}s, killing")
+                process.kill()
+                process.join()
+
+        print("Supervisor stopped")
+
+
+if __name__ == "__main__":
+    WorkerSupervisor().run()
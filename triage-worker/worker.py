@@ -1,6 +1,9 @@
 import asyncio
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional, Set
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
 
@@ -8,46 +11,301 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from shared.database import engine, LeadDB, InsightDB
+from shared.config import config
+from shared.database import engine, LeadDB, InsightDB, latest_insight_update, update_latest_insights
 from shared.message_queue import queue
-from shared.llm import get_llm_adapter
+from shared.rollups import add_to_rollups
+from shared.llm import adapter_stats, get_llm_adapter
 
 class TriageWorker:
-    def __init__(self):
+    def __init__(self, batch_size: int = None, batch_max_wait_ms: int = None, concurrency: int = None,
+                 consumer_name: str = None):
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
         self.llm_adapter = get_llm_adapter()
-        self.consumer_name = f"worker-{uuid.uuid4().hex[:8]}"
+        self.consumer_name = consumer_name or f"worker-{uuid.uuid4().hex[:8]}"
+        self.batch_size = batch_size or config.WORKER_BATCH_SIZE
+        self.batch_max_wait_ms = batch_max_wait_ms if batch_max_wait_ms is not None else config.WORKER_BATCH_MAX_WAIT_MS
+        self.concurrency = concurrency or config.WORKER_CONCURRENCY
+        
+        # В конкурентном режиме синхронные вызовы SQLAlchemy и redis уходят в пул потоков,
+        # чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(max_workers=config.WORKER_IO_THREADS) if self.concurrency > 1 else None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._lead_tails: Dict[str, asyncio.Task] = {}
+        # Сообщения, которые этот воркер сейчас обрабатывает; reclaim_pending их не забирает
+        self._in_flight: Set[str] = set()
+        self._stopping = False
+        
+        self.retry_base_ms = config.WORKER_RETRY_BASE_MS
+        self.max_deliveries = config.WORKER_MAX_DELIVERIES
+        self._next_reclaim_at = 0.0
+        self._next_stats_at = time.monotonic() + config.WORKER_STATS_INTERVAL
         
     async def run(self):
         """Основной цикл обработки событий"""
         print(f"Worker {self.consumer_name} started")
         
-        while True:
+        while not self._stopping:
             try:
-                events = queue.consume_events(
-                    consumer_name=self.consumer_name,
-                    count=1,
-                    block=1000  
-                )
+                if time.monotonic() >= self._next_stats_at:
+                    self._next_stats_at = time.monotonic() + config.WORKER_STATS_INTERVAL
+                    self.log_stats()
+                
+                if time.monotonic() >= self._next_reclaim_at:
+                    self._next_reclaim_at = time.monotonic() + config.WORKER_RECLAIM_INTERVAL
+                    reclaimed = await self._run_sync(self.reclaim_pending)
+                    if reclaimed:
+                        await self.handle_events(reclaimed)
+                
+                if self.batch_size > 1:
+                    events = self.collect_batch()
+                elif self.concurrency > 1:
+                    events = await self._run_sync(queue.consume_events, self.consumer_name, self.concurrency, 1000)
+                else:
+                    events = queue.consume_events(
+                        consumer_name=self.consumer_name,
+                        count=1,
+                        block=1000  
+                    )
                 
-                for message_id, event in events:
-                    await self.process_event(message_id, event)
+                if events:
+                    await self.handle_events(events)
                     
             except Exception as e:
                 print(f"Error in worker loop: {e}")
                 await asyncio.sleep(1)
+        
+        await self.drain()
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.log_stats()
+        print(f"Worker {self.consumer_name} stopped")
+    
+    def log_stats(self):
+        """Печатает счетчики кеша результатов и бюджета времени LLM адаптера"""
+        stats = adapter_stats(self.llm_adapter)
+        if stats:
+            print(f"Worker {self.consumer_name} LLM stats: {stats}")
+    
+    def stop(self):
+        """Просит воркер завершиться: новые события не читаются, начатые дорабатываются"""
+        if not self._stopping:
+            print(f"Worker {self.consumer_name} draining")
+        self._stopping = True
+    
+    async def handle_events(self, events):
+        """Обрабатывает прочитанные события в настроенном режиме: пачкой, конкурентно или по одному"""
+        if self.batch_size > 1:
+            await self.process_batch(events)
+        elif self.concurrency > 1:
+            await self.dispatch(events)
+        else:
+            for message_id, event in events:
+                await self.process_event(message_id, event)
+    
+    def reclaim_pending(self):
+        """
+        Забирает из PEL группы сообщения, чья задержка повтора истекла, в том числе
+        оставшиеся за упавшими consumer'ами. Задержка растет экспоненциально с числом доставок,
+        сообщения, исчерпавшие WORKER_MAX_DELIVERIES попыток, уходят в dead-letter стрим.
+        """
+        count = config.WORKER_RECLAIM_COUNT
+        to_claim = []
+        to_dead_letter = []
+        start = "-"
+        # Записи, ждущие свою задержку, стоят в начале PEL, поэтому PEL читается страницами,
+        # пока не наберется count готовых к повтору записей
+        while len(to_claim) + len(to_dead_letter) < count:
+            entries = queue.pending_entries(min_idle_ms=self.retry_base_ms, count=count, start=start)
+            for entry in entries:
+                if entry["consumer"] == self.consumer_name and entry["message_id"] in self._in_flight:
+                    continue
+                deliveries = entry["times_delivered"]
+                if deliveries >= self.max_deliveries:
+                    to_dead_letter.append(entry["message_id"])
+                elif entry["time_since_delivered"] >= self.retry_delay_ms(deliveries):
+                    to_claim.append(entry["message_id"])
+            if len(entries) < count:
+                break
+            start = f"({entries[-1]['message_id']}"
+        
+        if to_dead_letter:
+            moved = queue.dead_letter(
+                self.consumer_name,
+                to_dead_letter,
+                self.retry_base_ms,
+                reason=f"exceeded {self.max_deliveries} deliveries"
+            )
+            print(f"Moved {moved} events to dead-letter stream")
+        
+        events = queue.claim_events(self.consumer_name, to_claim, self.retry_base_ms)
+        if events:
+            print(f"Reclaimed {len(events)} pending events")
+        return events
+    
+    def retry_delay_ms(self, deliveries: int) -> int:
+        """Экспоненциальная задержка перед повторной доставкой"""
+        return min(self.retry_base_ms * 2 ** max(deliveries - 1, 0), config.WORKER_RETRY_MAX_MS)
+    
+    async def _run_sync(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def dispatch(self, events):
+        """
+        Запускает обработку событий, держа в работе не больше concurrency событий.
+        События одного лида обрабатываются строго по очереди в порядке чтения из стрима.
+        """
+        for message_id, event in events:
+            await self._slots.acquire()
+            self._in_flight.add(message_id)
+            
+            previous = self._lead_tails.get(event.lead_id)
+            task = asyncio.create_task(self._process_in_order(previous, message_id, event))
+            self._lead_tails[event.lead_id] = task
+            task.add_done_callback(partial(self._forget_tail, event.lead_id))
+    
+    async def drain(self):
+        """Дожидается завершения всех запущенных обработок"""
+        while self._lead_tails:
+            await asyncio.wait(list(self._lead_tails.values()))
+    
+    async def _process_in_order(self, previous: Optional[asyncio.Task], message_id: str, event):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self.process_event(message_id, event)
+        finally:
+            self._in_flight.discard(message_id)
+            self._slots.release()
+    
+    def _forget_tail(self, lead_id: str, task: asyncio.Task):
+        if self._lead_tails.get(lead_id) is task:
+            del self._lead_tails[lead_id]
+    
+    def collect_batch(self):
+        """Читает до batch_size событий, дожидаясь заполнения пачки не дольше batch_max_wait_ms"""
+        events = queue.consume_events(
+            consumer_name=self.consumer_name,
+            count=self.batch_size,
+            block=1000
+        )
+        
+        deadline = time.monotonic() + self.batch_max_wait_ms / 1000
+        while events and len(events) < self.batch_size:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            
+            more = queue.consume_events(
+                consumer_name=self.consumer_name,
+                count=self.batch_size - len(events),
+                block=remaining_ms
+            )
+            if not more:
+                break
+            events.extend(more)
+        
+        return events
+    
+    async def process_batch(self, events):
+        """Обрабатывает пачку событий: два SELECT, одна транзакция и один XACK на всю пачку"""
+        print(f"Processing batch of {len(events)} events")
+        
+        message_ids = [message_id for message_id, _ in events]
+        lead_ids = {event.lead_id for _, event in events}
+        
+        db = self.SessionLocal()
+        fallback_to_single = False
+        try:
+            leads = {
+                lead.id: lead
+                for lead in db.query(LeadDB).filter(LeadDB.id.in_(lead_ids))
+            }
+            existing = {
+                (row.lead_id, row.content_hash)
+                for row in db.query(InsightDB.lead_id, InsightDB.content_hash).filter(InsightDB.lead_id.in_(lead_ids))
+            }
+            
+            pending = {}
+            for _, event in events:
+                key = (event.lead_id, event.content_hash)
+                if event.lead_id not in leads:
+                    print(f"Lead {event.lead_id} not found")
+                elif key in existing or key in pending:
+                    print(f"Insight already exists for lead {event.lead_id} with hash {event.content_hash}")
+                else:
+                    pending[key] = event
+            
+            if pending:
+                to_triage = list(pending.values())
+                payloads = await self.llm_adapter.triage_many(
+                    [leads[event.lead_id].note for event in to_triage],
+                    [{"content_hash": event.content_hash} for event in to_triage]
+                )
+                
+                insights = [
+                    self._build_insight(event, payload)
+                    for event, payload in zip(to_triage, payloads)
+                ]
+                db.add_all(insights)
+                update_latest_insights(db, insights)
+                add_to_rollups(db, [(insight, leads[insight.lead_id].source) for insight in insights])
+                db.commit()
+                
+                print(f"Created {len(to_triage)} insights from batch of {len(events)} events")
+                queue.notify_insights_ready(list({event.lead_id for event in to_triage}))
+            
+            queue.ack_messages(message_ids)
+            
+        except IntegrityError:
+            db.rollback()
+            print("Duplicate insight in batch, falling back to per-event processing")
+            fallback_to_single = True
+            
+        except Exception as e:
+            db.rollback()
+            # Одно проблемное событие не должно возвращать в PEL всю пачку: по одному
+            # обработаются и подтвердятся все события, кроме сбойного
+            print(f"Error processing batch of {len(events)} events, falling back to per-event processing: {e}")
+            fallback_to_single = len(events) > 1
+            
+        finally:
+            db.close()
+        
+        if fallback_to_single:
+            for message_id, event in events:
+                await self.process_event(message_id, event)
+    
+    def _build_insight(self, event, insight_payload) -> InsightDB:
+        return InsightDB.from_payload(event.lead_id, event.content_hash, insight_payload)
     
     async def process_event(self, message_id: str, event):
         """Обрабатывает одно событие"""
         print(f"Processing event {event.event_id} for lead {event.lead_id}")
         
+        try:
+            note = await self._run_sync(self._load_note, message_id, event)
+            if note is None:
+                return
+            
+            insight_payload = await self.llm_adapter.triage(note, {"content_hash": event.content_hash})
+            
+            await self._run_sync(self._store_insight, message_id, event, insight_payload)
+            
+        except Exception as e:
+            print(f"Error processing event {event.event_id}: {e}")
+    
+    def _load_note(self, message_id: str, event) -> Optional[str]:
+        """Возвращает заметку лида; None, если событие не требует анализа (оно уже подтверждено)"""
         db = self.SessionLocal()
         try:
             lead = db.query(LeadDB).filter(LeadDB.id == event.lead_id).first()
             if not lead:
                 print(f"Lead {event.lead_id} not found")
                 queue.ack_message(message_id)
-                return
+                return None
             
             existing_insight = db.query(InsightDB).filter(
                 InsightDB.lead_id == event.lead_id,
@@ -57,37 +315,37 @@ class TriageWorker:
             if existing_insight:
                 print(f"Insight already exists for lead {event.lead_id} with hash {event.content_hash}")
                 queue.ack_message(message_id)
-                return
+                return None
             
-            insight_payload = await self.llm_adapter.triage(lead.note)
-            
-            insight = InsightDB(
-                id=str(uuid.uuid4()),
-                lead_id=event.lead_id,
-                intent=insight_payload.intent,
-                priority=insight_payload.priority,
-                next_action=insight_payload.next_action,
-                confidence=insight_payload.confidence,
-                tags=",".join(insight_payload.tags) if insight_payload.tags else None,
-                content_hash=event.content_hash,
-                created_at=datetime.utcnow()
-            )
+            return lead.note
+            
+        finally:
+            db.close()
+    
+    def _store_insight(self, message_id: str, event, insight_payload):
+        db = self.SessionLocal()
+        try:
+            insight = self._build_insight(event, insight_payload)
             
             db.add(insight)
+            db.execute(latest_insight_update(insight))
+            source = db.query(LeadDB.source).filter(LeadDB.id == event.lead_id).scalar()
+            add_to_rollups(db, [(insight, source)])
             db.commit()
             
             print(f"Created insight {insight.id} for lead {event.lead_id}")
             
             queue.ack_message(message_id)
+            queue.notify_insights_ready([event.lead_id])
             
         except IntegrityError:
             db.rollback()
             print(f"Duplicate insight for lead {event.lead_id}, skipping")
             queue.ack_message(message_id)
             
-        except Exception as e:
+        except Exception:
             db.rollback()
-            print(f"Error processing event {event.event_id}: {e}")
+            raise
             
         finally:
             db.close()
\ No newline at end of file